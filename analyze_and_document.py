@@ -1,61 +1,686 @@
 import os
 import base64
-import openai
-import dotenv
-import subprocess
-import sys
+import argparse
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-dotenv.load_dotenv()
+from PIL import Image
 
-# Set up your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+import atomic_write
+import description_cache
+import image_preprocess
+import layout_regions
+import metrics
+import phash_index
+import rate_limiter
+import run_store
 
-def analyze_screenshot(image_path):
-    """Analyzes a single screenshot using OpenAI's Vision API."""
-    try:
-        print(f"Analyzing {image_path}")
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
-        
-        # Determine image format from file extension
-        file_ext = os.path.splitext(image_path)[1].lower()
-        if file_ext == '.png':
-            mime_type = "image/png"
-        elif file_ext in ['.jpg', '.jpeg']:
-            mime_type = "image/jpeg"
-        else:
-            mime_type = "image/jpeg"  # default fallback
+MODEL = "gpt-4o"
+MAX_TOKENS = 500
+
+_openai = None
+_vision_client = None
 
-        prompt = """
+def load_openai():
+    """Imports the OpenAI SDK on first use, after loading .env and the API key,
+    so runs that only build the report never pay for the import."""
+    global _openai
+    if _openai is None:
+        import dotenv
+        import openai
+
+        dotenv.load_dotenv()
+        # Set up your OpenAI API key
+        openai.api_key = openai.api_key or os.getenv("OPENAI_API_KEY")
+        _openai = openai
+    return _openai
+
+def vision_client():
+    """Returns the client used for screenshot analysis. Its built-in retries are
+    turned off because rate_limiter.RateLimiter retries with its own backoff."""
+    global _vision_client
+    if _vision_client is None:
+        openai = load_openai()
+        _vision_client = openai.OpenAI(api_key=openai.api_key, base_url=openai.base_url, max_retries=0)
+    return _vision_client
+
+PROMPT = """
         You are a helpful assistant that documents web applications.
         You are given a screenshot of a web application and you need to describe the content of the screenshot.
         You need to describe the content of the screenshot, including key elements, text, and overall layout.
         Be concise but informative.
         """
-        prompt += f"""
+
+LAYOUT_PROMPT = """
+        You are a helpful assistant that documents web applications.
+        You are given a screenshot of the layout shared by every page of a web application; the
+        page-specific content area is greyed out. Describe the shared elements such as the header,
+        navigation, sidebar and footer, what each of them contains and what it is used for.
+        Be concise but informative.
+        """
+
+CROPPED_NOTE = """
+        The application's shared header, navigation and footer are documented separately and have
+        been cropped out of this screenshot; describe only the page-specific content shown.
+        """
+
+def is_layout_image(image_path):
+    return os.path.basename(image_path) == layout_regions.LAYOUT_IMAGE
+
+def build_prompt(image_path, crop=None):
+    """Returns the prompt text sent along with a screenshot."""
+    if is_layout_image(image_path):
+        return LAYOUT_PROMPT + f"""
+        Screenshot: {image_path}
+        """
+    return PROMPT + (CROPPED_NOTE if crop else "") + f"""
         Screenshot: {image_path}
         """
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}},
-                    ],
-                }
-            ],
-            max_tokens=500
-        )
-        return response.choices[0].message.content
+
+def read_screenshot(image_path, crop=None):
+    """Reads a screenshot's bytes, cropped to the page content if crop margins are given."""
+    with open(image_path, "rb") as image_file:
+        image_bytes = image_file.read()
+    if crop and not is_layout_image(image_path):
+        image_bytes = layout_regions.crop_image(image_bytes, crop)
+    return image_bytes
+
+def image_part(image_path, image_bytes, image_options=image_preprocess.DEFAULT_OPTIONS):
+    """Builds the image_url content part for one screenshot.
+
+    image_options control the downscaling/re-encoding done before upload (see
+    image_preprocess.prepare_image) plus the optional "detail" hint; pass
+    None to upload the image as-is.
+    """
+    options = dict(image_options or {})
+    detail = options.pop("detail", None)
+    with metrics.timer("prepare", os.path.basename(image_path), bytes=len(image_bytes)) as measured:
+        if image_options:
+            upload_bytes, mime_type = image_preprocess.prepare_image(image_bytes, **options)
+            saved = len(image_bytes) - len(upload_bytes)
+            print(f"Prepared {image_path}: {len(image_bytes)} -> {len(upload_bytes)} bytes ({saved} saved)")
+        else:
+            upload_bytes = image_bytes
+            mime_type = image_preprocess.sniff_mime_type(image_bytes) or "image/jpeg"
+        measured["upload_bytes"] = len(upload_bytes)
+    base64_image = base64.b64encode(upload_bytes).decode("utf-8")
+    # Drop the intermediate buffer early to keep peak memory down
+    del upload_bytes
+
+    image_url = {"url": f"data:{mime_type};base64,{base64_image}"}
+    if detail:
+        image_url["detail"] = detail
+    return {"type": "image_url", "image_url": image_url}
+
+def build_request(image_path, image_bytes, image_options=image_preprocess.DEFAULT_OPTIONS, crop=None):
+    """Builds the chat.completions request body for one screenshot.
+
+    image_options are passed on to image_part. crop tells the prompt that
+    image_bytes only show the page content.
+    """
+    return {
+        "model": MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": build_prompt(image_path, crop)},
+                    image_part(image_path, image_bytes, image_options),
+                ],
+            }
+        ],
+        "max_tokens": MAX_TOKENS,
+    }
+
+def request_fingerprint(image_path, image_options=image_preprocess.DEFAULT_OPTIONS, crop=None, grouped=False):
+    """Hashes the settings besides the image that shape a description: prompt, model,
+    max_tokens, image options and crop. Reused descriptions must match it."""
+    prompt = GROUP_PROMPT + (CROPPED_NOTE if crop else "") if grouped else build_prompt(image_path, crop)
+    settings = {"prompt": prompt, "model": MODEL, "max_tokens": MAX_TOKENS, "image_options": image_options,
+                "crop": list(crop) if crop else None}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+def description_cache_key(image_path, image_bytes, image_options=image_preprocess.DEFAULT_OPTIONS, crop=None,
+                          grouped=False):
+    """Cache key of a screenshot's description. Descriptions written for a grouped
+    request were made with GROUP_PROMPT, so they are keyed apart from single ones."""
+    extra = {"image_options": image_options, "crop": list(crop)} if crop else image_options
+    if grouped:
+        prompt = GROUP_PROMPT + (CROPPED_NOTE if crop else "")
+        extra = {"extra": extra, "grouped": True}
+    else:
+        prompt = build_prompt(image_path, crop)
+    return description_cache.cache_key(image_bytes, prompt, MODEL, MAX_TOKENS, extra=extra)
+
+def record_usage(measured, usage, batch=False):
+    """Adds the token counts of a response's usage and their estimated cost to a metrics record."""
+    if not usage:
+        return
+    if not isinstance(usage, dict):
+        usage = {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    measured.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                    cost=metrics.estimate_cost(MODEL, prompt_tokens, completion_tokens, batch=batch))
+
+def analyze_screenshot(image_path, cache_dir=description_cache.DEFAULT_CACHE_DIR,
+                       image_options=image_preprocess.DEFAULT_OPTIONS, limiter=None, crop=None,
+                       cache_max_age=description_cache.DEFAULT_MAX_AGE_DAYS):
+    """Analyzes a single screenshot using OpenAI's Vision API.
+
+    Descriptions are cached in cache_dir by image content, prompt, model and
+    max_tokens, and used for cache_max_age days; pass cache_dir=None to
+    always call the API. image_options are
+    passed on to build_request. The call goes through limiter (a
+    rate_limiter.RateLimiter shared by concurrent callers), which retries
+    rate-limited and failed requests. With crop margins (see
+    layout_regions.detect_layout) only the page content is sent. API latency,
+    tokens and cost are recorded in metrics under the "analyze" stage.
+    """
+    try:
+        image_bytes = read_screenshot(image_path, crop)
+
+        key = None
+        if cache_dir:
+            key = description_cache_key(image_path, image_bytes, image_options, crop)
+            cached = description_cache.load_description(key, cache_dir, cache_max_age)
+            if cached is not None:
+                print(f"Using cached description for {image_path}")
+                metrics.record("analyze", os.path.basename(image_path), cached=True)
+                return cached
+
+        print(f"Analyzing {image_path}")
+        request = build_request(image_path, image_bytes, image_options, crop)
+        del image_bytes
+        if limiter is None:
+            limiter = rate_limiter.RateLimiter(max_concurrency=1)
+        with metrics.timer("analyze", os.path.basename(image_path)) as measured:
+            response = limiter.call(lambda: vision_client().chat.completions.with_raw_response.create(**request),
+                                    stats=measured, max_tokens=MAX_TOKENS)
+            record_usage(measured, getattr(response, "usage", None))
+        description = response.choices[0].message.content
+        if key:
+            description_cache.store_description(key, description, cache_dir)
+        return description
     except Exception as e:
         return f"Error analyzing {image_path}: {e}"
 
-def get_screenshot_descriptions(screenshot_folder="screenshots"):
-    """Crawls a folder of screenshots and returns a list of descriptions."""
+BATCH_FILE = "batch_requests.jsonl"
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_POLL_INTERVAL = 30
+BATCH_DONE_STATUSES = ("completed", "failed", "expired", "cancelled")
+# The Batch API accepts at most 50,000 requests and 200 MB per input file;
+# larger sets are split over several files and batches
+BATCH_MAX_REQUESTS = 50000
+BATCH_MAX_BYTES = 190 * 1024 * 1024
+
+def batch_file_name(batch_file, part):
+    """batch_requests.jsonl for the first part, then batch_requests.1.jsonl, batch_requests.2.jsonl, ..."""
+    if not part:
+        return batch_file
+    stem, extension = os.path.splitext(batch_file)
+    return f"{stem}.{part}{extension}"
+
+def write_batch_files(image_paths, batch_file=BATCH_FILE, image_options=image_preprocess.DEFAULT_OPTIONS, crop=None,
+                      max_requests=BATCH_MAX_REQUESTS, max_bytes=BATCH_MAX_BYTES):
+    """Writes one Batch API request line per screenshot, starting a new file whenever
+    the next line would pass max_requests or max_bytes. The custom_id is the image
+    path. Returns the files written."""
+    batch_files = []
+    f = None
+    try:
+        for image_path in image_paths:
+            request = build_request(image_path, read_screenshot(image_path, crop), image_options, crop)
+            line = (json.dumps({
+                "custom_id": image_path,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": request,
+            }) + "\n").encode("utf-8")
+            if f is None or count >= max_requests or size + len(line) > max_bytes:
+                if f is not None:
+                    f.close()
+                batch_files.append(batch_file_name(batch_file, len(batch_files)))
+                f = open(batch_files[-1], "wb")
+                count = size = 0
+            f.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if f is not None:
+            f.close()
+    print(f"Wrote {len(image_paths)} requests to {', '.join(batch_files)}")
+    return batch_files
+
+def submit_batch(batch_file=BATCH_FILE, client=None):
+    """Uploads a request file and starts a batch. Returns the batch id."""
+    client = client or load_openai()
+    with open(batch_file, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+    print(f"Submitted batch {batch.id}")
+    return batch.id
+
+def wait_for_batch(batch_id, client=None, poll_interval=BATCH_POLL_INTERVAL, timeout=None):
+    """Polls a batch until it reaches a final status and returns it."""
+    client = client or load_openai()
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts:
+            print(f"Batch {batch_id}: {batch.status} ({counts.completed}/{counts.total} done, {counts.failed} failed)")
+        else:
+            print(f"Batch {batch_id}: {batch.status}")
+        if batch.status in BATCH_DONE_STATUSES:
+            return batch
+        if deadline and time.monotonic() > deadline:
+            raise TimeoutError(f"Batch {batch_id} still {batch.status} after {timeout} s")
+        time.sleep(poll_interval)
+
+def read_batch_results(batch, client=None):
+    """Returns {custom_id: description or "Error analyzing ..." string} for a finished batch."""
+    client = client or load_openai()
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            image_path = item["custom_id"]
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                error = item.get("error") or response.get("body", {}).get("error")
+                results[image_path] = f"Error analyzing {image_path}: {error}"
+                metrics.record("analyze", os.path.basename(image_path), batch=True, error="BatchError")
+            else:
+                results[image_path] = response["body"]["choices"][0]["message"]["content"]
+                measured = {"batch": True}
+                record_usage(measured, response["body"].get("usage"), batch=True)
+                metrics.record("analyze", os.path.basename(image_path), **measured)
+    return results
+
+def analyze_in_batch(image_paths, cache_dir=description_cache.DEFAULT_CACHE_DIR,
+                     image_options=image_preprocess.DEFAULT_OPTIONS, client=None,
+                     batch_file=BATCH_FILE, batch_id=None, poll_interval=BATCH_POLL_INTERVAL, crop=None,
+                     cache_max_age=description_cache.DEFAULT_MAX_AGE_DAYS):
+    """Analyzes screenshots through the OpenAI Batch API instead of one call each.
+
+    Cached descriptions are used as-is and only the rest are submitted, in as
+    many batches as the Batch API's per-file limits require. Pass the
+    batch_id of an earlier submission (several comma-separated, or a list)
+    to resume polling them instead of submitting again. Returns
+    {image_path: description}.
+    """
+    descriptions = {}
+    keys = {}
+    pending = []
+    for image_path in image_paths:
+        if cache_dir:
+            keys[image_path] = description_cache_key(image_path, read_screenshot(image_path, crop), image_options,
+                                                     crop)
+            cached = description_cache.load_description(keys[image_path], cache_dir, cache_max_age)
+            if cached is not None:
+                print(f"Using cached description for {image_path}")
+                metrics.record("analyze", os.path.basename(image_path), cached=True)
+                descriptions[image_path] = cached
+                continue
+        pending.append(image_path)
+
+    if not pending:
+        return descriptions
+
+    batch_ids = batch_id.split(",") if isinstance(batch_id, str) else list(batch_id or [])
+    missing = "no result in the batches"
+    if not batch_ids:
+        try:
+            for part in write_batch_files(pending, batch_file, image_options, crop):
+                batch_ids.append(submit_batch(part, client))
+        except Exception as e:
+            missing = f"not submitted: {e}"
+        if len(batch_ids) > 1:
+            print(f"Submitted {len(batch_ids)} batches; resume with --batch-id {','.join(batch_ids)}")
+
+    # The batches run side by side; wait for each in turn and merge their results
+    results = {}
+    for batch_id in batch_ids:
+        try:
+            results.update(read_batch_results(wait_for_batch(batch_id, client, poll_interval), client))
+        except Exception as e:
+            print(f"Batch {batch_id} failed: {e}")
+            missing = f"batch {batch_id} failed: {e}" if len(batch_ids) == 1 else missing
+
+    for image_path in pending:
+        description = results.get(image_path, f"Error analyzing {image_path}: {missing}")
+        if cache_dir and not is_error_description(description):
+            description_cache.store_description(keys[image_path], description, cache_dir)
+        descriptions[image_path] = description
+    return descriptions
+
+def is_error_description(description):
+    return description.startswith("Error analyzing ")
+
+GROUP_SIZE = 8
+# Images, prompt and MAX_TOKENS of output per image must fit in one request under this
+GROUP_TOKEN_LIMIT = 16000
+GROUP_PROMPT_TOKENS = 200
+
+GROUP_PROMPT = """
+        You are a helpful assistant that documents web applications.
+        You are given several screenshots of a web application, each preceded by its file name.
+        For each screenshot, describe its content, including key elements, text, and overall layout.
+        Be concise but informative.
+        Answer with a JSON object that maps each file name to its description, for example
+        {"users.png": "The page shows ..."}, with exactly one entry per screenshot.
+        """
+
+def estimate_image_tokens(image_path, image_options=image_preprocess.DEFAULT_OPTIONS, crop=None):
+    """Estimates a screenshot's prompt tokens as uploaded, from its dimensions alone."""
+    with Image.open(image_path) as image:
+        size = image.size
+    if crop and not is_layout_image(image_path):
+        box = layout_regions.content_box(size, crop)
+        if box:
+            size = (box[2] - box[0], box[3] - box[1])
+    options = image_options or {}
+    if image_options:
+        size = image_preprocess.fitted_size(size, options["max_width"], options["max_height"])
+    return image_preprocess.estimate_tokens(size, options.get("detail"))
+
+def plan_groups(image_paths, tokens, group_size=GROUP_SIZE, token_limit=GROUP_TOKEN_LIMIT):
+    """Packs screenshots, in order, into groups of at most group_size.
+
+    A group's prompt, images (tokens maps each path to its estimate) and
+    MAX_TOKENS of output per image stay under token_limit, so K shrinks for
+    large screenshots. The layout image has a prompt of its own and always
+    goes alone.
+    """
+    groups = []
+    current = []
+    used = GROUP_PROMPT_TOKENS
+    for image_path in image_paths:
+        if is_layout_image(image_path):
+            groups.append([image_path])
+            continue
+        needed = tokens[image_path] + MAX_TOKENS
+        if current and (len(current) >= group_size or used + needed > token_limit):
+            groups.append(current)
+            current = []
+            used = GROUP_PROMPT_TOKENS
+        current.append(image_path)
+        used += needed
+    if current:
+        groups.append(current)
+    return groups
+
+def build_group_request(image_paths, parts, crop=None):
+    """Builds one chat.completions request describing several screenshots.
+
+    parts maps each path to its image_part. The answer is requested as a
+    JSON object keyed by file name, with MAX_TOKENS of output per image.
+    """
+    content = [{"type": "text", "text": GROUP_PROMPT + (CROPPED_NOTE if crop else "")}]
+    for image_path in image_paths:
+        content.append({"type": "text", "text": f"Screenshot: {os.path.basename(image_path)}"})
+        content.append(parts[image_path])
+    return {
+        "model": MODEL,
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": MAX_TOKENS * len(image_paths),
+        "response_format": {"type": "json_object"},
+    }
+
+def parse_group_response(content, names):
+    """Returns {file name: description} for the names a grouped response describes.
+
+    Anything that isn't a JSON object of non-empty strings is ignored, so
+    missing or malformed entries are simply absent from the result.
+    """
+    text = (content or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    try:
+        answer = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(answer, dict):
+        return {}
+    return {name: answer[name].strip() for name in names
+            if isinstance(answer.get(name), str) and answer[name].strip()}
+
+def analyze_group(image_paths, cache_dir=description_cache.DEFAULT_CACHE_DIR,
+                  image_options=image_preprocess.DEFAULT_OPTIONS, limiter=None, crop=None,
+                  cache_max_age=description_cache.DEFAULT_MAX_AGE_DAYS):
+    """Analyzes several uncached screenshots in one Vision API request.
+
+    Screenshots the response doesn't describe (the request failed, the JSON
+    didn't parse or an entry is missing) fall back to analyze_screenshot.
+    Returns {image_path: description}.
+    """
+    if len(image_paths) == 1:
+        return {image_paths[0]: analyze_screenshot(image_paths[0], cache_dir, image_options, limiter, crop,
+                                                   cache_max_age)}
+    if limiter is None:
+        limiter = rate_limiter.RateLimiter(max_concurrency=1)
+
+    names = {os.path.basename(image_path): image_path for image_path in image_paths}
+    results = {}
+    try:
+        parts = {}
+        for image_path in image_paths:
+            parts[image_path] = image_part(image_path, read_screenshot(image_path, crop), image_options)
+        request = build_group_request(image_paths, parts, crop)
+        del parts
+        print(f"Analyzing {len(image_paths)} screenshots in one request: {', '.join(names)}")
+        with metrics.timer("analyze", ", ".join(names), images=len(image_paths)) as measured:
+            response = limiter.call(lambda: vision_client().chat.completions.with_raw_response.create(**request),
+                                    stats=measured, max_tokens=request["max_tokens"])
+            record_usage(measured, getattr(response, "usage", None))
+        results = parse_group_response(response.choices[0].message.content, names)
+        if len(results) < len(names):
+            print(f"Grouped response described {len(results)} of {len(names)} screenshots, "
+                  f"analyzing the rest one at a time")
+    except Exception as e:
+        print(f"Grouped request failed ({e}), analyzing one at a time")
+
+    descriptions = {}
+    for name, image_path in names.items():
+        if name in results:
+            descriptions[image_path] = results[name]
+            if cache_dir:
+                key = description_cache_key(image_path, read_screenshot(image_path, crop), image_options, crop,
+                                            grouped=True)
+                description_cache.store_description(key, results[name], cache_dir)
+        else:
+            descriptions[image_path] = analyze_screenshot(image_path, cache_dir, image_options, limiter, crop,
+                                                          cache_max_age)
+    return descriptions
+
+def analyze_in_groups(image_paths, max_workers=1, group_size=GROUP_SIZE, token_limit=GROUP_TOKEN_LIMIT,
+                      cache_dir=description_cache.DEFAULT_CACHE_DIR, image_options=image_preprocess.DEFAULT_OPTIONS,
+                      limiter=None, crop=None, on_result=None, cache_max_age=description_cache.DEFAULT_MAX_AGE_DAYS):
+    """Analyzes screenshots group_size at a time, sharing one prompt and round trip per group.
+
+    Cached descriptions are used as-is; the rest are packed by plan_groups
+    and the groups run on max_workers threads. Descriptions are cached per
+    screenshot. A grouped run uses descriptions cached by single runs too,
+    but its own are cached under a grouped key (see description_cache_key),
+    so single runs never pick them up. on_result, if
+    given, is called with (image_path, description) as each group finishes.
+    Returns {image_path: description}.
+    """
+    descriptions = {}
+    pending = []
+    for image_path in image_paths:
+        if cache_dir:
+            try:
+                image_bytes = read_screenshot(image_path, crop)
+                keys = [description_cache_key(image_path, image_bytes, image_options, crop, grouped)
+                        for grouped in (False, True)]
+            except Exception as e:
+                descriptions[image_path] = f"Error analyzing {image_path}: {e}"
+                continue
+            cached = None
+            for key in keys:
+                cached = description_cache.load_description(key, cache_dir, cache_max_age)
+                if cached is not None:
+                    break
+            if cached is not None:
+                print(f"Using cached description for {image_path}")
+                metrics.record("analyze", os.path.basename(image_path), cached=True)
+                descriptions[image_path] = cached
+                if on_result:
+                    on_result(image_path, cached)
+                continue
+        pending.append(image_path)
+
+    tokens = {}
+    for image_path in pending:
+        try:
+            tokens[image_path] = estimate_image_tokens(image_path, image_options, crop)
+        except Exception:
+            tokens[image_path] = rate_limiter.DEFAULT_TOKEN_ESTIMATE - MAX_TOKENS
+    groups = plan_groups(pending, tokens, group_size, token_limit)
+    if groups:
+        print(f"Analyzing {len(pending)} screenshots in {len(groups)} requests")
+
+    def analyze(group):
+        results = analyze_group(group, cache_dir, image_options, limiter, crop, cache_max_age)
+        if on_result:
+            for image_path, description in results.items():
+                on_result(image_path, description)
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for results in executor.map(analyze, groups):
+            descriptions.update(results)
+    return {image_path: descriptions[image_path] for image_path in image_paths}
+
+def find_reusable(screenshot_folder, filenames, previous_index, phash_threshold,
+                  image_options=image_preprocess.DEFAULT_OPTIONS, crop=None, grouped=False):
+    """Hashes screenshots and finds those whose description in previous_index can be reused:
+    they look the same (within phash_threshold bits) and were described with the same settings.
+
+    Returns ({filename: reused description}, {filename: hash}, {filename: request fingerprint}).
+    """
+    reused = {}
+    hashes = {}
+    fingerprints = {}
+    for filename in filenames:
+        image_path = os.path.join(screenshot_folder, filename)
+        try:
+            hashes[filename] = phash_index.dhash(image_path)
+        except Exception as e:
+            print(f"Could not hash {filename}: {e}")
+            continue
+        # A description made with another prompt, model or crop can't stand in for this one
+        fingerprints[filename] = request_fingerprint(image_path, image_options, crop, grouped)
+        entry = previous_index.get(filename)
+        if phash_index.is_visually_same(entry, hashes[filename], phash_threshold, fingerprints[filename]):
+            reused[filename] = entry["description"]
+            print(f"Reusing description for {filename} (visually unchanged)")
+    return reused, hashes, fingerprints
+
+def find_resumable(store, run_id, screenshot_folder, filenames, finished=None):
+    """{filename: description} for the screenshots run run_id already finished, if
+    they haven't changed since. finished is store.finished_pages(run_id), if already read."""
+    if finished is None:
+        finished = store.finished_pages(run_id)
+    resumed = {}
+    for filename in filenames:
+        entry = finished.get(filename)
+        if entry and entry["image_sha256"] == run_store.file_sha256(os.path.join(screenshot_folder, filename)):
+            resumed[filename] = entry["description"]
+    return resumed
+
+def record_page(store, run_id, image_path, description, source="analyzed"):
+    """Records a page's result in the run store, with the metrics of its analysis if it was analyzed."""
+    measured = (metrics.latest("analyze", os.path.basename(image_path)) or {}) if source == "analyzed" else {}
+    if measured.get("cached"):
+        source = "cached"
+    store.record_page(run_id, image_path, description,
+                      status="error" if is_error_description(description) else "done", source=source,
+                      **{name: measured.get(name)
+                         for name in ("seconds", "prompt_tokens", "completion_tokens", "cost")})
+
+# describe_page runs in worker threads (pipeline.py, watch.py) that share one summary
+_summary_lock = threading.Lock()
+
+def describe_page(image_path, phash_threshold=None, previous_index=None, index=None, store=None, run_id=None,
+                  finished=None, summary=None, **analyze_options):
+    """Describes one screenshot the way get_screenshot_descriptions would, for callers
+    that handle pages one at a time as they arrive (pipeline.py, watch.py).
+
+    With a phash_threshold, a page that looks the same as in previous_index
+    reuses its description, and its entry for the next run is put in index.
+    With a store, a page run run_id already finished (finished is
+    store.finished_pages(run_id)) is resumed and any other page is recorded.
+    The matching count in summary is incremented. Extra keyword arguments are
+    passed on to analyze_screenshot.
+    """
+    folder, filename = os.path.split(image_path)
+    source = "analyzed"
+    hashes = {}
+    if phash_threshold is not None:
+        reused, hashes, fingerprints = find_reusable(
+            folder, [filename], previous_index or {}, phash_threshold,
+            analyze_options.get("image_options", image_preprocess.DEFAULT_OPTIONS), analyze_options.get("crop"))
+        if filename in reused:
+            index[filename] = previous_index[filename]
+            description = reused[filename]
+            source = "reused"
+    if source == "analyzed" and store is not None:
+        resumed = find_resumable(store, run_id, folder, [filename], finished)
+        if filename in resumed:
+            print(f"Resuming {filename} (already done in run {run_id})")
+            description = resumed[filename]
+            source = "resumed"
+    if source == "analyzed":
+        description = analyze_screenshot(image_path, **analyze_options)
+        print(f"Analyzed {image_path}")
+        if filename in hashes and not is_error_description(description):
+            index[filename] = {"hash": hashes[filename], "description": description,
+                               "fingerprint": fingerprints[filename]}
+    if store is not None and source != "resumed":
+        record_page(store, run_id, image_path, description, source)
+    if summary is not None:
+        with _summary_lock:
+            summary[source] = summary.get(source, 0) + 1
+    return description
+
+def get_screenshot_descriptions(screenshot_folder="screenshots", max_workers=1, phash_threshold=None,
+                                summary=None, batch=None, shared_layout=False, group_size=None,
+                                group_tokens=GROUP_TOKEN_LIMIT, store=None, run_id=None, **analyze_options):
+    """Crawls a folder of screenshots and returns a list of descriptions.
+
+    With max_workers > 1 the screenshots are analyzed concurrently on a thread
+    pool of that size. Results are always returned in sorted filename order.
+    With a phash_threshold, screenshots whose perceptual hash is within that
+    many bits of the previous run's reuse the previous description, if it was
+    made with the same prompt, model and image settings. If a
+    summary dict is passed it is filled with analyzed/resumed/reused/removed counts.
+    If batch is a dict, the screenshots are sent through the Batch API with
+    those extra arguments to analyze_in_batch (e.g. {"batch_id": ...}).
+    Otherwise all calls share one rate limiter (pass limiter= to configure
+    it). With shared_layout, the header, sidebar and footer common to all
+    screenshots are described once as 00_common_layout.png (its chapter sorts first) and
+    only each page's content area is sent for the pages themselves. With a
+    group_size above 1, up to that many screenshots share each request (see
+    analyze_in_groups), fewer where they would exceed group_tokens. With a
+    store (a run_store.RunStore), each page is recorded in run run_id
+    as soon as it is done, and pages that run already finished are not
+    analyzed again as long as their screenshot is unchanged.
+    Extra keyword arguments are passed on to analyze_screenshot.
+    """
     print(f"Getting screenshot descriptions from {screenshot_folder}")
     descriptions = {}
+    if summary is not None:
+        summary.update(analyzed=0, resumed=0, reused=0, removed=0)
     
     # Check if screenshots folder exists
     if not os.path.exists(screenshot_folder):
@@ -63,68 +688,259 @@ def get_screenshot_descriptions(screenshot_folder="screenshots"):
         return descriptions
     
     # Check if folder is empty
-    files = os.listdir(screenshot_folder)
+    files = sorted(os.listdir(screenshot_folder))
     if not files:
         print(f"Warning: Screenshots folder '{screenshot_folder}' is empty!")
         return descriptions
     
+    image_files = []
     for filename in files:
+        if filename == layout_regions.LAYOUT_IMAGE:
+            continue  # generated below from the other screenshots
         if filename.endswith(('.png', '.jpg', '.jpeg')):
-            image_path = os.path.join(screenshot_folder, filename)
-            description = analyze_screenshot(image_path)
-            descriptions[filename] = description
-            print(f"Analyzed {filename}")
+            image_files.append(filename)
         else:
             print(f"Skipping {filename} (not an image file)")
     
+    # Describe the page chrome once and send only each page's content area
+    layout = None
+    if shared_layout:
+        layout = layout_regions.detect_layout([os.path.join(screenshot_folder, filename) for filename in image_files])
+        if layout:
+            layout_regions.write_layout_image(os.path.join(screenshot_folder, image_files[0]), layout,
+                                              os.path.join(screenshot_folder, layout_regions.LAYOUT_IMAGE))
+            left, top, right, bottom = layout
+            print(f"Found shared layout: header {top}px, footer {bottom}px, left {left}px, right {right}px")
+            analyze_options["crop"] = layout
+        else:
+            print("No layout shared by the screenshots found, sending whole pages")
+    crop = list(layout) if layout else None
+    
+    # Reuse descriptions of pages that look the same as in the previous run
+    reused = {}
+    hashes = {}
+    fingerprints = {}
+    previous_index = {}
+    if phash_threshold is not None:
+        previous_index = phash_index.load_index(screenshot_folder)
+        reused, hashes, fingerprints = find_reusable(
+            screenshot_folder, image_files, previous_index, phash_threshold,
+            analyze_options.get("image_options", image_preprocess.DEFAULT_OPTIONS), crop,
+            grouped=bool(batch is None and group_size and group_size > 1))
+    to_analyze = [filename for filename in image_files if filename not in reused]
+    if layout:
+        to_analyze.insert(0, layout_regions.LAYOUT_IMAGE)
+    
+    def store_result(filename, description, source="analyzed"):
+        if store is not None:
+            record_page(store, run_id, os.path.join(screenshot_folder, filename), description, source)
+    
+    # Pick up where an interrupted run left off
+    resumed = {}
+    if store is not None:
+        resumed = find_resumable(store, run_id, screenshot_folder, to_analyze)
+        if resumed:
+            print(f"Resuming run {run_id}: {len(resumed)} pages already done")
+            to_analyze = [filename for filename in to_analyze if filename not in resumed]
+        for filename in reused:
+            store_result(filename, reused[filename], source="reused")
+    
+    limiter = analyze_options.pop("limiter", None) or rate_limiter.RateLimiter(max_concurrency=max_workers)
+    
+    def analyze(filename):
+        description = analyze_screenshot(os.path.join(screenshot_folder, filename), limiter=limiter,
+                                         **analyze_options)
+        store_result(filename, description)
+        print(f"Analyzed {filename}")
+        return description
+    
+    analyzed = {}
+    if batch is not None and to_analyze:
+        image_paths = [os.path.join(screenshot_folder, filename) for filename in to_analyze]
+        results = analyze_in_batch(image_paths, **analyze_options, **batch)
+        for filename, image_path in zip(to_analyze, image_paths):
+            analyzed[filename] = results[image_path]
+            store_result(filename, analyzed[filename])
+    elif group_size and group_size > 1 and to_analyze:
+        image_paths = [os.path.join(screenshot_folder, filename) for filename in to_analyze]
+        results = analyze_in_groups(image_paths, max_workers, group_size, group_tokens, limiter=limiter,
+                                    on_result=lambda image_path, description: store_result(
+                                        os.path.basename(image_path), description, source="grouped"),
+                                    **analyze_options)
+        for filename, image_path in zip(to_analyze, image_paths):
+            analyzed[filename] = results[image_path]
+    elif max_workers > 1 and len(to_analyze) > 1:
+        print(f"Analyzing {len(to_analyze)} screenshots with {max_workers} workers")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map() yields results in submission order, not completion order
+            results = executor.map(analyze, to_analyze)
+            for filename, description in zip(to_analyze, results):
+                analyzed[filename] = description
+    else:
+        for filename in to_analyze:
+            analyzed[filename] = analyze(filename)
+    
+    if limiter.stats["retries"] or limiter.stats["failed"]:
+        print(f"Rate limiter: {limiter.stats['requests']} requests, {limiter.stats['retries']} retries, "
+              f"{limiter.stats['rate_limited']} rate limited, {limiter.stats['failed']} failed")
+    
+    analyzed_count = len(analyzed) - (1 if layout_regions.LAYOUT_IMAGE in analyzed else 0)
+    analyzed.update(resumed)
+    if layout:
+        descriptions[layout_regions.LAYOUT_IMAGE] = analyzed.pop(layout_regions.LAYOUT_IMAGE)
+    for filename in image_files:
+        descriptions[filename] = reused[filename] if filename in reused else analyzed[filename]
+    
+    if phash_threshold is not None:
+        # Reused entries keep the hash their description was generated from, so
+        # slow drift across many runs still triggers a fresh analysis eventually
+        index = {}
+        for filename in image_files:
+            if filename in reused:
+                index[filename] = previous_index[filename]
+            elif filename in hashes and not is_error_description(descriptions[filename]):
+                index[filename] = {"hash": hashes[filename], "description": descriptions[filename],
+                                   "fingerprint": fingerprints[filename]}
+        phash_index.save_index(screenshot_folder, index)
+        print(f"Skipped {len(reused)} of {len(image_files)} visually unchanged screenshots")
+    
+    if summary is not None:
+        summary["analyzed"] = analyzed_count
+        summary["resumed"] = len(resumed) - (1 if layout_regions.LAYOUT_IMAGE in resumed else 0)
+        summary["reused"] = len(reused)
+        summary["removed"] = len(set(previous_index) - set(image_files))
+    
     if not descriptions:
         print("No image files found in the screenshots folder!")
     
     return descriptions
 
-def create_markdown_report(descriptions, output_dir="chapters"):
-    """Creates separate Markdown files for each screenshot and description."""
+def chapter_path(filename, output_dir="chapters"):
+    """Returns the chapter file for a screenshot, e.g. dashboard.png -> chapters/Dashboard.md."""
+    base_name = os.path.splitext(filename)[0]  # Remove .png extension
+    return os.path.join(output_dir, f"{base_name.title()}.md")
+
+MANIFEST_FILE = ".manifest.json"
+
+def load_manifest(output_dir="chapters"):
+    """Returns {chapter file name: {"hash": ..., "screenshot": ...}} from the last run."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def chapter_content(filename, description):
+    # Create a descriptive title based on the filename
+    # title = base_name.replace('_', ' ').replace('-', ' ').title()
+    # content = f"# {title}\n\n"
+    content = f"![Screenshot of {filename}](screenshots/{filename})\n\n"
+    content += f"## Description\n\n{description}\n\n"
+    return content
+
+def write_chapter(filename, description, output_dir="chapters", manifest=None, previous_manifest=None):
+    """Writes the Markdown chapter for one screenshot if its content changed.
+
+    The chapter's content hash is recorded in manifest; if previous_manifest
+    already has the same hash the file is left untouched, keeping its mtime
+    for incremental downstream builds. Returns (path, whether it was written).
+    """
+    chapter_file = chapter_path(filename, output_dir)
+    name = os.path.basename(chapter_file)
+    content = chapter_content(filename, description)
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    if manifest is not None:
+        manifest[name] = {"hash": digest, "screenshot": filename}
+    
+    previous = (previous_manifest or {}).get(name)
+    if previous and previous.get("hash") == digest and os.path.exists(chapter_file):
+        print(f"Unchanged chapter: {chapter_file}")
+        return chapter_file, False
+    
+    atomic_write.write_text(chapter_file, content)
+    print(f"Created chapter: {chapter_file}")
+    return chapter_file, True
+
+def finish_chapters(output_dir, manifest, expected=None):
+    """Removes files that are not part of the new chapter set and saves its manifest.
+
+    Called only once every chapter has been written, so an interrupted run
+    leaves the previous chapters in place. With expected, the screenshot
+    names the run set out to describe, only the previous run's chapters of
+    screenshots that are no longer expected are removed; those of expected
+    screenshots that were not described (e.g. their capture failed) and the
+    Common Layout chapter stay, along with their manifest entries. Returns
+    the removed paths.
+    """
+    removed = []
+    if expected is None:
+        stale = [file for file in os.listdir(output_dir) if file != MANIFEST_FILE and file not in manifest]
+    else:
+        stale = []
+        for name, entry in load_manifest(output_dir).items():
+            if name in manifest:
+                continue
+            if entry.get("screenshot") in expected or entry.get("screenshot") == layout_regions.LAYOUT_IMAGE:
+                manifest[name] = entry
+            else:
+                stale.append(name)
+    for file in stale:
+        path = os.path.join(output_dir, file)
+        if os.path.isfile(path):
+            os.remove(path)
+            removed.append(path)
+            print(f"Removed stale chapter: {path}")
+    atomic_write.write_json(os.path.join(output_dir, MANIFEST_FILE), manifest, indent=2, sort_keys=True)
+    return removed
+
+def create_markdown_report(descriptions, output_dir="chapters", expected=None):
+    """Creates separate Markdown files for each screenshot and description.
+
+    Only chapters whose content changed are rewritten. expected is passed on
+    to finish_chapters. Returns the paths of the chapters that were written
+    or removed.
+    """
     print(f"Creating markdown report in {output_dir}")
     # Create chapters directory if it doesn't exist
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         print(f"Created directory: {output_dir}")
     
-    # delete all files in the output directory
-    for file in os.listdir(output_dir):
-        os.remove(os.path.join(output_dir, file))
+    previous_manifest = load_manifest(output_dir)
+    manifest = {}
+    changed = []
     
     # Create individual markdown files for each screenshot
     for filename, description in descriptions.items():
-        # Create a clean filename for the markdown file
-        base_name = os.path.splitext(filename)[0]  # Remove .png extension
-        chapter_file = os.path.join(output_dir, f"{base_name.title()}.md")
-        
-        with open(chapter_file, "w") as f:
-            # Create a descriptive title based on the filename
-            # title = base_name.replace('_', ' ').replace('-', ' ').title()
-            # f.write(f"# {title}\n\n")
-            f.write(f"![Screenshot of {filename}](screenshots/{filename})\n\n")
-            f.write(f"## Description\n\n{description}\n\n")
-        
-        print(f"Created chapter: {chapter_file}")
+        chapter_file, written = write_chapter(filename, description, output_dir, manifest, previous_manifest)
+        if written:
+            changed.append(chapter_file)
     
-    print(f"Generated {len(descriptions)} chapter files in {output_dir}/")
+    changed += finish_chapters(output_dir, manifest, expected)
+    print(f"Generated {len(descriptions)} chapter files in {output_dir}/ ({len(changed)} changed)")
+    return changed
 
-def create_pdf_report(chapters_dir="chapters", output_file="user_guide.pdf"):
-    """Creates a PDF report from chapter markdown files using the markdown_to_html.py script."""
+def create_pdf_report(chapters_dir="chapters", output_file="user_guide.pdf", pdf_jobs=None, pdf_budget_mb=None):
+    """Creates a PDF report from chapter markdown files using markdown_to_html.py, in-process.
+
+    With pdf_jobs, chapters are rendered separately on that many processes and
+    cached, so only changed chapters are re-rendered before merging. Images
+    are embedded as resized variants, reduced further to fit pdf_budget_mb.
+    """
     print(f"Creating PDF report in {output_file}")
     try:
-        # Use the markdown_to_html.py script to convert all chapter files to a single PDF
-        result = subprocess.run([
-            sys.executable, "markdown_to_html.py", 
-            "--single", 
-            "--pdf", 
-            chapters_dir,  # directory containing the chapter markdown files
-            "user_guide.html"  # output HTML file
-        ], capture_output=True, text=True, check=True)
+        # Imported here so runs that never build the PDF don't load weasyprint
+        import markdown_to_html
+        
+        assets = markdown_to_html.make_assets("user_guide.pdf", pdf_budget_mb=pdf_budget_mb)
+        if pdf_jobs:
+            markdown_to_html.convert_to_single_html(chapters_dir, "user_guide.html", assets=assets)
+            markdown_to_html.convert_to_pdf_by_chapter(chapters_dir, "user_guide.pdf", jobs=pdf_jobs, assets=assets)
+        else:
+            # Convert all chapter files to user_guide.html and user_guide.pdf
+            markdown_to_html.convert_to_single_html(chapters_dir, "user_guide.html", pdf_output=True, assets=assets)
+        assets.prune()
         
-        # The script creates user_guide.html and user_guide.pdf
         if os.path.exists("user_guide.pdf"):
             # Rename to the desired output filename if different
             if output_file != "user_guide.pdf":
@@ -133,22 +949,174 @@ def create_pdf_report(chapters_dir="chapters", output_file="user_guide.pdf"):
         else:
             print("Error: PDF generation failed - no output file created")
             
-    except subprocess.CalledProcessError as e:
-        print(f"Error running markdown_to_html.py: {e}")
-        print(f"stdout: {e.stdout}")
-        print(f"stderr: {e.stderr}")
     except Exception as e:
         print(f"Error creating PDF report: {e}")
 
-if __name__ == "__main__":
-    descriptions = get_screenshot_descriptions()
+def add_analysis_arguments(parser, per_page=False):
+    """Adds the options that shape how screenshots are analyzed. analyze_and_document.py,
+    pipeline.py and watch.py share them; see analysis_options and open_run. per_page
+    leaves out batches, groups and the run store, which need a run's whole screenshot set."""
+    parser.add_argument("--cache-dir", default=description_cache.DEFAULT_CACHE_DIR,
+                        help=f"description cache directory (default: {description_cache.DEFAULT_CACHE_DIR})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="ignore the description cache and send every screenshot to the API")
+    parser.add_argument("--purge-cache", action="store_true",
+                        help="delete all cached descriptions before analyzing")
+    parser.add_argument("--cache-max-size", type=float, default=description_cache.DEFAULT_MAX_BYTES / (1024 * 1024),
+                        help="evict least recently used entries above this size in MB (default: %(default).0f)")
+    parser.add_argument("--cache-max-age", type=float, default=description_cache.DEFAULT_MAX_AGE_DAYS,
+                        help="evict entries unused for this many days (default: %(default).0f)")
+    parser.add_argument("--max-dimension", type=int, default=image_preprocess.DEFAULT_OPTIONS["max_width"],
+                        help="downscale screenshots to fit in this many pixels per side before upload "
+                             "(default: %(default)s)")
+    parser.add_argument("--image-format", choices=["jpeg", "webp", "png"],
+                        default=image_preprocess.DEFAULT_OPTIONS["image_format"],
+                        help="re-encode screenshots in this format before upload (default: %(default)s)")
+    parser.add_argument("--image-quality", type=int, default=image_preprocess.DEFAULT_OPTIONS["quality"],
+                        help="JPEG/WebP quality for uploaded screenshots (default: %(default)s)")
+    parser.add_argument("--detail", choices=["low", "high", "auto"],
+                        help="image detail hint sent to the Vision API (default: not sent)")
+    parser.add_argument("--no-preprocess", action="store_true",
+                        help="upload screenshots as-is, without downscaling or re-encoding")
+    parser.add_argument("--phash", action="store_true",
+                        help="reuse the previous description of screenshots that look unchanged; text-only "
+                             "changes on tall pages can go unnoticed (default: off)")
+    parser.add_argument("--phash-threshold", type=int, default=phash_index.DEFAULT_THRESHOLD,
+                        help="with --phash, how many bits a screenshot's perceptual hash may differ by "
+                             "(default: %(default)s)")
+    parser.add_argument("--shared-layout", action="store_true",
+                        help="describe the header, sidebar and footer shared by all pages once, in a "
+                             "Common Layout chapter, and send only each page's content area")
+    if not per_page:
+        parser.add_argument("--batch", action="store_true",
+                            help="submit all screenshots through the OpenAI Batch API and wait for the results")
+        parser.add_argument("--batch-id",
+                            help="resume waiting for previously submitted batches (comma-separated ids) instead of "
+                                 "submitting new ones")
+        parser.add_argument("--batch-poll-interval", type=float, default=BATCH_POLL_INTERVAL,
+                            help="seconds between batch status checks (default: %(default)s)")
+        parser.add_argument("--group-size", type=int,
+                            help=f"describe up to this many screenshots per API request, e.g. {GROUP_SIZE} "
+                                 "(default: one screenshot per request)")
+        parser.add_argument("--group-tokens", type=int, default=GROUP_TOKEN_LIMIT,
+                            help="keep each grouped request's estimated prompt and output tokens under this "
+                                 "(default: %(default)s)")
+        parser.add_argument("--run-store", default=run_store.DEFAULT_STORE,
+                            help="SQLite database recording each page as it finishes (default: %(default)s)")
+        parser.add_argument("--no-run-store", action="store_true", help="don't record this run")
+        parser.add_argument("--resume", action="store_true",
+                            help="continue the last run if it didn't finish, analyzing only the pages it hadn't done")
+
+def analysis_options(args):
+    """get_screenshot_descriptions keyword arguments for the options of add_analysis_arguments."""
+    image_options = None
+    if not args.no_preprocess:
+        image_options = {
+            "max_width": args.max_dimension,
+            "max_height": args.max_dimension,
+            "image_format": args.image_format,
+            "quality": args.image_quality,
+            "detail": args.detail,
+        }
+
+    batch = None
+    if getattr(args, "batch", False) or getattr(args, "batch_id", None):
+        batch = {"batch_id": args.batch_id, "poll_interval": args.batch_poll_interval}
+
+    return {
+        "cache_dir": None if args.no_cache else args.cache_dir,
+        "cache_max_age": args.cache_max_age,
+        "image_options": image_options,
+        "batch": batch,
+        "shared_layout": args.shared_layout,
+        "group_size": getattr(args, "group_size", None),
+        "group_tokens": getattr(args, "group_tokens", GROUP_TOKEN_LIMIT),
+        "phash_threshold": args.phash_threshold if args.phash else None,
+    }
+
+def open_run(args, options):
+    """Opens the run store and starts a run, or with --resume continues the last one if
+    it didn't finish and used the same settings. Returns (store, run_id), or (None, None)
+    with --no-run-store."""
+    if args.no_run_store:
+        return None, None
+    # Descriptions made with other settings can't be resumed into this run
+    run_options = {"model": MODEL, "max_tokens": MAX_TOKENS, "image_options": options["image_options"],
+                   "shared_layout": options["shared_layout"], "group_size": options["group_size"]}
+    store = run_store.RunStore(args.run_store)
+    run_id = None
+    if args.resume:
+        run = store.unfinished_run()
+        if run is None:
+            print("No unfinished run to resume, starting a new one")
+        elif run["options"] != json.loads(json.dumps(run_options, sort_keys=True)):
+            print(f"Run {run['id']} used different settings, starting a new run")
+        else:
+            run_id = run["id"]
+    if run_id is None:
+        run_id = store.start_run(run_options)
+    print(f"Recording run {run_id} in {args.run_store}")
+    return store, run_id
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze screenshots and generate the user guide.")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of screenshots to analyze concurrently (default: 1)")
+    add_analysis_arguments(parser)
+    parser.add_argument("--pdf-jobs", type=int,
+                        help="render chapters to PDF separately on this many processes, reusing cached "
+                             "chapters, then merge them (default: render one combined document)")
+    parser.add_argument("--pdf-budget", type=float, metavar="MB",
+                        help="lower the resolution and quality of the PDF's images until they fit in this many MB")
+    parser.add_argument("--tpm", type=int,
+                        help="tokens-per-minute budget for screenshot analysis (default: no budget, "
+                             "only the API's rate-limit headers are followed)")
+    parser.add_argument("--max-retries", type=int, default=rate_limiter.MAX_RETRIES,
+                        help="retries for rate-limited or failed API calls before giving up (default: %(default)s)")
+    parser.add_argument("--metrics-file", default=metrics.REPORT_FILE,
+                        help="JSON run report with per-stage and per-page timings, tokens and cost "
+                             "(default: %(default)s)")
+    parser.add_argument("--prometheus-file",
+                        help="also write the run's metrics to this Prometheus textfile (e.g. for "
+                             "node_exporter's textfile collector)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.purge_cache:
+        description_cache.purge_cache(args.cache_dir)
+    options = analysis_options(args)
+
+    limiter = rate_limiter.RateLimiter(max_concurrency=args.jobs, tokens_per_minute=args.tpm,
+                                       max_retries=args.max_retries)
+    store, run_id = open_run(args, options)
+    
+    summary = {}
+    descriptions = get_screenshot_descriptions(max_workers=args.jobs, limiter=limiter, summary=summary,
+                                               store=store, run_id=run_id, **options)
+    if options["cache_dir"]:
+        description_cache.prune_cache(options["cache_dir"], int(args.cache_max_size * 1024 * 1024),
+                                      args.cache_max_age)
     chapters_dir = "chapters"
-    create_markdown_report(descriptions, chapters_dir)
+    changed_chapters = create_markdown_report(descriptions, chapters_dir)
+    
+    print(f"Run summary: {summary['analyzed']} analyzed, {summary['resumed']} resumed, "
+          f"{summary['reused']} skipped as visually unchanged")
     
     # Create PDF report if chapters were created successfully
-    if descriptions:
-        create_pdf_report(chapters_dir, "user_guide.pdf")
-    else:
+    if not descriptions:
         print("No screenshots found, skipping PDF generation.")
+    elif not summary["analyzed"] and not summary["resumed"] and not changed_chapters and os.path.exists("user_guide.pdf"):
+        print("No pages changed visually, keeping the existing user_guide.pdf.")
+    else:
+        create_pdf_report(chapters_dir, "user_guide.pdf", pdf_jobs=args.pdf_jobs, pdf_budget_mb=args.pdf_budget)
 
-    print("Done.")
\ No newline at end of file
+    report = metrics.write_report(args.metrics_file, args.prometheus_file)
+    metrics.print_summary(report)
+    if store is not None:
+        store.finish_run(run_id)
+        store.close()
+    print("Done.")
+
+if __name__ == "__main__":
+    main()
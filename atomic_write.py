@@ -0,0 +1,44 @@
+import os
+import json
+import socket
+import threading
+import contextlib
+
+# Files are written under a temporary name next to their final path and then
+# renamed into place, so readers never see a half-written file and a failed
+# write leaves the previous one intact. The temporary name includes the host,
+# process and thread, so concurrent writers of the same path (threads, worker
+# processes, or hosts sharing a filesystem) never write into each other's file.
+HOST = socket.gethostname()
+TMP_SUFFIX = ".tmp"
+
+def tmp_path(path):
+    """A temporary name next to path, unique to this host, process and thread."""
+    return f"{path}.{HOST}.{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}"
+
+@contextlib.contextmanager
+def replacing(path):
+    """Yields a temporary path to write; once the block finishes it replaces path.
+
+    If the block raises, the temporary file is removed and path is left as it was.
+    """
+    tmp_file = tmp_path(path)
+    try:
+        yield tmp_file
+        os.replace(tmp_file, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_file)
+        raise
+
+def write_text(path, content):
+    """Atomically writes a string to path as UTF-8."""
+    with replacing(path) as tmp_file:
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(content)
+
+def write_json(path, data, **dump_options):
+    """Atomically writes data to path as JSON; dump_options are passed on to json.dump."""
+    with replacing(path) as tmp_file:
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, **dump_options)
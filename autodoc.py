@@ -1,4 +1,57 @@
-import subprocess
+import sys
+import time
+import argparse
+import importlib
 
-subprocess.run(["python3", "capture_screenshots.py"])
-subprocess.run(["python3", "analyze_and_document.py"])
\ No newline at end of file
+# Each subcommand imports only its own module, and the modules load their heavy
+# dependencies (openai, weasyprint, playwright) on first use, so quick commands
+# such as rendering HTML start without them.
+COMMANDS = {
+    "capture": ("capture_screenshots", "capture screenshots of the pages in shots.yml"),
+    "analyze": ("analyze_and_document", "describe the screenshots and build the chapters and PDF"),
+    "render": ("markdown_to_html", "convert Markdown chapters to HTML and/or PDF"),
+    # Capture, analysis and chapter writing run as one in-process pipeline
+    "all": ("pipeline", "capture, analyze and build the user guide in one process (the default)"),
+}
+HEAVY_MODULES = ("openai", "weasyprint", "playwright", "PIL", "pypdf", "yaml", "dotenv", "markdown")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="autodoc", description="Generate a user guide from screenshots of a web application.",
+        epilog="Options after the command are passed on to it; see e.g. 'autodoc render --help'.")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="report how long imports took and which heavy dependencies were loaded")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    for name, (_, help_text) in COMMANDS.items():
+        # Help and options belong to the command's own parser
+        command = commands.add_parser(name, help=help_text, add_help=False)
+        command.add_argument("--profile-startup", action="store_true", default=argparse.SUPPRESS)
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # Pipeline options without a command (e.g. autodoc.py --jobs 8) keep running everything
+    first = next((index for index, arg in enumerate(argv) if arg != "--profile-startup"), None)
+    if first is not None and argv[first] not in COMMANDS and argv[first] not in ("-h", "--help"):
+        argv.insert(first, "all")
+    return parser.parse_known_args(argv)
+
+def loaded_heavy_modules():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+def main(argv=None):
+    start = time.perf_counter()
+    args, command_argv = parse_args(argv)
+    module_name = COMMANDS[args.command or "all"][0]
+
+    module = importlib.import_module(module_name)
+    imported = time.perf_counter()
+    if args.profile_startup:
+        print(f"Startup: imported {module_name} in {(imported - start) * 1000:.1f} ms "
+              f"(heavy modules loaded: {', '.join(loaded_heavy_modules()) or 'none'})")
+    try:
+        module.main(command_argv)
+    finally:
+        if args.profile_startup:
+            print(f"Startup: {(imported - start) * 1000:.1f} ms, command: {time.perf_counter() - imported:.2f} s "
+                  f"(heavy modules loaded: {', '.join(loaded_heavy_modules()) or 'none'})")
+
+if __name__ == "__main__":
+    main()
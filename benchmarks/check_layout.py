@@ -0,0 +1,63 @@
+import os
+import sys
+import argparse
+import tempfile
+
+# Checks run against the pipeline modules in the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import layout_regions
+import synthetic_screenshots
+from synthetic_screenshots import generate_screenshots
+
+def expected_content(width, height):
+    """The boxes each synthetic page draws outside the shared chrome, as (name, box)."""
+    left = synthetic_screenshots.SIDEBAR_WIDTH + 32
+    title_top = synthetic_screenshots.HEADER_HEIGHT + 24
+    table_top = synthetic_screenshots.HEADER_HEIGHT + 72
+    return [
+        ("page title", (left, title_top, left + 60, title_top + 10)),
+        ("table's left edge", (left, table_top, left + 1, table_top + synthetic_screenshots.ROW_HEIGHT)),
+        ("table's right edge", (width - 33, table_top, width - 32, table_top + 2 * synthetic_screenshots.ROW_HEIGHT)),
+    ]
+
+def check_layout(count=10, width=1280, height=2000):
+    """Detects the shared layout of synthetic screenshots and returns the content
+    that the crop would cut off, as a list of messages (empty if none)."""
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = generate_screenshots(workdir, count, width, height)
+        margins = layout_regions.detect_layout(paths)
+    if margins is None:
+        return ["no shared layout detected"]
+    box = layout_regions.content_box((width, height), margins)
+    print(f"Margins {margins}, content box {box}")
+    problems = []
+    for name, (x0, y0, x1, y1) in expected_content(width, height):
+        if x0 < box[0] or y0 < box[1] or x1 > box[2] or y1 > box[3]:
+            problems.append(f"{name} {(x0, y0, x1, y1)} falls outside the content box {box}")
+    # The chrome itself should still be cropped away
+    if margins[0] < synthetic_screenshots.SIDEBAR_WIDTH or margins[1] < synthetic_screenshots.HEADER_HEIGHT:
+        problems.append(f"sidebar or header not cropped: margins {margins}")
+    return problems
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check that shared-layout cropping keeps every page's own "
+                                                 "content, on synthetic screenshots.")
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=2000)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    problems = check_layout(args.count, args.width, args.height)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if problems:
+        sys.exit(1)
+    print("OK: the crop keeps each page's title and table")
+
+if __name__ == "__main__":
+    main()
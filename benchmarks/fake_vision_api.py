@@ -0,0 +1,320 @@
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A local stand-in for the OpenAI chat.completions endpoint, so the pipeline can be
+# timed (and its retry behaviour exercised) without spending real API money.
+# The files and batches endpoints the Batch API path uses are served too: an
+# uploaded request file is answered line by line as if each were a
+# chat.completions call, and the batch completes after batch_seconds.
+
+DESCRIPTION = (
+    "The page shows a header with the application name and user menu, a navigation "
+    "sidebar on the left and a data table in the main content area. Above the table "
+    "are a search box and an \"Add\" button; each row has edit and delete actions."
+)
+
+def completion_for(request):
+    """Returns (prompt_tokens, completion_tokens, content) for a chat.completions request."""
+    parts = [part for message in request.get("messages", []) for part in message.get("content") or []
+             if isinstance(part, dict)]
+    images = max(1, sum(part.get("type") == "image_url" for part in parts))
+    prompt_tokens = (85 + 170 * 4) * images
+    completion_tokens = min(request.get("max_tokens") or 500, 80 * images)
+    content = DESCRIPTION
+    if (request.get("response_format") or {}).get("type") == "json_object":
+        # Grouped requests name each screenshot in a text part before its image
+        names = [part["text"].split(":", 1)[1].strip() for part in parts
+                 if part.get("type") == "text" and part.get("text", "").startswith("Screenshot:")]
+        content = json.dumps({name: DESCRIPTION for name in names})
+    return prompt_tokens, completion_tokens, content
+
+def completion_body(request, prompt_tokens, completion_tokens, content):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "gpt-4o"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+class FakeVisionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_not_found(self):
+        self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        with self.server.lock:
+            self.server.stats["requests"] += 1
+
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            self.chat_completion(json.loads(body or b"{}"))
+        elif path.endswith("/files"):
+            self.upload_file(body)
+        elif path.endswith("/batches"):
+            self.create_batch(json.loads(body or b"{}"))
+        else:
+            self.send_not_found()
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.stats["requests"] += 1
+
+        parts = self.path.split("?")[0].rstrip("/").split("/")
+        if len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content":
+            with self.server.lock:
+                content = self.server.files.get(parts[-2], {}).get("content")
+            if content is None:
+                self.send_not_found()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        elif len(parts) >= 2 and parts[-2] == "batches":
+            batch = self.retrieve_batch(parts[-1])
+            if batch is None:
+                self.send_not_found()
+            else:
+                self.send_json(200, batch)
+        else:
+            self.send_not_found()
+
+    def chat_completion(self, request):
+        config = self.server.config
+        prompt_tokens, completion_tokens, content = completion_for(request)
+        tokens_left, reset_tokens = self.take_tokens(prompt_tokens + (request.get("max_tokens") or 500))
+        if tokens_left is None:
+            with self.server.lock:
+                self.server.stats["rate_limited"] += 1
+            self.send_json(429, {"error": {"message": "Rate limit reached for tokens per min", "type": "tokens",
+                                           "code": "rate_limit_exceeded"}},
+                           {"x-ratelimit-limit-tokens": str(config["tokens_per_minute"]),
+                            "x-ratelimit-remaining-tokens": "0",
+                            "x-ratelimit-reset-tokens": f"{reset_tokens:.3f}s"})
+            return
+
+        time.sleep(max(0.0, random.gauss(config["latency"], config["jitter"])))
+
+        roll = random.random()
+        if roll < config["rate_limit_ratio"]:
+            with self.server.lock:
+                self.server.stats["rate_limited"] += 1
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                           {"retry-after-ms": str(int(config["retry_after"] * 1000)),
+                            "x-ratelimit-remaining-requests": "0",
+                            "x-ratelimit-reset-requests": f"{config['retry_after']}s"})
+            return
+        if roll < config["rate_limit_ratio"] + config["error_ratio"]:
+            with self.server.lock:
+                self.server.stats["errors"] += 1
+            self.send_json(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+            return
+
+        self.send_json(200, completion_body(request, prompt_tokens, completion_tokens, content), {
+            "x-ratelimit-limit-requests": "10000",
+            "x-ratelimit-remaining-requests": "9999",
+            "x-ratelimit-limit-tokens": str(config["tokens_per_minute"] or 2000000),
+            "x-ratelimit-remaining-tokens": str(tokens_left),
+            "x-ratelimit-reset-requests": "6ms",
+            "x-ratelimit-reset-tokens": f"{reset_tokens:.3f}s",
+        })
+
+    def upload_file(self, body):
+        """Stores a multipart upload (the files.create call) and returns its file object."""
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode("utf-8") + body)
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param("name", header="content-disposition")] = part
+        upload = fields.get("file")
+        if upload is None:
+            self.send_json(400, {"error": {"message": "Missing file", "type": "invalid_request_error"}})
+            return
+        content = upload.get_payload(decode=True) or b""
+        file_object = {
+            "id": f"file-{uuid.uuid4().hex}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": upload.get_filename() or "upload.jsonl",
+            "purpose": fields["purpose"].get_content().strip() if "purpose" in fields else "batch",
+            "status": "processed",
+        }
+        with self.server.lock:
+            self.server.files[file_object["id"]] = dict(file_object, content=content)
+        self.send_json(200, file_object)
+
+    def create_batch(self, request):
+        """Starts a batch over an uploaded request file; it is answered when first retrieved after batch_seconds."""
+        with self.server.lock:
+            input_file = self.server.files.get(request.get("input_file_id"))
+        if input_file is None:
+            self.send_json(400, {"error": {"message": f"No such file: {request.get('input_file_id')}",
+                                           "type": "invalid_request_error"}})
+            return
+        now = int(time.time())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": request.get("endpoint"),
+            "input_file_id": input_file["id"],
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "in_progress",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "in_progress_at": now,
+            "completed_at": None,
+            "expires_at": now + 24 * 3600,
+            "request_counts": {"total": input_file["content"].count(b"\n"), "completed": 0, "failed": 0},
+            "metadata": request.get("metadata"),
+        }
+        with self.server.lock:
+            self.server.batches[batch["id"]] = dict(batch, ready_at=time.monotonic() + self.server.config["batch_seconds"])
+        self.send_json(200, batch)
+
+    def retrieve_batch(self, batch_id):
+        """Returns a batch object, finishing the batch first if its time has come. None if unknown."""
+        with self.server.lock:
+            batch = self.server.batches.get(batch_id)
+            if batch is None:
+                return None
+            if batch["status"] == "in_progress" and time.monotonic() >= batch["ready_at"]:
+                self.finish_batch(batch)
+            return {key: value for key, value in batch.items() if key != "ready_at"}
+
+    def finish_batch(self, batch):
+        """Answers every request line of a batch, putting error_ratio of them in the error file.
+        Called with the server lock held."""
+        output, errors = [], []
+        for line in self.server.files[batch["input_file_id"]]["content"].splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            result = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": item["custom_id"], "error": None}
+            self.server.stats["batch_requests"] += 1
+            if random.random() < self.server.config["error_ratio"]:
+                self.server.stats["errors"] += 1
+                result["response"] = {"status_code": 500, "request_id": uuid.uuid4().hex,
+                                      "body": {"error": {"message": "Internal server error", "type": "server_error"}}}
+                errors.append(result)
+            else:
+                request = item.get("body") or {}
+                result["response"] = {"status_code": 200, "request_id": uuid.uuid4().hex,
+                                      "body": completion_body(request, *completion_for(request))}
+                output.append(result)
+        for key, results in (("output_file_id", output), ("error_file_id", errors)):
+            if results:
+                content = "".join(json.dumps(result) + "\n" for result in results).encode("utf-8")
+                file_id = f"file-{uuid.uuid4().hex}"
+                self.server.files[file_id] = {"id": file_id, "object": "file", "bytes": len(content),
+                                              "created_at": int(time.time()), "filename": f"{batch['id']}_{key}.jsonl",
+                                              "purpose": "batch_output", "status": "processed", "content": content}
+                batch[key] = file_id
+        batch.update(status="completed", completed_at=int(time.time()),
+                     request_counts={"total": len(output) + len(errors), "completed": len(output),
+                                     "failed": len(errors)})
+
+    def take_tokens(self, tokens):
+        """Charges a request's tokens against the per-minute limit like the real API,
+        which counts the prompt plus max_tokens when the request arrives.
+        Returns (tokens left or None if over the limit, seconds until tokens free up)."""
+        limit = self.server.config["tokens_per_minute"]
+        if not limit:
+            return 2000000 - tokens, 0.001
+        now = time.monotonic()
+        with self.server.lock:
+            window = self.server.token_window
+            while window and window[0][0] <= now - 60:
+                window.pop(0)
+            used = sum(count for _, count in window)
+            reset = window[0][0] + 60 - now if window else 0.001
+            if used + tokens > limit:
+                return None, reset
+            window.append((now, tokens))
+            return limit - used - tokens, reset
+
+def start_server(port=0, latency=0.5, jitter=0.1, rate_limit_ratio=0.0, error_ratio=0.0, retry_after=1.0,
+                 tokens_per_minute=None, batch_seconds=0.0):
+    """Starts the fake API on a background thread. Returns (server, base_url).
+
+    With tokens_per_minute, requests beyond that many tokens in the last
+    minute get a 429 with the same headers the real API sends. Batches stay
+    in_progress for batch_seconds; error_ratio of their requests fail.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeVisionHandler)
+    server.daemon_threads = True
+    server.config = {
+        "latency": latency,
+        "jitter": jitter,
+        "rate_limit_ratio": rate_limit_ratio,
+        "error_ratio": error_ratio,
+        "retry_after": retry_after,
+        "tokens_per_minute": tokens_per_minute,
+        "batch_seconds": batch_seconds,
+    }
+    server.lock = threading.Lock()
+    server.token_window = []
+    server.files = {}
+    server.batches = {}
+    server.stats = {"requests": 0, "batch_requests": 0, "rate_limited": 0, "errors": 0}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1/"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI chat.completions, files and batches endpoint.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="mean response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="standard deviation of the response time")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--error-ratio", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after sent with 429s, in seconds")
+    parser.add_argument("--tpm", type=int, help="tokens-per-minute limit enforced with 429s")
+    parser.add_argument("--batch-seconds", type=float, default=0.0, help="time a batch stays in progress")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    server, base_url = start_server(args.port, args.latency, args.jitter, args.rate_limit_ratio,
+                                    args.error_ratio, args.retry_after, args.tpm, args.batch_seconds)
+    print(f"Fake vision API listening on {base_url} (set OPENAI_BASE_URL to use it)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
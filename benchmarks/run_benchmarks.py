@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+
+# Benchmarks import the pipeline modules from the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import openai
+
+import analyze_and_document
+import markdown_to_html
+import rate_limiter
+from fake_vision_api import start_server
+from synthetic_screenshots import generate_screenshots
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return round(time.perf_counter() - start, 3), result
+
+def run_size(pages, workdir, args):
+    """Times each stage for one guide size inside workdir. Returns the result record."""
+    os.makedirs(workdir, exist_ok=True)
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        generate_screenshots("screenshots", pages, args.width, args.height)
+        stages = {}
+
+        # Caching and perceptual-hash reuse would hide the API cost being measured
+        if args.batch:
+            stages["get_screenshot_descriptions"], descriptions = timed(
+                analyze_and_document.get_screenshot_descriptions, "screenshots", cache_dir=None,
+                batch={"poll_interval": args.batch_poll_interval})
+        else:
+            stages["get_screenshot_descriptions"], descriptions = timed(
+                analyze_and_document.get_screenshot_descriptions, "screenshots",
+                max_workers=args.jobs, cache_dir=None,
+                limiter=rate_limiter.RateLimiter(max_concurrency=args.jobs, tokens_per_minute=args.tpm))
+        errors = sum(1 for d in descriptions.values() if analyze_and_document.is_error_description(d))
+
+        stages["create_markdown_report"], _ = timed(analyze_and_document.create_markdown_report,
+                                                   descriptions, "chapters")
+        stages["convert_to_single_html"], _ = timed(markdown_to_html.convert_to_single_html,
+                                                   "chapters", "user_guide.html")
+
+        if args.skip_pdf or not markdown_to_html.weasyprint_available():
+            stages["html_to_pdf"] = None
+        else:
+            # Render the print-CSS document the PDF report uses; writing it is not timed
+            md_files = sorted(os.path.join("chapters", name) for name in os.listdir("chapters") if name.endswith(".md"))
+            with open("user_guide_print.html", "w", encoding="utf-8") as f:
+                markdown_to_html.write_single_html(md_files, f, markdown_to_html.PRINT_CSS)
+            stages["html_to_pdf"], _ = timed(markdown_to_html.html_to_pdf, "user_guide_print.html", "user_guide.pdf")
+
+        return {"pages": pages, "errors": errors, "stages": stages}
+    finally:
+        os.chdir(previous_cwd)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time each pipeline stage against a local fake vision API.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="guide sizes (pages) to benchmark (default: 10 100 1000)")
+    parser.add_argument("--jobs", "-j", type=int, default=8, help="concurrent analysis requests (default: 8)")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake API mean latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="fake API latency standard deviation")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--error-ratio", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--api-tpm", type=int, help="tokens-per-minute limit the fake API enforces")
+    parser.add_argument("--tpm", type=int, help="tokens-per-minute budget given to the rate limiter")
+    parser.add_argument("--batch", action="store_true", help="analyze through the fake Batch API endpoints")
+    parser.add_argument("--batch-seconds", type=float, default=0.0,
+                        help="time each fake batch stays in progress (with --batch)")
+    parser.add_argument("--batch-poll-interval", type=float, default=0.5,
+                        help="seconds between batch status checks (with --batch)")
+    parser.add_argument("--width", type=int, default=1280, help="synthetic screenshot width")
+    parser.add_argument("--height", type=int, default=2000, help="synthetic screenshot height")
+    parser.add_argument("--skip-pdf", action="store_true", help="don't time html_to_pdf")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file (default: %(default)s)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated work directories")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    server, base_url = start_server(latency=args.latency, jitter=args.jitter,
+                                    rate_limit_ratio=args.rate_limit_ratio, error_ratio=args.error_ratio,
+                                    tokens_per_minute=args.api_tpm, batch_seconds=args.batch_seconds)
+    openai.base_url = base_url
+    openai.api_key = "benchmark"
+
+    root = tempfile.mkdtemp(prefix="autodoc-bench-")
+    results = []
+    try:
+        for pages in args.sizes:
+            print(f"=== {pages} pages ===")
+            result = run_size(pages, os.path.join(root, str(pages)), args)
+            results.append(result)
+            print(json.dumps(result))
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "keep")},
+        "api_stats": server.stats,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote benchmark results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import os
+import random
+import argparse
+
+from PIL import Image, ImageDraw
+
+# Generates admin-app-like screenshots: the same header, sidebar and footer on
+# every page, with a different title and table in the content area.
+
+HEADER_HEIGHT = 64
+SIDEBAR_WIDTH = 240
+FOOTER_HEIGHT = 40
+ROW_HEIGHT = 36
+
+def draw_screenshot(path, page, width=1280, height=2000, seed=None):
+    rng = random.Random(page if seed is None else seed)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+
+    # Shared chrome
+    draw.rectangle([0, 0, width, HEADER_HEIGHT], fill="#1f2d3d")
+    draw.text((20, 24), "Admin Console", fill="white")
+    draw.text((width - 140, 24), "admin@example.com", fill="white")
+    draw.rectangle([0, HEADER_HEIGHT, SIDEBAR_WIDTH, height - FOOTER_HEIGHT], fill="#f2f4f7")
+    for i, item in enumerate(["Dashboard", "Controllers", "Users", "Assets", "System", "Settings"]):
+        draw.text((24, HEADER_HEIGHT + 24 + i * 32), item, fill="#333333")
+    draw.rectangle([0, height - FOOTER_HEIGHT, width, height], fill="#e9ecef")
+    draw.text((20, height - FOOTER_HEIGHT + 14), "(c) Example Corp", fill="#555555")
+
+    # Page-specific content
+    left = SIDEBAR_WIDTH + 32
+    draw.text((left, HEADER_HEIGHT + 24), f"Page {page}", fill="black")
+    top = HEADER_HEIGHT + 72
+    rows = (height - FOOTER_HEIGHT - top - 20) // ROW_HEIGHT
+    for row in range(rows):
+        y = top + row * ROW_HEIGHT
+        if row % 2:
+            draw.rectangle([left, y, width - 32, y + ROW_HEIGHT], fill="#fafafa")
+        for col in range(4):
+            value = rng.randint(0, 99999)
+            draw.text((left + 12 + col * 220, y + 12), f"item-{page}-{row}-{col} {value}", fill="#222222")
+
+    image.save(path)
+
+def generate_screenshots(output_dir, count, width=1280, height=2000):
+    """Writes count synthetic screenshots (page-0000.png, ...) to output_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for page in range(count):
+        path = os.path.join(output_dir, f"page-{page:04d}.png")
+        draw_screenshot(path, page, width, height)
+        paths.append(path)
+    return paths
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic web app screenshots.")
+    parser.add_argument("output_dir", nargs="?", default="screenshots")
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=2000)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    generate_screenshots(args.output_dir, args.count, args.width, args.height)
+    print(f"Generated {args.count} screenshots in {args.output_dir}")
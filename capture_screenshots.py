@@ -1,29 +1,427 @@
 import subprocess
 import yaml
 import os
+import argparse
+import asyncio
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import atomic_write
+import metrics
 
 shots_file = "shots.yml"
 login_file = "login.yml"
 auth_file = "auth.json"
+screenshots_dir = "screenshots"
+timings_file = "capture_timings.json"
+
+# shot-scraper's default window size; pages are captured full height
+VIEWPORT = {"width": 1280, "height": 720}
+# Fixed wait used for shots without readiness conditions
+WAIT_MS = 3000
+# Default timeout for each readiness condition
+READY_TIMEOUT_MS = 10000
+# Timeout for the logged-in probe and each step of a scripted login
+AUTH_TIMEOUT_MS = 15000
+# Environment variables holding the scripted login credentials, unless login.yml names others
+USERNAME_ENV = "AUTODOC_USERNAME"
+PASSWORD_ENV = "AUTODOC_PASSWORD"
+
+# Resolves once the document has gone `quietMs` without any DOM mutation
+DOM_STABLE_JS = """
+(quietMs) => new Promise((resolve) => {
+    let timer;
+    const observer = new MutationObserver(() => {
+        clearTimeout(timer);
+        timer = setTimeout(done, quietMs);
+    });
+    function done() {
+        observer.disconnect();
+        resolve(true);
+    }
+    observer.observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    timer = setTimeout(done, quietMs);
+})
+"""
+
+def load_yaml(path):
+    with open(path, "r") as f:
+        return yaml.safe_load(f)
+
+def login(login_url, auth_file=auth_file):
+    """Opens a browser for an interactive login and saves the session to auth_file."""
+    print(f"Logging in to {login_url}")
+    subprocess.run(["shot-scraper", "auth", login_url, auth_file])
+
+def load_auth_state(auth_file=auth_file):
+    """Returns the Playwright storage state saved in auth_file, or None if there is none."""
+    try:
+        with open(auth_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def auth_cookies_valid(state, now=None):
+    """False if the saved session is empty or any of its persistent cookies has expired.
+
+    Session cookies (expires -1) can't be checked here; the probe catches those.
+    """
+    if not state or not (state.get("cookies") or state.get("origins")):
+        return False
+    now = now or time.time()
+    for cookie in state.get("cookies", []):
+        expires = cookie.get("expires", -1)
+        if expires and 0 < expires < now:
+            print(f"Saved cookie {cookie.get('name')} has expired")
+            return False
+    return True
+
+def cookie_header(state, url):
+    """Builds the Cookie header the browser would send to url from a storage state."""
+    parsed = urllib.parse.urlsplit(url)
+    host = parsed.hostname or ""
+    path = parsed.path or "/"
+    pairs = []
+    for cookie in state.get("cookies", []):
+        domain = cookie.get("domain", "").lstrip(".")
+        if host != domain and not host.endswith("." + domain):
+            continue
+        if not path.startswith(cookie.get("path") or "/"):
+            continue
+        if cookie.get("secure") and parsed.scheme != "https":
+            continue
+        pairs.append(f"{cookie['name']}={cookie['value']}")
+    return "; ".join(pairs)
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+def probe_with_request(state, probe_url):
+    """Requests probe_url with the saved cookies. Logged-out requests usually get a
+    redirect to the login page or a 401/403, so only a 2xx answer counts as logged in."""
+    request = urllib.request.Request(probe_url, headers={"Cookie": cookie_header(state, probe_url)})
+    opener = urllib.request.build_opener(_NoRedirect)
+    try:
+        with opener.open(request, timeout=AUTH_TIMEOUT_MS / 1000) as response:
+            return 200 <= response.status < 300
+    except urllib.error.HTTPError:
+        return False
+    except (urllib.error.URLError, OSError) as e:
+        print(f"Could not reach {probe_url}: {e}")
+        return False
+
+async def probe_with_browser(auth_file, probe_url, selector, login_url=None):
+    """Opens probe_url with the saved session and checks that selector becomes visible.
+
+    Used for apps (e.g. single-page apps keeping tokens in localStorage) where
+    the HTTP status alone doesn't tell whether the user is logged in.
+    """
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch()
+        try:
+            context = await browser.new_context(viewport=VIEWPORT, storage_state=auth_file)
+            page = await context.new_page()
+            await page.goto(probe_url, wait_until="load", timeout=AUTH_TIMEOUT_MS)
+            if login_url and page.url.split("?")[0] == login_url.split("?")[0]:
+                return False
+            await page.wait_for_selector(selector, state="visible", timeout=AUTH_TIMEOUT_MS)
+            return True
+        except Exception:
+            return False
+        finally:
+            await browser.close()
+
+def auth_is_valid(login_config, auth_file=auth_file):
+    """True if auth_file holds an unexpired session that the probe URL accepts.
+
+    login.yml sets the probe with `probe_url` (a page only logged-in users can
+    open) and optionally `probe_selector` (an element only shown when logged
+    in, checked in a real browser). Without a probe_url only cookie expiry
+    is checked.
+    """
+    state = load_auth_state(auth_file)
+    if not auth_cookies_valid(state):
+        return False
+    probe_url = login_config.get("probe_url")
+    if not probe_url:
+        return True
+    if login_config.get("probe_selector"):
+        return asyncio.run(probe_with_browser(auth_file, probe_url, login_config["probe_selector"],
+                                              login_config.get("url")))
+    return probe_with_request(state, probe_url)
+
+async def scripted_login(login_config, auth_file=auth_file):
+    """Logs in by filling the login form with credentials from the environment.
+
+    Needs `username_selector`, `password_selector` and `submit_selector` in
+    login.yml and the credentials in AUTODOC_USERNAME / AUTODOC_PASSWORD (or
+    the variables named by `username_env` / `password_env`). Saves the session
+    to auth_file and returns True if the browser left the login page.
+    """
+    from playwright.async_api import async_playwright
+
+    selectors = [login_config.get(key) for key in ("username_selector", "password_selector", "submit_selector")]
+    if not all(selectors):
+        return False
+    # Credentials may come from .env; loaded only here, so runs that reuse a
+    # saved session don't import python-dotenv at all
+    import dotenv
+
+    dotenv.load_dotenv()
+    username = os.getenv(login_config.get("username_env", USERNAME_ENV))
+    password = os.getenv(login_config.get("password_env", PASSWORD_ENV))
+    if not username or not password:
+        return False
+    username_selector, password_selector, submit_selector = selectors
+    login_url = login_config["url"]
+
+    print(f"Logging in to {login_url} as {username}")
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch()
+        try:
+            context = await browser.new_context(viewport=VIEWPORT)
+            page = await context.new_page()
+            await page.goto(login_url, wait_until="load", timeout=AUTH_TIMEOUT_MS)
+            await page.fill(username_selector, username, timeout=AUTH_TIMEOUT_MS)
+            await page.fill(password_selector, password, timeout=AUTH_TIMEOUT_MS)
+            await page.click(submit_selector, timeout=AUTH_TIMEOUT_MS)
+            try:
+                await page.wait_for_url(lambda url: url.split("?")[0] != login_url.split("?")[0],
+                                        timeout=AUTH_TIMEOUT_MS)
+            except Exception:
+                print(f"Still on {page.url} after submitting the login form")
+                return False
+            await page.wait_for_load_state("networkidle", timeout=AUTH_TIMEOUT_MS)
+            # Write next to auth_file first so a failed save can't clobber a good session
+            with atomic_write.replacing(auth_file) as tmp_file:
+                await context.storage_state(path=tmp_file)
+            return True
+        except Exception as e:
+            print(f"Scripted login failed: {e}")
+            return False
+        finally:
+            await browser.close()
+
+def ensure_auth(login_config, auth_file=auth_file, force=False):
+    """Makes sure auth_file holds a logged-in session, as cheaply as possible.
 
-with open(login_file, "r") as f:
-    login = yaml.safe_load(f)
+    An existing session is reused while it is valid (see auth_is_valid).
+    Otherwise a scripted login is tried, and only if that isn't configured or
+    fails does shot-scraper open a browser for an interactive login.
+    """
+    if not force and auth_is_valid(login_config, auth_file):
+        print(f"Reusing the session saved in {auth_file}")
+        return
+    if asyncio.run(scripted_login(login_config, auth_file)):
+        if not login_config.get("probe_url") or auth_is_valid(login_config, auth_file):
+            print(f"Saved the new session to {auth_file}")
+            return
+        print("The probe URL still isn't accessible after the scripted login")
+    login(login_config["url"], auth_file)
 
-print(f"Logging in to {login[0]['url']}")
-subprocess.run(["shot-scraper", "auth", login[0]["url"], auth_file])
+def clear_screenshots(output_dir=screenshots_dir):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
-with open(shots_file, "r") as f:
-    shots = yaml.safe_load(f)
+    # delete all files in the screenshots directory
+    for file in os.listdir(output_dir):
+        os.remove(os.path.join(output_dir, file))
 
-if not os.path.exists("screenshots"):
-    os.makedirs("screenshots")
+def capture_with_shot_scraper(shots, auth_file=auth_file, wait_ms=WAIT_MS):
+    """Captures each page with its own shot-scraper process (one browser launch per page).
 
-# delete all files in the screenshots directory
-for file in os.listdir("screenshots"):
-    os.remove(os.path.join("screenshots", file))
+    Only the fixed `wait` applies here; a shot's `wait_for` conditions need the
+    playwright engine, so they're skipped with a warning.
+    """
+    for shot in shots:
+        url = shot["url"]
+        output_file = shot["output"]
+        wait = shot.get("wait", wait_ms)
+        if shot.get("wait_for"):
+            print(f"Warning: ignoring wait_for for {url} with the shot-scraper engine, "
+                  f"waiting {wait} ms instead; use --engine playwright for readiness conditions")
+        with metrics.timer("capture", url) as measured:
+            subprocess.run(["shot-scraper", url, "--auth", auth_file, "--wait", str(wait), "--output", output_file])
+            if os.path.exists(output_file):
+                measured["bytes"] = os.path.getsize(output_file)
 
-print(f"Capturing screenshots for {len(shots)} pages")
-for shot in shots:
+def parse_conditions(shot):
+    """Normalizes a shot's `wait_for` list into (kind, value, timeout_ms) tuples.
+
+    Each entry is either a bare name (`network_idle`) or a mapping with one
+    condition and an optional timeout, e.g. `{selector: "#chart", timeout: 15000}`.
+    Supported conditions: network_idle, selector, javascript, dom_stable (quiet ms).
+    """
+    conditions = []
+    for entry in shot.get("wait_for") or []:
+        if isinstance(entry, str):
+            entry = {entry: True}
+        entry = dict(entry)
+        timeout = entry.pop("timeout", shot.get("timeout", READY_TIMEOUT_MS))
+        for kind, value in entry.items():
+            if kind not in ("network_idle", "selector", "javascript", "dom_stable"):
+                raise ValueError(f"Unknown wait_for condition '{kind}' for {shot['url']}")
+            conditions.append((kind, value, timeout))
+    return conditions
+
+async def wait_until_ready(page, conditions):
+    """Waits for each readiness condition in turn. Returns the names of those that timed out."""
+    timed_out = []
+    for kind, value, timeout in conditions:
+        try:
+            if kind == "network_idle":
+                await page.wait_for_load_state("networkidle", timeout=timeout)
+            elif kind == "selector":
+                await page.wait_for_selector(value, state="visible", timeout=timeout)
+            elif kind == "javascript":
+                await page.wait_for_function(value, timeout=timeout)
+            elif kind == "dom_stable":
+                quiet_ms = 500 if value is True else int(value)
+                await asyncio.wait_for(page.evaluate(DOM_STABLE_JS, quiet_ms), timeout / 1000)
+        except Exception:
+            print(f"Timed out after {timeout} ms waiting for {kind} on {page.url}")
+            timed_out.append(kind)
+    return timed_out
+
+async def capture_page(page, shot, wait_ms=WAIT_MS):
+    """Navigates an open tab to one shot's URL and saves a full-page screenshot.
+
+    Waits for the shot's readiness conditions, or the fixed wait when it has
+    none. Returns a timing record for the page, or None if the capture failed.
+    """
     url = shot["url"]
     output_file = shot["output"]
-    subprocess.run(["shot-scraper", url, "--auth", auth_file, "--wait", "3000", "--output", output_file])
\ No newline at end of file
+    try:
+        conditions = parse_conditions(shot)
+        start = time.perf_counter()
+        await page.goto(url, wait_until="load")
+        if conditions:
+            timed_out = await wait_until_ready(page, conditions)
+        else:
+            timed_out = []
+            await page.wait_for_timeout(shot.get("wait", wait_ms))
+        ready_ms = round((time.perf_counter() - start) * 1000)
+
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        await page.screenshot(path=output_file, full_page=True)
+        seconds = round(time.perf_counter() - start, 4)
+        print(f"Captured {url} -> {output_file} (ready after {ready_ms} ms)")
+        metrics.record("capture", url, seconds=seconds, ready_ms=ready_ms, bytes=os.path.getsize(output_file),
+                       timed_out=timed_out)
+        return {"url": url, "output": output_file, "ready_ms": ready_ms, "timed_out": timed_out}
+    except Exception as e:
+        print(f"Error capturing {url}: {e}")
+        metrics.record("capture", url, error=type(e).__name__)
+        return None
+
+async def new_auth_context(browser, auth_file=auth_file):
+    """Opens a browser context with the viewport and, if it exists, the session saved in auth_file."""
+    storage_state = auth_file if auth_file and os.path.exists(auth_file) else None
+    return await browser.new_context(viewport=VIEWPORT, storage_state=storage_state)
+
+async def capture_in_context(context, shots, tabs=4, wait_ms=WAIT_MS, on_capture=None):
+    """Captures shots on up to `tabs` tabs of an open browser context. See capture_with_browser."""
+    queue = asyncio.Queue()
+    for shot in shots:
+        queue.put_nowait(shot)
+
+    records = {}
+
+    async def worker():
+        page = await context.new_page()
+        try:
+            while True:
+                try:
+                    shot = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                record = await capture_page(page, shot, wait_ms)
+                if record:
+                    records[shot["output"]] = record
+                    if on_capture:
+                        await on_capture(shot, record)
+        finally:
+            await page.close()
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(tabs, len(shots))))))
+    return [records[shot["output"]] for shot in shots if shot["output"] in records]
+
+async def capture_with_browser(shots, auth_file=auth_file, tabs=4, wait_ms=WAIT_MS, on_capture=None):
+    """Captures all pages with one Playwright browser and one authenticated context.
+
+    Pages are spread over up to `tabs` tabs that each navigate from shot to
+    shot, so the browser start and the auth.json load happen once per run.
+    If given, the coroutine on_capture(shot, record) is awaited after each
+    successful capture, which lets callers start processing pages right away.
+    Returns the timing records of the pages captured successfully, in shot order.
+    """
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch()
+        try:
+            context = await new_auth_context(browser, auth_file)
+            return await capture_in_context(context, shots, tabs, wait_ms, on_capture)
+        finally:
+            await browser.close()
+
+def write_timings(records, path=timings_file):
+    """Writes per-page readiness timings and prints the slowest pages."""
+    atomic_write.write_json(path, records, indent=2)
+    slowest = sorted(records, key=lambda record: record["ready_ms"], reverse=True)[:5]
+    if slowest:
+        print("Slowest pages to become ready:")
+        for record in slowest:
+            print(f"  {record['ready_ms']:>6} ms  {record['url']}")
+
+def capture_screenshots(engine="playwright", tabs=4, metrics_file=metrics.REPORT_FILE, prometheus_file=None,
+                        force_login=False, shots_path=shots_file):
+    """Logs in if needed, then captures every page listed in shots_path into the screenshots directory.
+
+    Per-page capture times and sizes are written to the metrics_file run report.
+    """
+    login_config = load_yaml(login_file)
+    ensure_auth(login_config[0], auth_file, force=force_login)
+
+    shots = load_yaml(shots_path)
+    clear_screenshots(screenshots_dir)
+
+    print(f"Capturing screenshots for {len(shots)} pages")
+    if engine == "shot-scraper":
+        capture_with_shot_scraper(shots, auth_file)
+    else:
+        records = asyncio.run(capture_with_browser(shots, auth_file, tabs=tabs))
+        write_timings(records, timings_file)
+    metrics.write_report(metrics_file, prometheus_file)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Capture screenshots of the pages listed in shots.yml.")
+    parser.add_argument("--engine", choices=["playwright", "shot-scraper"], default="playwright",
+                        help="playwright reuses one browser for all pages; shot-scraper runs one process per page")
+    parser.add_argument("--tabs", type=int, default=4,
+                        help="number of pages captured in parallel by the playwright engine (default: 4)")
+    parser.add_argument("--shots", default=shots_file,
+                        help="pages to capture, e.g. crawled_shots.yml written by crawler.py (default: %(default)s)")
+    parser.add_argument("--force-login", action="store_true",
+                        help="log in again even if the session in auth.json is still valid")
+    parser.add_argument("--metrics-file", default=metrics.REPORT_FILE,
+                        help="JSON run report with per-page capture times (default: %(default)s)")
+    parser.add_argument("--prometheus-file", help="also write the run's metrics to this Prometheus textfile")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    capture_screenshots(engine=args.engine, tabs=args.tabs, metrics_file=args.metrics_file,
+                        prometheus_file=args.prometheus_file, force_login=args.force_login,
+                        shots_path=args.shots)
+
+if __name__ == "__main__":
+    main()
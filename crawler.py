@@ -0,0 +1,251 @@
+import os
+import re
+import time
+import asyncio
+import fnmatch
+import hashlib
+import argparse
+import urllib.parse
+
+import yaml
+
+import atomic_write
+import capture_screenshots
+
+crawl_file = "crawled_shots.yml"
+
+MAX_DEPTH = 3
+MAX_PAGES = 500
+# Following these would end the session the crawl runs in
+DEFAULT_EXCLUDE = ["*logout*", "*log-out*", "*signout*", "*sign_out*", "*sign-out*"]
+# Links only matter for discovery, so skip downloading what can't contain any
+BLOCKED_RESOURCES = ("image", "media", "font")
+NAVIGATION_TIMEOUT_MS = 15000
+
+# Tag structure plus visible text: identical for aliases of the same page
+# (e.g. / and /dashboard), but changes as soon as the content does
+DOM_FINGERPRINT_JS = """
+() => {
+    const parts = [];
+    const walker = document.createTreeWalker(document.body || document.documentElement, NodeFilter.SHOW_ELEMENT);
+    for (let node = walker.currentNode; node; node = walker.nextNode()) {
+        parts.push(node.tagName);
+    }
+    parts.push((document.body || document.documentElement).innerText);
+    return parts.join("|");
+}
+"""
+
+def normalize_url(url, keep_query=()):
+    """Normalizes a URL for deduplication.
+
+    Drops the fragment and the query string (except parameters listed in
+    keep_query, sorted), lowercases the scheme and host, removes default
+    ports and the trailing slash. Returns None for non-HTTP URLs.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https"):
+        return None
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not (scheme == "http" and port == 80 or scheme == "https" and port == 443):
+        host = f"{host}:{port}"
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = ""
+    if keep_query:
+        params = [(key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                  if key in keep_query]
+        query = urllib.parse.urlencode(sorted(params))
+    return urllib.parse.urlunsplit((scheme, host, path, query, ""))
+
+def origin(url):
+    parts = urllib.parse.urlsplit(url)
+    return parts.scheme, parts.netloc
+
+def matches(target, patterns):
+    """True if target matches any of the glob patterns, ignoring case on every platform."""
+    target = target.lower()
+    return any(fnmatch.fnmatchcase(target, pattern.lower()) for pattern in patterns)
+
+def is_allowed(url, seed_origin, include=None, exclude=None):
+    """True if url is on the seed's origin, matches an include pattern (if any)
+    and no exclude pattern. Patterns are globs matched against the path and
+    query, case-insensitively (so /LogOut is excluded like /logout)."""
+    if origin(url) != seed_origin:
+        return False
+    parts = urllib.parse.urlsplit(url)
+    target = parts.path + (f"?{parts.query}" if parts.query else "")
+    if include and not matches(target, include):
+        return False
+    return not matches(target, exclude or [])
+
+def output_name(url, screenshots_dir=capture_screenshots.screenshots_dir, taken=None):
+    """Derives a screenshot path from a URL's path, e.g. /admin/users -> screenshots/admin_users.png."""
+    parts = urllib.parse.urlsplit(url)
+    name = re.sub(r"[^A-Za-z0-9]+", "_", parts.path).strip("_").lower() or "index"
+    if parts.query:
+        name += "_" + re.sub(r"[^A-Za-z0-9]+", "_", parts.query).strip("_").lower()
+    candidate = name
+    counter = 2
+    while taken is not None and candidate in taken:
+        candidate = f"{name}_{counter}"
+        counter += 1
+    if taken is not None:
+        taken.add(candidate)
+    return os.path.join(screenshots_dir, f"{candidate}.png")
+
+async def crawl(seeds, auth_file=capture_screenshots.auth_file, tabs=8, max_depth=MAX_DEPTH,
+                max_pages=MAX_PAGES, include=None, exclude=DEFAULT_EXCLUDE, keep_query=(),
+                screenshots_dir=capture_screenshots.screenshots_dir, login_url=None):
+    """Discovers pages by following same-origin links from the seed URLs.
+
+    Up to `tabs` tabs of one authenticated browser context work through a
+    shared frontier, breadth first, down to max_depth links from a seed.
+    Each normalized URL is visited once and at most max_pages URLs are ever
+    queued, so the frontier stays bounded on apps with thousands of routes.
+    Pages that redirect to login_url or whose DOM matches a page already
+    found are skipped. Returns [{"url": ..., "output": ...}] in discovery order.
+    """
+    from playwright.async_api import async_playwright
+
+    seeds = [normalize_url(seed, keep_query) for seed in seeds]
+    seed_origin = origin(seeds[0])
+    login_url = normalize_url(login_url, keep_query) if login_url else None
+
+    frontier = asyncio.Queue()
+    seen = set()
+    for seed in seeds:
+        if seed not in seen:
+            seen.add(seed)
+            frontier.put_nowait((seed, 0, len(seen)))
+
+    found = []  # (discovery order, url)
+    fingerprints = {}
+    skipped = {"duplicate": 0, "redirected": 0, "failed": 0}
+
+    async def block_resources(route):
+        if route.request.resource_type in BLOCKED_RESOURCES:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def enqueue(links, depth):
+        for link in links:
+            url = normalize_url(link, keep_query)
+            if not url or url in seen or len(seen) >= max_pages:
+                continue
+            if not is_allowed(url, seed_origin, include, exclude):
+                continue
+            seen.add(url)
+            frontier.put_nowait((url, depth, len(seen)))
+
+    async def visit(page, url, depth, order):
+        try:
+            await page.goto(url, wait_until="domcontentloaded", timeout=NAVIGATION_TIMEOUT_MS)
+        except Exception as e:
+            print(f"Error loading {url}: {e}")
+            skipped["failed"] += 1
+            return
+        final_url = normalize_url(page.url, keep_query)
+        if login_url and final_url == login_url and url != login_url:
+            print(f"Skipping {url} (redirected to the login page)")
+            skipped["redirected"] += 1
+            return
+        try:
+            fingerprint = hashlib.sha256((await page.evaluate(DOM_FINGERPRINT_JS)).encode("utf-8")).hexdigest()
+            links = await page.eval_on_selector_all("a[href]", "links => links.map(link => link.href)")
+        except Exception as e:
+            print(f"Error reading {url}: {e}")
+            skipped["failed"] += 1
+            return
+
+        if fingerprint in fingerprints:
+            print(f"Skipping {url} (same page as {fingerprints[fingerprint]})")
+            skipped["duplicate"] += 1
+        else:
+            fingerprints[fingerprint] = url
+            found.append((order, url))
+            print(f"Found {url} (depth {depth})")
+        if depth < max_depth:
+            enqueue(links, depth + 1)
+
+    async def worker(context):
+        page = await context.new_page()
+        try:
+            while True:
+                url, depth, order = await frontier.get()
+                try:
+                    await visit(page, url, depth, order)
+                finally:
+                    frontier.task_done()
+        finally:
+            await page.close()
+
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch()
+        storage_state = auth_file if auth_file and os.path.exists(auth_file) else None
+        context = await browser.new_context(viewport=capture_screenshots.VIEWPORT, storage_state=storage_state)
+        await context.route("**/*", block_resources)
+        workers = [asyncio.create_task(worker(context)) for _ in range(max(1, tabs))]
+        try:
+            await frontier.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await browser.close()
+
+    print(f"Crawled {len(seen)} URLs: {len(found)} pages, {skipped['duplicate']} duplicates, "
+          f"{skipped['redirected']} redirected to login, {skipped['failed']} failed")
+    if len(seen) >= max_pages:
+        print(f"Stopped queueing new URLs after {max_pages} (raise --max-pages to crawl further)")
+
+    taken = set()
+    return [{"url": url, "output": output_name(url, screenshots_dir, taken)} for _, url in sorted(found)]
+
+def write_shots(shots, path=crawl_file):
+    """Writes a crawled page list in the shots.yml format."""
+    atomic_write.write_text(path, yaml.safe_dump(shots, sort_keys=False))
+    print(f"Wrote {len(shots)} pages to {path}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Discover pages by crawling the app and write a shots file.")
+    parser.add_argument("--seed", action="append",
+                        help="URL to start from; repeat for several (default: the url in login.yml)")
+    parser.add_argument("--tabs", type=int, default=8, help="pages loaded in parallel (default: 8)")
+    parser.add_argument("--max-depth", type=int, default=MAX_DEPTH,
+                        help="follow links at most this many clicks from a seed (default: %(default)s)")
+    parser.add_argument("--max-pages", type=int, default=MAX_PAGES,
+                        help="stop queueing new URLs after this many (default: %(default)s)")
+    parser.add_argument("--include", action="append",
+                        help="only crawl paths matching this glob, e.g. '/admin/*'; repeatable")
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="skip paths matching this glob; repeatable, added to the logout patterns")
+    parser.add_argument("--keep-query", action="append", default=[],
+                        help="query parameter that makes a page distinct (all others are dropped); repeatable")
+    parser.add_argument("--output", default=crawl_file,
+                        help="shots file to write (default: %(default)s); pass it to capture with --shots")
+    parser.add_argument("--force-login", action="store_true",
+                        help="log in again even if the session in auth.json is still valid")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+
+    login_config = capture_screenshots.load_yaml(capture_screenshots.login_file)[0]
+    capture_screenshots.ensure_auth(login_config, capture_screenshots.auth_file, force=args.force_login)
+
+    seeds = args.seed or [login_config.get("probe_url") or login_config["url"]]
+    shots = asyncio.run(crawl(seeds, capture_screenshots.auth_file, tabs=args.tabs, max_depth=args.max_depth,
+                              max_pages=args.max_pages, include=args.include,
+                              exclude=DEFAULT_EXCLUDE + args.exclude, keep_query=args.keep_query,
+                              login_url=login_config["url"]))
+    write_shots(shots, args.output)
+    print(f"Done in {time.perf_counter() - start:.1f} s.")
+
+if __name__ == "__main__":
+    main()
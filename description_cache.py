@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import hashlib
+import shutil
+
+import atomic_write
+
+# Descriptions are stored one JSON file per entry, sharded by the first two
+# characters of the key so large guides don't end up with one huge directory.
+DEFAULT_CACHE_DIR = os.path.join(".autodoc_cache", "descriptions")
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = 30
+
+def cache_key(image_bytes, prompt, model, max_tokens, extra=None):
+    """Returns the cache key for one vision request.
+
+    The key covers everything that influences the answer: the image content,
+    the prompt text, the model name and max_tokens. Anything else that changes
+    the request (e.g. preprocessing settings) can be passed in extra.
+    """
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_bytes).digest())
+    request = {"prompt": prompt, "model": model, "max_tokens": max_tokens, "extra": extra}
+    digest.update(json.dumps(request, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, key[:2], f"{key}.json")
+
+def load_description(key, cache_dir=DEFAULT_CACHE_DIR, max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """Returns the cached description for key, or None on a miss."""
+    path = _entry_path(key, cache_dir)
+    try:
+        # An entry's age is the time since it was last used
+        if max_age_days is not None and time.time() - os.path.getmtime(path) > max_age_days * 86400:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # Touch the entry so eviction drops the least recently used first
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return entry.get("description")
+
+def store_description(key, description, cache_dir=DEFAULT_CACHE_DIR):
+    """Stores a description under key. Writes are atomic so concurrent workers are safe."""
+    path = _entry_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write.write_json(path, {"created": time.time(), "description": description})
+
+def prune_cache(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """Evicts entries unused for max_age_days, then least recently used ones until the cache fits in max_bytes."""
+    if not os.path.exists(cache_dir):
+        return 0
+
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    now = time.time()
+    removed = 0
+    total = 0
+    kept = []
+    for mtime, size, path in entries:
+        if max_age_days is not None and now - mtime > max_age_days * 86400:
+            os.remove(path)
+            removed += 1
+        else:
+            kept.append((mtime, size, path))
+            total += size
+
+    if max_bytes is not None:
+        # Oldest access first
+        kept.sort()
+        for mtime, size, path in kept:
+            if total <= max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+
+    if removed:
+        print(f"Evicted {removed} cached descriptions from {cache_dir}")
+    return removed
+
+def purge_cache(cache_dir=DEFAULT_CACHE_DIR):
+    """Deletes every cached description."""
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+        print(f"Purged description cache: {cache_dir}")
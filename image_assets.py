@@ -0,0 +1,251 @@
+import os
+import re
+import html
+import time
+import hashlib
+
+from PIL import Image
+
+import atomic_write
+
+# Resized copies of the images a document embeds, written next to the document
+# and named by the hash of the source image, so a screenshot used by several
+# chapters (or saved under several names) is processed and embedded once, and
+# unchanged screenshots are not processed again on the next run.
+ASSETS_DIR = "assets"
+
+# PDF pages are Letter/A4 with 1 in margins and the body's own 20 px margins,
+# leaving about 6.1 in for an image. Anything beyond print DPI at that width
+# only makes the PDF bigger.
+PRINT_WIDTH_INCHES = 6.1
+PRINT_DPI = 150
+PRINT_QUALITY = 80
+# Tried in turn, after PRINT_DPI/PRINT_QUALITY, until the images fit the PDF budget
+BUDGET_STEPS = ((120, 70), (96, 60), (72, 50))
+
+# Widths offered to browsers in srcset; the middle one is the fallback src.
+# The sidebar leaves the screen layout's content column about 870 px wide.
+SCREEN_WIDTHS = (480, 960, 1440)
+SCREEN_QUALITY = 80
+SCREEN_SIZES = "(max-width: 1200px) 100vw, 870px"
+
+# Chapter list thumbnails show the top of the page, where its header and
+# navigation make it recognisable, rather than a sliver of a tall screenshot
+THUMBNAIL_WIDTH = 320
+THUMBNAIL_HEIGHT = 200
+
+# Variants of replaced screenshots and unused budget steps are removed once
+# nothing has referenced them for this long
+ASSET_MAX_AGE_DAYS = 30
+
+IMG_TAG_PATTERN = re.compile(r'<img\b[^>]*>')
+SRC_ATTRIBUTE_PATTERN = re.compile(r'\ssrc="([^"]+)"')
+
+def is_local(src):
+    return not re.match(r'^[a-z]+:', src) and not src.startswith('/')
+
+def local_sources(html_doc):
+    """The distinct local image paths an HTML document references, in order."""
+    sources = []
+    for tag in IMG_TAG_PATTERN.findall(html_doc):
+        match = SRC_ATTRIBUTE_PATTERN.search(tag)
+        if match and is_local(html.unescape(match.group(1))) and html.unescape(match.group(1)) not in sources:
+            sources.append(html.unescape(match.group(1)))
+    return sources
+
+def flatten(image):
+    """image as RGB, with any transparency composited onto white."""
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+def write_variant(image, path, width, image_format, quality):
+    """Saves image shrunk (never enlarged) to width as image_format. Returns its size."""
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+    with atomic_write.replacing(path) as tmp_file:
+        image.save(tmp_file, image_format, quality=quality)
+    return image.size
+
+class ImageAssets:
+    """Writes and references resized copies of a document's images.
+
+    Print variants are single JPEGs at print DPI for the PDF page width,
+    stepped down through BUDGET_STEPS while their total size exceeds
+    pdf_budget bytes. Screen variants are WebP files at SCREEN_WIDTHS,
+    referenced through srcset with lazy loading. Paths in the HTML are
+    relative to base_dir, the directory the document is written to; image
+    paths are resolved against source_dir, which defaults to base_dir.
+    """
+
+    def __init__(self, base_dir=".", assets_dir=ASSETS_DIR, print_dpi=PRINT_DPI, print_quality=PRINT_QUALITY,
+                 pdf_budget=None, source_dir=None):
+        self.base_dir = base_dir
+        self.source_dir = source_dir or base_dir
+        self.assets_dir = assets_dir
+        self.print_settings = (print_dpi, print_quality)
+        self.steps = [(print_dpi, print_quality)] + [step for step in BUDGET_STEPS if step[0] < print_dpi]
+        self.pdf_budget = pdf_budget
+        self._sources = {}
+
+    def source(self, src):
+        """(content hash, width, height) of a referenced image, or None if it can't be read."""
+        path = os.path.join(self.source_dir, src)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        if key not in self._sources:
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:20]
+            try:
+                with Image.open(path) as image:
+                    size = image.size
+            except OSError:
+                return None
+            self._sources[key] = (digest,) + size
+        return self._sources[key]
+
+    def variants(self, src, wanted):
+        """Writes the missing variants of src. wanted is [(file name, width, format, quality)];
+        returns {file name: (width, height)} in the same order."""
+        os.makedirs(os.path.join(self.base_dir, self.assets_dir), exist_ok=True)
+        _, source_width, source_height = self.source(src)
+        sizes = {}
+        image = None
+        for name, width, image_format, quality in wanted:
+            path = os.path.join(self.base_dir, self.assets_dir, name)
+            if os.path.exists(path):
+                # Mark as recently used so pruning keeps it
+                os.utime(path)
+                width = min(width, source_width)
+                sizes[name] = (width, max(1, round(source_height * width / source_width)))
+                continue
+            if image is None:
+                with Image.open(os.path.join(self.source_dir, src)) as opened:
+                    image = flatten(opened) if image_format == "JPEG" else opened.convert("RGBA")
+            sizes[name] = write_variant(image, path, width, image_format, quality)
+        return sizes
+
+    def print_variant(self, src, settings=None):
+        """(relative path, size) of src's print variant, or None if src can't be read."""
+        source = self.source(src)
+        if source is None:
+            return None
+        dpi, quality = settings or self.print_settings
+        name = f"{source[0]}-{dpi}dpi-q{quality}.jpg"
+        width = round(PRINT_WIDTH_INCHES * dpi)
+        size = self.variants(src, [(name, width, "JPEG", quality)])[name]
+        return f"{self.assets_dir}/{name}", size
+
+    def fit_budget(self, sources):
+        """Picks the first print setting whose variants of sources fit in pdf_budget bytes.
+
+        Images with the same content count once, as WeasyPrint embeds them once.
+        Returns the total size of the chosen variants.
+        """
+        unique = {}
+        for src in sources:
+            source = self.source(src)
+            if source is not None:
+                unique.setdefault(source[0], src)
+        total = 0
+        for settings in self.steps:
+            variants = [self.print_variant(src, settings) for src in unique.values()]
+            total = sum(os.path.getsize(os.path.join(self.base_dir, path)) for path, _ in variants)
+            self.print_settings = settings
+            if self.pdf_budget is None or total <= self.pdf_budget:
+                break
+        else:
+            print(f"Warning: images alone take {total / 1e6:.1f} MB, over the "
+                  f"{self.pdf_budget / 1e6:.1f} MB PDF budget even at {self.print_settings[0]} DPI")
+            return total
+        if self.print_settings != self.steps[0]:
+            print(f"Images reduced to {self.print_settings[0]} DPI, quality {self.print_settings[1]} "
+                  f"({total / 1e6:.1f} MB) to fit the {self.pdf_budget / 1e6:.1f} MB PDF budget")
+        return total
+
+    def check_budget(self, pdf_file):
+        """Warns if pdf_file came out larger than pdf_budget."""
+        if self.pdf_budget is not None and os.path.exists(pdf_file) and os.path.getsize(pdf_file) > self.pdf_budget:
+            print(f"Warning: {pdf_file} is {os.path.getsize(pdf_file) / 1e6:.1f} MB, over the "
+                  f"{self.pdf_budget / 1e6:.1f} MB budget")
+
+    def prune(self, max_age_days=ASSET_MAX_AGE_DAYS):
+        """Deletes variants that haven't been referenced for max_age_days."""
+        assets_path = os.path.join(self.base_dir, self.assets_dir)
+        if not os.path.isdir(assets_path):
+            return
+        cutoff = time.time() - max_age_days * 86400
+        for name in os.listdir(assets_path):
+            path = os.path.join(assets_path, name)
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+    def screen_variants(self, src):
+        """([(relative path, width)], (width, height) of the largest) for src, or None."""
+        source = self.source(src)
+        if source is None:
+            return None
+        digest, source_width, _ = source
+        widths = sorted({min(width, source_width) for width in SCREEN_WIDTHS})
+        wanted = [(f"{digest}-{width}w.webp", width, "WEBP", SCREEN_QUALITY) for width in widths]
+        sizes = self.variants(src, wanted)
+        return ([(f"{self.assets_dir}/{name}", sizes[name][0]) for name, _, _, _ in wanted],
+                sizes[wanted[-1][0]])
+
+    def thumbnail(self, src, width=THUMBNAIL_WIDTH, height=THUMBNAIL_HEIGHT):
+        """(relative path, (width, height)) of a WebP thumbnail of the top of src, or None."""
+        source = self.source(src)
+        if source is None:
+            return None
+        digest, source_width, source_height = source
+        name = f"{digest}-thumb{width}x{height}.webp"
+        path = os.path.join(self.base_dir, self.assets_dir, name)
+        scale = min(1.0, width / source_width)
+        size = (round(source_width * scale), min(height, max(1, round(source_height * scale))))
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with Image.open(os.path.join(self.source_dir, src)) as image:
+                top = image.convert("RGBA").crop((0, 0, source_width, round(size[1] / scale)))
+            size = write_variant(top, path, size[0], "WEBP", SCREEN_QUALITY)
+        return f"{self.assets_dir}/{name}", size
+
+    def _rewrite(self, html_doc, replace_tag):
+        def replace(match):
+            tag = match.group(0)
+            src = SRC_ATTRIBUTE_PATTERN.search(tag)
+            if not src or not is_local(html.unescape(src.group(1))):
+                return tag
+            return replace_tag(tag, html.unescape(src.group(1))) or tag
+        return IMG_TAG_PATTERN.sub(replace, html_doc)
+
+    def print_html(self, html_doc):
+        """html_doc with its local images replaced by their print variants."""
+        def replace_tag(tag, src):
+            variant = self.print_variant(src)
+            if variant is None:
+                return None
+            return SRC_ATTRIBUTE_PATTERN.sub(lambda _: f' src="{html.escape(variant[0])}"', tag, count=1)
+        return self._rewrite(html_doc, replace_tag)
+
+    def screen_html(self, html_doc):
+        """html_doc with its local images served from screen variants through srcset,
+        loaded lazily and with their size set so the page doesn't jump as they arrive."""
+        def replace_tag(tag, src):
+            variants = self.screen_variants(src)
+            if variants is None:
+                return None
+            paths, (width, height) = variants
+            fallback = paths[len(paths) // 2][0]
+            srcset = ", ".join(f"{html.escape(path)} {variant_width}w" for path, variant_width in paths)
+            attributes = (f' src="{html.escape(fallback)}" srcset="{srcset}" sizes="{SCREEN_SIZES}" '
+                          f'width="{width}" height="{height}" loading="lazy" decoding="async"')
+            return SRC_ATTRIBUTE_PATTERN.sub(lambda _: attributes, tag, count=1)
+        return self._rewrite(html_doc, replace_tag)
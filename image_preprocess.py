@@ -0,0 +1,90 @@
+import io
+
+from PIL import Image
+
+# The Vision API scales high-detail images to fit in 2048x2048 before tiling, so
+# anything larger only costs upload bytes and latency.
+DEFAULT_OPTIONS = {
+    "max_width": 2048,
+    "max_height": 2048,
+    "image_format": "jpeg",
+    "quality": 85,
+    "detail": None,  # "low", "high" or "auto"; None leaves it to the API
+}
+
+FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+
+def sniff_mime_type(data):
+    """Returns the MIME type of image bytes from their magic number, not the file extension."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    return None
+
+def prepare_image(data, max_width=2048, max_height=2048, image_format="jpeg", quality=85):
+    """Downscales and re-encodes an image before upload.
+
+    The image is shrunk (never enlarged) to fit max_width x max_height and
+    re-encoded as image_format ("jpeg", "webp" or "png"; None keeps the
+    original format). Returns (bytes, mime_type). If re-encoding an image
+    that didn't need resizing would make it larger, the original is kept.
+    """
+    original_mime = sniff_mime_type(data)
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        resized = image.width > max_width or image.height > max_height
+        if not resized and image_format is None:
+            return data, original_mime or Image.MIME.get(image.format, "image/png")
+
+        if resized:
+            image.thumbnail((max_width, max_height), Image.LANCZOS)
+
+        if image_format is None:
+            image_format = {"image/jpeg": "jpeg", "image/webp": "webp"}.get(original_mime, "png")
+        pil_format, mime_type = FORMATS[image_format]
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        if pil_format == "PNG":
+            image.save(output, pil_format, optimize=True)
+        else:
+            image.save(output, pil_format, quality=quality)
+
+    prepared = output.getvalue()
+    if len(prepared) >= len(data) and not resized and original_mime:
+        return data, original_mime
+    return prepared, mime_type
+
+# How the Vision API counts a high-detail image: scaled to fit in 2048x2048,
+# then so its shortest side is at most 768, and charged per 512 px tile
+API_MAX_SIDE = 2048
+API_SHORT_SIDE = 768
+TILE_SIDE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+
+def fitted_size(size, max_width, max_height):
+    """The size an image of size (width, height) is shrunk to by thumbnail((max_width, max_height))."""
+    width, height = size
+    scale = min(1.0, max_width / width, max_height / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def estimate_tokens(size, detail=None):
+    """Estimates the prompt tokens the Vision API charges for an image of size (width, height)."""
+    if detail == "low":
+        return BASE_TOKENS
+    width, height = fitted_size(size, API_MAX_SIDE, API_MAX_SIDE)
+    scale = min(1.0, API_SHORT_SIDE / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = -(-width // TILE_SIDE) * -(-height // TILE_SIDE)
+    return BASE_TOKENS + TILE_TOKENS * int(tiles)
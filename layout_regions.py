@@ -0,0 +1,173 @@
+import io
+from collections import Counter
+
+from PIL import Image
+
+# Reserved screenshot name for the shared page chrome; it becomes the 00_Common_Layout
+# chapter, which sorts before every page's chapter, and is never treated as a page
+LAYOUT_IMAGE = "00_common_layout.png"
+
+TILE_SIZE = 16
+# A tile is shared if this fraction of the screenshots has the same pixels there
+SHARED_RATIO = 1.0
+# A row or column belongs to the shared chrome if this fraction of its tiles is
+# shared. Anything less lets a band run through a page's own title or table,
+# which would then be cropped away before the model ever sees it.
+BAND_RATIO = 1.0
+MIN_PAGES = 3
+# Enough screenshots to tell the shared chrome apart without hashing every page
+SAMPLE_SIZE = 50
+# Cropping must leave at least this fraction of the width/height as page content
+MIN_CONTENT_RATIO = 0.25
+MASK_COLOR = (224, 224, 224)
+
+def tile_grid(image, rows, from_bottom=False, tile_size=TILE_SIZE):
+    """Hashes rows x (width // tile_size) tiles, counted from the top or the bottom edge.
+
+    Each strip of tiles is transposed so every tile's pixels are one
+    contiguous slice of bytes, instead of cropping tile by tile.
+    """
+    columns = image.width // tile_size
+    tile_bytes = tile_size * tile_size
+    grid = []
+    for row in range(rows):
+        top = image.height - (row + 1) * tile_size if from_bottom else row * tile_size
+        strip = image.crop((0, top, columns * tile_size, top + tile_size)).transpose(Image.Transpose.TRANSPOSE)
+        data = strip.tobytes()
+        grid.append([hash(data[col * tile_bytes:(col + 1) * tile_bytes]) for col in range(columns)])
+    return grid
+
+def shared_tiles(grids, ratio=SHARED_RATIO):
+    """Marks each tile position whose most common hash appears in at least ratio of the grids."""
+    needed = max(2, ratio * len(grids))
+    rows, columns = len(grids[0]), len(grids[0][0])
+    return [[Counter(grid[row][col] for grid in grids).most_common(1)[0][1] >= needed
+             for col in range(columns)] for row in range(rows)]
+
+def leading_band(lines, ratio=BAND_RATIO):
+    """Counts the lines (rows or columns of booleans) from the start that are mostly shared."""
+    count = 0
+    for line in lines:
+        if not line or sum(line) < ratio * len(line):
+            break
+        count += 1
+    return count
+
+def is_blank(image, box):
+    """True if box of a greyscale image is a single colour, i.e. cuts through no content."""
+    low, high = image.crop(box).getextrema()
+    return low == high
+
+def snap_to_blank(image, margins):
+    """Moves each margin back towards its edge until the line it cuts along is blank,
+    so the crop never splits text or a table that merely looks the same on every
+    page (a title's first letters, a table's striped rows)."""
+    left, top, right, bottom = margins
+    width, height = image.size
+    while top and not is_blank(image, (left, top - 1, width - right, top)):
+        top -= 1
+    while bottom and not is_blank(image, (left, height - bottom, width - right, height - bottom + 1)):
+        bottom -= 1
+    while left and not is_blank(image, (left - 1, top, left, height - bottom)):
+        left -= 1
+    while right and not is_blank(image, (width - right, top, width - right + 1, height - bottom)):
+        right -= 1
+    return left, top, right, bottom
+
+def detect_layout(image_paths, tile_size=TILE_SIZE, sample_size=SAMPLE_SIZE):
+    """Finds the header, footer and side bands that are identical across screenshots.
+
+    Headers and sidebars are compared from the top edge and footers from the
+    bottom edge, so pages of different heights still line up. A band is
+    chrome only if every tile in it is identical across the screenshots, and
+    each margin is then moved back to a line that is blank on every sampled
+    page (see snap_to_blank). Only screenshots
+    of the most common width are compared, and at most sample_size of them,
+    spread evenly over the set. Returns margins in pixels as
+    (left, top, right, bottom), or None if there is no usable shared chrome.
+    """
+    sizes = {}
+    for path in image_paths:
+        with Image.open(path) as image:
+            sizes[path] = image.size
+    if len(sizes) < MIN_PAGES:
+        return None
+    width = Counter(size[0] for size in sizes.values()).most_common(1)[0][0]
+    paths = [path for path in image_paths if sizes[path][0] == width]
+    if len(paths) < MIN_PAGES:
+        return None
+    if len(paths) > sample_size:
+        step = len(paths) / sample_size
+        paths = [paths[int(i * step)] for i in range(sample_size)]
+
+    rows = min(sizes[path][1] for path in paths) // tile_size
+    columns = width // tile_size
+    if rows < 2 or columns < 2:
+        return None
+    top_grids = []
+    bottom_grids = []
+    for path in paths:
+        with Image.open(path) as image:
+            image = image.convert("L")
+        top_grids.append(tile_grid(image, rows, tile_size=tile_size))
+        bottom_grids.append(tile_grid(image, rows, from_bottom=True, tile_size=tile_size))
+
+    top_shared = shared_tiles(top_grids)
+    bottom_shared = shared_tiles(bottom_grids)
+
+    top = leading_band(top_shared)
+    bottom = leading_band(bottom_shared)
+    if top + bottom >= rows:
+        # Every page looks the same; there's no content area to tell apart
+        return None
+    # Side bands are judged on the rows between header and footer
+    body = top_shared[top:rows - bottom] or top_shared
+    left = leading_band([[row[col] for row in body] for col in range(columns)])
+    right = leading_band([[row[col] for row in body] for col in reversed(range(columns))])
+
+    # Margins only shrink, so once a pass over the samples changes nothing,
+    # every margin lies on a blank line in all of them
+    margins = tuple(count * tile_size for count in (left, top, right, bottom))
+    changed = True
+    while changed and any(margins):
+        changed = False
+        for path in paths:
+            with Image.open(path) as image:
+                snapped = snap_to_blank(image.convert("L"), margins)
+            changed = changed or snapped != margins
+            margins = snapped
+    left, top, right, bottom = (margin / tile_size for margin in margins)
+    if not any(margins) or (columns - left - right) < MIN_CONTENT_RATIO * columns:
+        return None
+    if (rows - top - bottom) < MIN_CONTENT_RATIO * rows:
+        return None
+    return margins
+
+def content_box(size, margins):
+    """The crop box left after removing the margins, or None if too little would remain."""
+    width, height = size
+    left, top, right, bottom = margins
+    box = (left, top, width - right, height - bottom)
+    if box[2] - box[0] < TILE_SIZE or box[3] - box[1] < TILE_SIZE:
+        return None
+    return box
+
+def crop_image(data, margins):
+    """Returns PNG bytes of just the page-specific content area, or data unchanged if it can't be cropped."""
+    with Image.open(io.BytesIO(data)) as image:
+        box = content_box(image.size, margins)
+        if box is None:
+            return data
+        output = io.BytesIO()
+        image.crop(box).save(output, "PNG")
+    return output.getvalue()
+
+def write_layout_image(image_path, margins, output_path):
+    """Saves a copy of one screenshot with its content area greyed out, showing only the shared chrome."""
+    with Image.open(image_path) as image:
+        image = image.convert("RGB")
+        box = content_box(image.size, margins)
+        if box:
+            image.paste(MASK_COLOR, box)
+        image.save(output_path, "PNG")
+    return output_path
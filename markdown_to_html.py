@@ -1,230 +1,52 @@
 import markdown
-import sys
 import os
 import glob
 import re
+import io
+import hashlib
+import time
+import threading
+import contextlib
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
-try:
-    from weasyprint import HTML, CSS
-    WEASYPRINT_AVAILABLE = True
-except ImportError:
-    WEASYPRINT_AVAILABLE = False
-    print("Warning: weasyprint not available. Install with: pip install weasyprint")
+import atomic_write
+import image_assets
+import metrics
 
-def translate_github_urls(text):
-    """Translate GitHub blob URLs to raw URLs for proper image display"""
-    # Pattern to match GitHub blob URLs
-    pattern = r'https://github\.com/([^/]+/[^/]+)/blob/([^/]+)/(.+)'
-    
-    def replace_url(match):
-        owner_repo = match.group(1)
-        branch = match.group(2)
-        path = match.group(3)
-        return f'https://github.com/{owner_repo}/raw/refs/heads/{branch}/{path}'
-    
-    # Replace all occurrences
-    return re.sub(pattern, replace_url, text)
-
-def convert_markdown_to_html(input_file, output_file=None):
-    # Read the markdown file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        markdown_text = f.read()
-    
-    # Translate GitHub URLs before processing
-    markdown_text = translate_github_urls(markdown_text)
-    
-    # Convert markdown to HTML with more extensions for better link/image handling
-    html = markdown.markdown(markdown_text, extensions=[
-        'fenced_code', 
-        'codehilite',
-        'tables',
-        'toc',
-        'attr_list',
-        'def_list',
-        'footnotes',
-        'md_in_html',
-        'nl2br'
-    ])
-    
-    # Create a complete HTML document
-    html_doc = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <title>{os.path.basename(input_file)}</title>
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            line-height: 1.6;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 20px;
-        }}
-        pre {{
-            background-color: #f4f4f4;
-            padding: 10px;
-            border-radius: 5px;
-            overflow-x: auto;
-        }}
-        code {{
-            font-family: Consolas, Monaco, 'Andale Mono', monospace;
-        }}
-        img {{
-            max-width: 100%;
-            height: auto;
-            display: block;
-            margin: 10px auto;
-        }}
-        a {{
-            color: #007bff;
-            text-decoration: none;
-        }}
-        a:hover {{
-            text-decoration: underline;
-        }}
-        table {{
-            border-collapse: collapse;
-            width: 100%;
-            margin: 10px 0;
-        }}
-        th, td {{
-            border: 1px solid #ddd;
-            padding: 8px;
-            text-align: left;
-        }}
-        th {{
-            background-color: #f2f2f2;
-        }}
-    </style>
-</head>
-<body>
-{html}
-</body>
-</html>"""
-    
-    # Write to output file or print to console
-    if output_file:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(html_doc)
-        print(f"Successfully converted {input_file} to {output_file}")
-    else:
-        print(html_doc)
+# WeasyPrint takes far longer to import than the rest of this module, so it is
+# loaded on first use and HTML-only conversions never pay for it
+_weasyprint = None
 
-def html_to_pdf(html_file, pdf_file):
-    """Convert HTML file to PDF using weasyprint"""
-    if not WEASYPRINT_AVAILABLE:
-        print("Error: weasyprint is required for PDF generation. Install with: pip install weasyprint")
-        return False
-    
-    try:
-        # Read the HTML file
-        with open(html_file, 'r', encoding='utf-8') as f:
-            html_content = f.read()
-        
-        # Get the directory of the HTML file for base_url
-        html_dir = os.path.dirname(os.path.abspath(html_file))
-        
-        # Convert to PDF using base_url for proper resource resolution
-        # This allows WeasyPrint to resolve relative paths correctly
-        html_doc = HTML(string=html_content, base_url=f"file://{html_dir}/")
-        html_doc.write_pdf(pdf_file)
-        print(f"Successfully converted {html_file} to {pdf_file}")
-        return True
-    except Exception as e:
-        print(f"Error converting to PDF: {str(e)}")
-        return False
-
-def convert_directory(input_dir='.', output_dir='html', pdf_output=False):
-    # Create output directory if it doesn't exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-        print(f"Created output directory: {output_dir}")
-    
-    # Find all markdown files in the input directory
-    md_files = glob.glob(os.path.join(input_dir, '*.md'))
-    
-    if not md_files:
-        print(f"No markdown files found in {input_dir}")
-        return
-    
-    # Convert each markdown file
-    for md_file in md_files:
-        # Get the base filename without extension
-        base_name = os.path.splitext(os.path.basename(md_file))[0]
-        # Create output filename
-        html_file = os.path.join(output_dir, f"{base_name}.html")
-        
+def weasyprint_available():
+    """Imports WeasyPrint if it hasn't been yet. Returns whether it is usable."""
+    global _weasyprint
+    if _weasyprint is None:
         try:
-            convert_markdown_to_html(md_file, html_file)
-            
-            # Convert to PDF if requested
-            if pdf_output:
-                pdf_file = os.path.join(output_dir, f"{base_name}.pdf")
-                html_to_pdf(html_file, pdf_file)
-                
-        except Exception as e:
-            print(f"Error converting {md_file}: {str(e)}")
+            import weasyprint
+            _weasyprint = weasyprint
+        except (ImportError, OSError):
+            _weasyprint = False
+            print("Warning: weasyprint not available. Install with: pip install weasyprint")
+    return bool(_weasyprint)
 
-def convert_to_single_html(input_dir='.', output_file='combined_documentation.html', pdf_output=False):
-    # Find all markdown files in the input directory
-    md_files = glob.glob(os.path.join(input_dir, '*.md'))
-    
-    if not md_files:
-        print(f"No markdown files found in {input_dir}")
-        return
-    
-    # Sort files for consistent ordering
-    md_files.sort()
-    
-    # Create the HTML document structure
-    html_parts = []
-    toc_items = []
-    
-    for i, md_file in enumerate(md_files):
-        try:
-            # Read the markdown file
-            with open(md_file, 'r', encoding='utf-8') as f:
-                markdown_text = f.read()
-            
-            # Translate GitHub URLs before processing
-            markdown_text = translate_github_urls(markdown_text)
-            
-            # Convert markdown to HTML with more extensions for better link/image handling
-            html_content = markdown.markdown(markdown_text, extensions=[
-                'fenced_code', 
-                'codehilite',
-                'tables',
-                'toc',
-                'attr_list',
-                'def_list',
-                'footnotes',
-                'md_in_html',
-                'nl2br'
-            ])
-            
-            # Create section with anchor
-            base_name = os.path.splitext(os.path.basename(md_file))[0]
-            section_id = f"section-{i}"
-            toc_items.append(f'<li><a href="#{section_id}">{base_name}</a></li>')
-            
-            html_parts.append(f'''
-            <section id="{section_id}">
-                <h1>{base_name}</h1>
-                <hr>
-                {html_content}
-            </section>
-            ''')
-            
-        except Exception as e:
-            print(f"Error processing {md_file}: {str(e)}")
-    
-    # Create complete HTML document
-    toc_html = '\n'.join(toc_items)
-    content_html = '\n'.join(html_parts)
-    
-    # Use print-friendly CSS for PDF output
-    if pdf_output:
-        css_styles = """
+MARKDOWN_EXTENSIONS = [
+    'fenced_code', 
+    'codehilite',
+    'tables',
+    'toc',
+    'attr_list',
+    'def_list',
+    'footnotes',
+    'md_in_html',
+    'nl2br'
+]
+
+# Stylesheets for the combined document: print-friendly for PDF output,
+# with a fixed sidebar table of contents for the browser
+PRINT_CSS = """
         body {
             font-family: Arial, sans-serif;
             line-height: 1.6;
@@ -310,8 +132,8 @@ def convert_to_single_html(input_dir='.', output_file='combined_documentation.ht
             margin: 1in;
         }
         """
-    else:
-        css_styles = """
+
+SCREEN_CSS = """
         body {
             font-family: Arial, sans-serif;
             line-height: 1.6;
@@ -409,9 +231,252 @@ def convert_to_single_html(input_dir='.', output_file='combined_documentation.ht
             background-color: #f2f2f2;
         }
         """
+
+# Pattern to match GitHub blob URLs
+GITHUB_BLOB_URL = re.compile(r'https://github\.com/([^/]+/[^/]+)/blob/([^/]+)/(.+)')
+
+def translate_github_urls(text):
+    """Translate GitHub blob URLs to raw URLs for proper image display"""
+    def replace_url(match):
+        owner_repo = match.group(1)
+        branch = match.group(2)
+        path = match.group(3)
+        return f'https://github.com/{owner_repo}/raw/refs/heads/{branch}/{path}'
+    
+    # Replace all occurrences
+    return GITHUB_BLOB_URL.sub(replace_url, text)
+
+# Building a Markdown instance loads all extensions, so each thread keeps one
+# and resets it between documents instead of calling markdown.markdown()
+_local = threading.local()
+
+def get_converter():
+    """Returns this thread's Markdown converter, built once with MARKDOWN_EXTENSIONS."""
+    converter = getattr(_local, 'converter', None)
+    if converter is None:
+        converter = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+        _local.converter = converter
+    return converter
+
+def render_markdown(markdown_text):
+    """Converts one Markdown document to an HTML fragment with the shared converter."""
+    # Translate GitHub URLs before processing
+    markdown_text = translate_github_urls(markdown_text)
+    return get_converter().reset().convert(markdown_text)
+
+def convert_markdown_to_html(input_file, output_file=None):
+    # Read the markdown file
+    with open(input_file, 'r', encoding='utf-8') as f:
+        markdown_text = f.read()
+    
+    # Convert markdown to HTML with more extensions for better link/image handling
+    with metrics.timer("markdown", os.path.basename(input_file)):
+        html = render_markdown(markdown_text)
     
+    # Create a complete HTML document
     html_doc = f"""<!DOCTYPE html>
 <html>
+<head>
+    <meta charset="UTF-8">
+    <title>{os.path.basename(input_file)}</title>
+    <style>
+        body {{
+            font-family: Arial, sans-serif;
+            line-height: 1.6;
+            max-width: 800px;
+            margin: 0 auto;
+            padding: 20px;
+        }}
+        pre {{
+            background-color: #f4f4f4;
+            padding: 10px;
+            border-radius: 5px;
+            overflow-x: auto;
+        }}
+        code {{
+            font-family: Consolas, Monaco, 'Andale Mono', monospace;
+        }}
+        img {{
+            max-width: 100%;
+            height: auto;
+            display: block;
+            margin: 10px auto;
+        }}
+        a {{
+            color: #007bff;
+            text-decoration: none;
+        }}
+        a:hover {{
+            text-decoration: underline;
+        }}
+        table {{
+            border-collapse: collapse;
+            width: 100%;
+            margin: 10px 0;
+        }}
+        th, td {{
+            border: 1px solid #ddd;
+            padding: 8px;
+            text-align: left;
+        }}
+        th {{
+            background-color: #f2f2f2;
+        }}
+    </style>
+</head>
+<body>
+{html}
+</body>
+</html>"""
+    
+    # Write to output file or print to console
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(html_doc)
+        print(f"Successfully converted {input_file} to {output_file}")
+    else:
+        print(html_doc)
+
+def html_to_pdf(html_file, pdf_file):
+    """Convert HTML file to PDF using weasyprint"""
+    if not weasyprint_available():
+        print("Error: weasyprint is required for PDF generation. Install with: pip install weasyprint")
+        return False
+    
+    try:
+        # Get the directory of the HTML file for base_url
+        html_dir = os.path.dirname(os.path.abspath(html_file))
+        
+        # Convert to PDF using base_url for proper resource resolution
+        # This allows WeasyPrint to resolve relative paths correctly.
+        # WeasyPrint reads the file itself, so no copy is held in Python.
+        with metrics.timer("pdf", os.path.basename(pdf_file)):
+            html_doc = _weasyprint.HTML(filename=html_file, base_url=f"file://{html_dir}/")
+            html_doc.write_pdf(pdf_file)
+        print(f"Successfully converted {html_file} to {pdf_file}")
+        return True
+    except Exception as e:
+        print(f"Error converting to PDF: {str(e)}")
+        return False
+
+def is_up_to_date(source_file, *output_files):
+    """True if every output file exists and is at least as new as source_file."""
+    source_mtime = os.path.getmtime(source_file)
+    return all(os.path.exists(path) and os.path.getmtime(path) >= source_mtime for path in output_files)
+
+def convert_file(md_file, output_dir='html', pdf_output=False, incremental=False):
+    """Converts one markdown file to HTML (and PDF) in output_dir.
+
+    With incremental, files whose outputs are newer than the markdown are skipped.
+    """
+    # Get the base filename without extension
+    base_name = os.path.splitext(os.path.basename(md_file))[0]
+    # Create output filename
+    html_file = os.path.join(output_dir, f"{base_name}.html")
+    pdf_file = os.path.join(output_dir, f"{base_name}.pdf")
+    
+    if incremental and is_up_to_date(md_file, html_file, *([pdf_file] if pdf_output else [])):
+        print(f"Up to date: {html_file}")
+        return
+    
+    try:
+        convert_markdown_to_html(md_file, html_file)
+        
+        # Convert to PDF if requested
+        if pdf_output:
+            html_to_pdf(html_file, pdf_file)
+            
+    except Exception as e:
+        print(f"Error converting {md_file}: {str(e)}")
+
+def _convert_file_quietly(md_file, output_dir, pdf_output, incremental):
+    """Runs convert_file in a worker process and returns what it printed and
+    the metrics it recorded, so the parent can print each file's messages in order."""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        convert_file(md_file, output_dir, pdf_output, incremental)
+    return output.getvalue(), metrics.take()
+
+def convert_directory(input_dir='.', output_dir='html', pdf_output=False, jobs=1, incremental=False):
+    """Converts each markdown file in input_dir to its own HTML (and PDF) file.
+
+    With jobs > 1 the files are spread over that many worker processes; files
+    are processed and reported in sorted order either way. With incremental,
+    only files changed since their last conversion are converted.
+    """
+    # Create output directory if it doesn't exist
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+        print(f"Created output directory: {output_dir}")
+    
+    # Find all markdown files in the input directory
+    md_files = sorted(glob.glob(os.path.join(input_dir, '*.md')))
+    
+    if not md_files:
+        print(f"No markdown files found in {input_dir}")
+        return
+    
+    # Convert each markdown file
+    if jobs and jobs > 1 and len(md_files) > 1:
+        # Forked workers start with a copy of this process's metrics; clear them
+        with ProcessPoolExecutor(max_workers=jobs, initializer=metrics.reset) as executor:
+            chunksize = max(1, len(md_files) // (jobs * 4))
+            outputs = executor.map(_convert_file_quietly, md_files, [output_dir] * len(md_files),
+                                   [pdf_output] * len(md_files), [incremental] * len(md_files),
+                                   chunksize=chunksize)
+            for output, records in outputs:
+                print(output, end='')
+                metrics.extend(records)
+    else:
+        for md_file in md_files:
+            convert_file(md_file, output_dir, pdf_output, incremental)
+
+def write_single_html(md_files, out, css_styles=SCREEN_CSS, rewrite_images=None):
+    """Streams the combined document for md_files to the text stream out.
+
+    Each section is spooled to a temporary file as soon as it is converted, so
+    only the table of contents is kept in memory; it is written first and the
+    sections are then copied after it. rewrite_images, if given, is applied to
+    each section's HTML (e.g. ImageAssets.screen_html). Returns the number of
+    sections written.
+    """
+    toc_items = []
+    
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as sections:
+        for i, md_file in enumerate(md_files):
+            try:
+                # Read the markdown file
+                with open(md_file, 'r', encoding='utf-8') as f:
+                    markdown_text = f.read()
+                
+                # Convert markdown to HTML with more extensions for better link/image handling
+                with metrics.timer("markdown", os.path.basename(md_file)):
+                    html_content = render_markdown(markdown_text)
+                if rewrite_images:
+                    with metrics.timer("images", os.path.basename(md_file)):
+                        html_content = rewrite_images(html_content)
+                
+                # Create section with anchor
+                base_name = os.path.splitext(os.path.basename(md_file))[0]
+                section_id = f"section-{i}"
+                if toc_items:
+                    sections.write('\n')
+                toc_items.append(f'<li><a href="#{section_id}">{base_name}</a></li>')
+                
+                sections.write(f'''
+            <section id="{section_id}">
+                <h1>{base_name}</h1>
+                <hr>
+                {html_content}
+            </section>
+            ''')
+                
+            except Exception as e:
+                print(f"Error processing {md_file}: {str(e)}")
+        
+        toc_html = '\n'.join(toc_items)
+        out.write(f"""<!DOCTYPE html>
+<html>
 <head>
     <meta charset="UTF-8">
     <title>Combined Documentation</title>
@@ -427,52 +492,334 @@ def convert_to_single_html(input_dir='.', output_file='combined_documentation.ht
         </ul>
     </div>
     <div class="content">
-        {content_html}
+        """)
+        sections.seek(0)
+        shutil.copyfileobj(sections, out)
+        out.write("""
     </div>
 </body>
-</html>"""
+</html>""")
     
-    # Write to output file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html_doc)
-    print(f"Successfully converted {len(md_files)} markdown files to {output_file}")
+    return len(toc_items)
+
+def write_document(md_files, output_file, pdf_output=False, assets=None):
+    """Streams the combined document for md_files to output_file, replacing it atomically.
+
+    For screen the sections go straight to output_file. For print (pdf_output)
+    the document is first spooled to a temporary file while its images are
+    collected; once assets has picked print variants that fit the PDF budget
+    together, it is copied to output_file line by line with the images
+    pointed at those variants. Either way only one section is held in memory
+    at a time. Returns the number of sections written.
+    """
+    with atomic_write.replacing(output_file) as tmp_file:
+        if not pdf_output:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                return write_single_html(md_files, f, SCREEN_CSS, assets.screen_html if assets else None)
+        if not assets:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                return write_single_html(md_files, f, PRINT_CSS)
+
+        sources = []
+        def collect(html_content):
+            sources.extend(image_assets.local_sources(html_content))
+            return html_content
+
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as spooled:
+            count = write_single_html(md_files, spooled, PRINT_CSS, collect)
+            with metrics.timer("images", "print variants"):
+                assets.fit_budget(sources)
+                spooled.seek(0)
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    # Markdown writes each <img> tag on one line
+                    for line in spooled:
+                        f.write(assets.print_html(line) if '<img' in line else line)
+        return count
+
+def convert_to_single_html(input_dir='.', output_file='combined_documentation.html', pdf_output=False,
+                           assets=None):
+    """Writes all markdown files in input_dir to one HTML document, and with pdf_output
+    a PDF next to it. With assets, images are replaced by resized variants."""
+    # Find all markdown files in the input directory
+    md_files = glob.glob(os.path.join(input_dir, '*.md'))
     
-    # Convert to PDF if requested
+    if not md_files:
+        print(f"No markdown files found in {input_dir}")
+        return
+    
+    # Sort files for consistent ordering
+    md_files.sort()
+    
+    write_document(md_files, output_file, pdf_output, assets)
+    print(f"Successfully converted {len(md_files)} markdown files to {output_file}")
     if pdf_output:
+        # WeasyPrint reads the file itself, so no copy of the document is held here
         pdf_file = os.path.splitext(output_file)[0] + '.pdf'
-        html_to_pdf(output_file, pdf_file)
+        if html_to_pdf(output_file, pdf_file) and assets:
+            assets.check_budget(pdf_file)
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        # Check for flags first
-        pdf_output = '--pdf' in sys.argv
-        single_output = '--single' in sys.argv
-        
-        # Remove flags from arguments list for processing
-        args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
-        
-        if single_output:
-            # Convert to single HTML file
-            input_dir = args[0] if len(args) > 0 else '.'
-            output_file = args[1] if len(args) > 1 else 'combined_documentation.html'
-            convert_to_single_html(input_dir, output_file, pdf_output)
-        elif pdf_output:
-            # Convert with PDF output (separate files)
-            input_dir = args[0] if len(args) > 0 else '.'
-            output_dir = args[1] if len(args) > 1 else 'html'
-            convert_directory(input_dir, output_dir, pdf_output=True)
+# Rendered chapter PDFs, keyed by the hash of their HTML, CSS and images
+PDF_CACHE_DIR = os.path.join(".autodoc_cache", "pdf")
+PDF_CACHE_MAX_AGE_DAYS = 30
+
+TOC_PAGE_CSS = """
+        .toc .page-number {
+            float: right;
+            color: #495057;
+        }
+        """
+
+IMG_SRC_PATTERN = re.compile(r'<img[^>]*\ssrc="([^"]+)"')
+
+def chapter_document(title, html_content, css_styles=PRINT_CSS):
+    """Wraps one converted chapter in a standalone HTML document for PDF rendering."""
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>{title}</title>
+    <style>
+        {css_styles}
+    </style>
+</head>
+<body>
+    <div class="content">
+            <section>
+                <h1>{title}</h1>
+                <hr>
+                {html_content}
+            </section>
+    </div>
+</body>
+</html>"""
+
+def pdf_cache_key(html_doc, base_dir):
+    """Hashes a chapter's HTML (which embeds its CSS) and the local images it references,
+    so replacing a screenshot invalidates the chapter even if its Markdown is unchanged."""
+    digest = hashlib.sha256(html_doc.encode('utf-8'))
+    for src in sorted(set(IMG_SRC_PATTERN.findall(html_doc))):
+        if re.match(r'^[a-z]+:', src):
+            continue
+        image_path = os.path.join(base_dir, src)
+        digest.update(src.encode('utf-8'))
+        if os.path.exists(image_path):
+            with open(image_path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def render_pdf(html_doc, base_url, pdf_file, title=None):
+    """Renders an HTML string to a PDF file. Runs in worker processes and
+    returns the metrics recorded there for the parent to collect."""
+    weasyprint_available()
+    with metrics.timer("pdf", title or os.path.basename(pdf_file)), atomic_write.replacing(pdf_file) as tmp_file:
+        _weasyprint.HTML(string=html_doc, base_url=base_url).write_pdf(tmp_file)
+    return metrics.take()
+
+def render_toc_pdf(titles, start_pages, base_url):
+    """Renders the table of contents with page numbers. Returns (pdf bytes, page count)."""
+    toc_items = []
+    for i, (title, page) in enumerate(zip(titles, start_pages)):
+        # The link targets its own anchor so WeasyPrint keeps it; it is
+        # pointed at the chapter's first page after merging
+        toc_items.append(f'<li><a id="section-{i}" href="#section-{i}">{title}</a>'
+                         f'<span class="page-number">{page}</span></li>')
+    toc_html = '\n'.join(toc_items)
+    html_doc = f"""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>Combined Documentation</title>
+    <style>
+        {PRINT_CSS}
+        {TOC_PAGE_CSS}
+    </style>
+</head>
+<body>
+    <div class="toc">
+        <h2>Table of Contents</h2>
+        <ul>
+            {toc_html}
+        </ul>
+    </div>
+</body>
+</html>"""
+    with metrics.timer("pdf", "Table of Contents"):
+        document = _weasyprint.HTML(string=html_doc, base_url=base_url).render()
+        pdf_bytes = document.write_pdf()
+    return pdf_bytes, len(document.pages)
+
+def convert_to_pdf_by_chapter(input_dir='.', pdf_file='combined_documentation.pdf', jobs=None,
+                              cache_dir=PDF_CACHE_DIR, executor=None, assets=None):
+    """Renders each chapter to its own PDF in a process pool, then merges them.
+
+    Chapter PDFs are cached in cache_dir by the hash of their HTML, CSS and
+    images, so after a one-chapter change only that chapter is re-rendered.
+    The merged PDF starts with a table of contents whose entries show page
+    numbers and link to their chapters, and gets one bookmark per chapter.
+    Pass a ProcessPoolExecutor (started with initializer=metrics.reset) as
+    executor to reuse its already-running workers instead of starting a pool.
+    With assets, chapters embed print variants of their images, chosen so
+    that all of them together fit the assets' PDF budget.
+    """
+    if not weasyprint_available():
+        print("Error: weasyprint is required for PDF generation. Install with: pip install weasyprint")
+        return False
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.generic import ArrayObject, NameObject
+
+    md_files = sorted(glob.glob(os.path.join(input_dir, '*.md')))
+    if not md_files:
+        print(f"No markdown files found in {input_dir}")
+        return False
+
+    base_dir = os.path.dirname(os.path.abspath(pdf_file))
+    base_url = f"file://{base_dir}/"
+    os.makedirs(cache_dir, exist_ok=True)
+
+    chapters = []
+    for md_file in md_files:
+        try:
+            with open(md_file, 'r', encoding='utf-8') as f, metrics.timer("markdown", os.path.basename(md_file)):
+                html_content = render_markdown(f.read())
+        except Exception as e:
+            print(f"Error processing {md_file}: {str(e)}")
+            continue
+        chapters.append((os.path.splitext(os.path.basename(md_file))[0], html_content))
+
+    if assets:
+        # The budget covers the whole guide, so settle the image quality before any chapter uses it
+        with metrics.timer("images", "print variants"):
+            assets.fit_budget([src for _, html_content in chapters
+                               for src in image_assets.local_sources(html_content)])
+
+    titles = []
+    chapter_pdfs = []
+    to_render = []
+    for title, html_content in chapters:
+        if assets:
+            html_content = assets.print_html(html_content)
+        html_doc = chapter_document(title, html_content)
+        chapter_pdf = os.path.join(cache_dir, f"{pdf_cache_key(html_doc, base_dir)}.pdf")
+        titles.append(title)
+        chapter_pdfs.append(chapter_pdf)
+        if os.path.exists(chapter_pdf):
+            # Mark as recently used so cache pruning keeps it
+            os.utime(chapter_pdf)
         else:
-            # If directory is specified as argument (original behavior)
-            input_dir = sys.argv[1]
-            output_dir = sys.argv[2] if len(sys.argv) > 2 else 'html'
-            convert_directory(input_dir, output_dir)
+            to_render.append((html_doc, chapter_pdf, title))
+
+    print(f"Rendering {len(to_render)} of {len(chapter_pdfs)} chapters ({len(chapter_pdfs) - len(to_render)} cached)")
+    if to_render:
+        with contextlib.ExitStack() as stack:
+            if executor is None:
+                executor = stack.enter_context(ProcessPoolExecutor(max_workers=jobs, initializer=metrics.reset))
+            futures = [executor.submit(render_pdf, html_doc, base_url, chapter_pdf, title)
+                       for html_doc, chapter_pdf, title in to_render]
+            for future in futures:
+                metrics.extend(future.result())
+
+    page_counts = [len(PdfReader(chapter_pdf).pages) for chapter_pdf in chapter_pdfs]
+
+    # The TOC's own length shifts every page number, so render it until it's stable
+    toc_pages = 1
+    while True:
+        start_pages = []
+        page = toc_pages + 1
+        for count in page_counts:
+            start_pages.append(page)
+            page += count
+        toc_pdf, rendered_pages = render_toc_pdf(titles, start_pages, base_url)
+        if rendered_pages == toc_pages:
+            break
+        toc_pages = rendered_pages
+
+    writer = PdfWriter(clone_from=PdfReader(io.BytesIO(toc_pdf)))
+    for chapter_pdf in chapter_pdfs:
+        writer.append(chapter_pdf)
+
+    start_indexes = [start_page - 1 for start_page in start_pages]
+    for title, start_index in zip(titles, start_indexes):
+        writer.add_outline_item(title, start_index)
+
+    # Point the TOC links, in order, at the first page of each chapter
+    link_index = 0
+    for page in writer.pages[:toc_pages]:
+        for annotation in page.get("/Annots", []):
+            annotation = annotation.get_object()
+            if annotation.get("/Subtype") != "/Link" or link_index >= len(start_indexes):
+                continue
+            target = writer.pages[start_indexes[link_index]].indirect_reference
+            annotation[NameObject("/Dest")] = ArrayObject([target, NameObject("/Fit")])
+            if "/A" in annotation:
+                del annotation["/A"]
+            link_index += 1
+
+    with open(pdf_file, 'wb') as f:
+        writer.write(f)
+    print(f"Successfully merged {len(chapter_pdfs)} chapter PDFs into {pdf_file}")
+    if assets:
+        assets.check_budget(pdf_file)
+
+    # Drop cached chapters that haven't been used for a while
+    cutoff = time.time() - PDF_CACHE_MAX_AGE_DAYS * 86400
+    for cached_pdf in glob.glob(os.path.join(cache_dir, '*.pdf')):
+        if os.path.getmtime(cached_pdf) < cutoff:
+            os.remove(cached_pdf)
+    return True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert Markdown files to HTML, and optionally PDF.",
+        epilog="Without --single, --split-pdf or --site, each Markdown file is converted to its own HTML file "
+               "in output (default: html). PDF generation requires weasyprint.")
+    parser.add_argument("input_dir", nargs="?", default=".", help="directory of Markdown files (default: .)")
+    parser.add_argument("output", nargs="?",
+                        help="output directory, or the output file with --single / --split-pdf")
+    parser.add_argument("--single", action="store_true", help="combine all files into one HTML document")
+    parser.add_argument("--pdf", action="store_true", help="also write PDF output")
+    parser.add_argument("--split-pdf", action="store_true",
+                        help="render chapters to PDF in parallel and merge them into one PDF")
+    parser.add_argument("--site", action="store_true",
+                        help="write a static site to output (default: site): one page per chapter with shared "
+                             "navigation and client-side search")
+    parser.add_argument("--jobs", type=int,
+                        help="worker processes for per-file conversion or --split-pdf, threads for --site")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip files whose HTML/PDF is newer than the Markdown")
+    parser.add_argument("--original-images", action="store_true",
+                        help="embed images as they are instead of resized variants (--single / --split-pdf)")
+    parser.add_argument("--print-dpi", type=int, default=image_assets.PRINT_DPI,
+                        help="resolution of images in PDF output (default: %(default)s)")
+    parser.add_argument("--pdf-budget", type=float, metavar="MB",
+                        help="lower image resolution and quality until the PDF's images fit in this many MB")
+    return parser.parse_args(argv)
+
+def make_assets(output_file, print_dpi=image_assets.PRINT_DPI, pdf_budget_mb=None):
+    """The image assets for a document written to output_file, kept in an assets folder next to it."""
+    return image_assets.ImageAssets(os.path.dirname(os.path.abspath(output_file)), print_dpi=print_dpi,
+                                    pdf_budget=pdf_budget_mb * 1e6 if pdf_budget_mb else None)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.site:
+        import static_site
+        static_site.build_site(args.input_dir, args.output or static_site.SITE_DIR, jobs=args.jobs or 4)
+        return
+    if not (args.split_pdf or args.single):
+        convert_directory(args.input_dir, args.output or 'html', pdf_output=args.pdf, jobs=args.jobs,
+                          incremental=args.incremental)
+        return
+
+    output = args.output or ('combined_documentation.pdf' if args.split_pdf else 'combined_documentation.html')
+    assets = None if args.original_images else make_assets(output, args.print_dpi, args.pdf_budget)
+    if args.split_pdf:
+        # Render each chapter to PDF in parallel and merge them
+        convert_to_pdf_by_chapter(args.input_dir, output, jobs=args.jobs, assets=assets)
     else:
-        # Default to current directory
-        print("Usage:")
-        print("  python markdown_to_html.py [directory] [output_directory]  # Convert each MD to separate HTML")
-        print("  python markdown_to_html.py --single [directory] [output_file]  # Convert all MD to single HTML")
-        print("  python markdown_to_html.py --pdf [directory] [output_directory]  # Convert each MD to HTML + PDF")
-        print("  python markdown_to_html.py --single --pdf [directory] [output_file]  # Convert all MD to single HTML + PDF")
-        print("\nDefault: Convert each markdown file to separate HTML files in 'html' directory")
-        print("\nNote: PDF generation requires weasyprint. Install with: pip install weasyprint")
-        convert_directory() 
\ No newline at end of file
+        convert_to_single_html(args.input_dir, output, args.pdf, assets=assets)
+    if assets:
+        assets.prune()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import time
+import threading
+import contextlib
+
+import atomic_write
+
+# USD per million tokens (input, output). Batch API requests are billed at half price.
+PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+BATCH_DISCOUNT = 0.5
+
+REPORT_FILE = "run_report.json"
+SLOWEST_PAGES = 10
+
+# Values summed per stage in the report and the Prometheus textfile
+TOTALS = ("seconds", "bytes", "upload_bytes", "prompt_tokens", "completion_tokens", "cost")
+
+_lock = threading.Lock()
+_records = []
+_started = time.time()
+
+def record(stage, page=None, **values):
+    """Records one measurement, e.g. record("analyze", "users.png", seconds=1.2, prompt_tokens=900)."""
+    entry = {"stage": stage, "page": page}
+    entry.update(values)
+    with _lock:
+        _records.append(entry)
+    return entry
+
+@contextlib.contextmanager
+def timer(stage, page=None, **values):
+    """Times the body of a with block and records it. Yields a dict the body can add values to."""
+    values = dict(values)
+    start = time.perf_counter()
+    try:
+        yield values
+    except Exception as e:
+        values["error"] = type(e).__name__
+        raise
+    finally:
+        record(stage, page, seconds=round(time.perf_counter() - start, 4), **values)
+
+def take():
+    """Returns and clears the records collected so far. Worker processes send these back to the parent."""
+    with _lock:
+        records = list(_records)
+        _records.clear()
+    return records
+
+def extend(records):
+    """Adds records collected in another process."""
+    with _lock:
+        _records.extend(records)
+
+def latest(stage, page):
+    """The most recent record of a stage for a page, or None. Recent records are at the end, so this is quick."""
+    with _lock:
+        for entry in reversed(_records):
+            if entry["stage"] == stage and entry["page"] == page:
+                return dict(entry)
+    return None
+
+def reset():
+    global _started
+    take()
+    _started = time.time()
+
+def estimate_cost(model, prompt_tokens, completion_tokens, batch=False):
+    """Estimated cost in USD of one request, or None for a model without a known price."""
+    if model not in PRICES:
+        return None
+    input_price, output_price = PRICES[model]
+    cost = (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+    return round(cost * (BATCH_DISCOUNT if batch else 1), 6)
+
+def summarize(records):
+    """Totals per stage: {stage: {"count": ..., "max_seconds": ..., "seconds": ..., ...}}."""
+    stages = {}
+    for entry in records:
+        totals = stages.setdefault(entry["stage"], {"count": 0, "max_seconds": 0})
+        totals["count"] += 1
+        totals["max_seconds"] = max(totals["max_seconds"], entry.get("seconds") or 0)
+        for name in TOTALS:
+            if entry.get(name) is not None:
+                totals[name] = round(totals.get(name, 0) + entry[name], 6)
+        if entry.get("error"):
+            totals["errors"] = totals.get("errors", 0) + 1
+    return stages
+
+def slowest_pages(records, limit=SLOWEST_PAGES):
+    """The slowest page measurements of each stage, slowest first."""
+    by_stage = {}
+    for entry in records:
+        if entry.get("page") is not None and entry.get("seconds") is not None:
+            by_stage.setdefault(entry["stage"], []).append(entry)
+    return {stage: [{"page": entry["page"], "seconds": entry["seconds"]}
+                    for entry in sorted(entries, key=lambda entry: entry["seconds"], reverse=True)[:limit]]
+            for stage, entries in by_stage.items()}
+
+def prometheus_text(records, finished=None):
+    """Formats the run's metrics in the Prometheus text exposition format."""
+    def label(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    lines = []
+    def gauge(name, help_text, samples):
+        if not samples:
+            return
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{label(text)}"' for key, text in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    stages = summarize(records)
+    gauge("autodoc_stage_seconds", "Time spent in each stage during the last run.",
+          [({"stage": stage}, totals["seconds"]) for stage, totals in stages.items() if "seconds" in totals])
+    gauge("autodoc_stage_items", "Measurements recorded for each stage during the last run.",
+          [({"stage": stage}, totals["count"]) for stage, totals in stages.items()])
+    gauge("autodoc_stage_errors", "Failed items in each stage during the last run.",
+          [({"stage": stage}, totals.get("errors", 0)) for stage, totals in stages.items()])
+    gauge("autodoc_upload_bytes", "Image bytes uploaded to the Vision API during the last run.",
+          [({}, sum(totals.get("upload_bytes", 0) for totals in stages.values()))])
+    gauge("autodoc_tokens", "Tokens used during the last run.",
+          [({"kind": "prompt"}, sum(totals.get("prompt_tokens", 0) for totals in stages.values())),
+           ({"kind": "completion"}, sum(totals.get("completion_tokens", 0) for totals in stages.values()))])
+    gauge("autodoc_cost_dollars", "Estimated API cost of the last run in USD.",
+          [({}, round(sum(totals.get("cost", 0) for totals in stages.values()), 6))])
+    # A page can be measured more than once per stage (e.g. a retried capture);
+    # each label set may only appear once, so report the total
+    page_seconds = {}
+    for entry in records:
+        if entry.get("page") is not None and entry.get("seconds") is not None:
+            key = (entry["stage"], entry["page"])
+            page_seconds[key] = page_seconds.get(key, 0) + entry["seconds"]
+    gauge("autodoc_page_seconds", "Time spent on each page in each stage during the last run.",
+          [({"stage": stage, "page": page}, round(seconds, 4)) for (stage, page), seconds in page_seconds.items()])
+    gauge("autodoc_last_run_timestamp_seconds", "When the last run finished.",
+          [({}, round(finished or time.time()))])
+    return "\n".join(lines) + "\n"
+
+def write_report(path=REPORT_FILE, prometheus_file=None):
+    """Writes the JSON run report and, optionally, a Prometheus textfile for node_exporter.
+
+    The report has per-stage totals, the slowest pages of each stage and every
+    individual measurement. Both files are replaced atomically.
+    """
+    with _lock:
+        records = list(_records)
+    finished = time.time()
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(_started)),
+        "duration_seconds": round(finished - _started, 3),
+        "stages": summarize(records),
+        "slowest_pages": slowest_pages(records),
+        "records": records,
+    }
+    if path:
+        atomic_write.write_json(path, report, indent=2)
+        print(f"Wrote run report to {path}")
+    if prometheus_file:
+        atomic_write.write_text(prometheus_file, prometheus_text(records, finished))
+        print(f"Wrote Prometheus metrics to {prometheus_file}")
+    return report
+
+def print_summary(report):
+    for stage, totals in report["stages"].items():
+        line = f"  {stage:<10} {totals['count']:>5} items {totals.get('seconds', 0):>9.2f} s"
+        if totals.get("prompt_tokens") or totals.get("completion_tokens"):
+            line += f"  {totals.get('prompt_tokens', 0)}+{totals.get('completion_tokens', 0)} tokens"
+        if totals.get("cost"):
+            line += f"  ${totals['cost']:.4f}"
+        print(line)
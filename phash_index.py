@@ -0,0 +1,60 @@
+import os
+import json
+
+from PIL import Image
+
+import atomic_write
+
+# 16x16 difference hash = 256 bits. Full-page screenshots are tall, so a larger
+# grid than the usual 8x8 keeps real content changes from vanishing in the resize.
+# Even so, a changed word or number on a tall page can move no bits at all, so
+# reuse is opt-in and the default threshold only absorbs rendering noise.
+HASH_SIZE = 16
+DEFAULT_THRESHOLD = 2
+
+def dhash(image_path, hash_size=HASH_SIZE):
+    """Returns the difference hash of an image as a hex string.
+
+    The image is reduced to a (hash_size + 1) x hash_size grayscale grid and
+    each bit records whether a pixel is brighter than its right neighbour, so
+    antialiasing, compression noise and small text changes barely move it.
+    """
+    with Image.open(image_path) as image:
+        pixels = list(image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+def hamming_distance(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+def index_path(screenshot_folder):
+    """The index lives next to the screenshots folder, e.g. screenshots.phash.json,
+    because the capture step clears the folder itself on every run."""
+    return os.path.normpath(screenshot_folder) + ".phash.json"
+
+def load_index(screenshot_folder):
+    """Returns {filename: {"hash": ..., "description": ...}} from the last run."""
+    try:
+        with open(index_path(screenshot_folder), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_index(screenshot_folder, index):
+    path = index_path(screenshot_folder)
+    atomic_write.write_json(path, index, indent=2, sort_keys=True)
+
+def is_visually_same(entry, current_hash, threshold=DEFAULT_THRESHOLD, fingerprint=None):
+    """True if an index entry's hash is within threshold bits of current_hash and
+    its description was made with the request settings fingerprint stands for."""
+    if not entry or not entry.get("hash") or len(entry["hash"]) != len(current_hash):
+        return False
+    if entry.get("fingerprint") != fingerprint:
+        return False
+    return hamming_distance(entry["hash"], current_hash) <= threshold
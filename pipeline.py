@@ -0,0 +1,203 @@
+import os
+import time
+import asyncio
+import argparse
+
+import capture_screenshots
+import analyze_and_document
+import description_cache
+import metrics
+import phash_index
+import rate_limiter
+
+# Bound on pages waiting between two stages, so a fast stage can't run ahead and
+# pile up screenshots or descriptions in memory while a slow stage catches up.
+QUEUE_SIZE = 8
+
+async def run_pipeline(shots, tabs=4, analysis_workers=4, queue_size=QUEUE_SIZE, chapters_dir="chapters",
+                       auth_file=capture_screenshots.auth_file, phash_threshold=None, store=None, run_id=None,
+                       summary=None, **analyze_options):
+    """Captures, analyzes and writes chapters for all shots in one process.
+
+    The three stages run concurrently and hand pages on through bounded
+    queues: each screenshot is queued for analysis as soon as it is captured,
+    and each description is written as a chapter as soon as it arrives.
+    Pages are reused, resumed and recorded as in
+    analyze_and_document.get_screenshot_descriptions: with a phash_threshold,
+    unchanged-looking pages reuse the previous run's description, and with a
+    store, pages run run_id already finished are not analyzed again and each
+    page is recorded as it is done. If a summary dict is passed it is filled
+    with analyzed/resumed/reused counts. Extra keyword arguments are passed
+    on to analyze_screenshot; unless a limiter is given, the analysis workers
+    share one rate limiter. Returns {screenshot filename: description} in
+    shot order.
+    """
+    analyze_options.setdefault("limiter", rate_limiter.RateLimiter(max_concurrency=analysis_workers))
+    captured = asyncio.Queue(maxsize=queue_size)
+    described = asyncio.Queue(maxsize=queue_size)
+    descriptions = {}
+    shot_files = {os.path.basename(shot["output"]) for shot in shots}
+    completed = set()
+    counts = {"analyzed": 0, "resumed": 0, "reused": 0}
+    previous_index = phash_index.load_index(capture_screenshots.screenshots_dir) if phash_threshold is not None else {}
+    index = {}
+    finished = store.finished_pages(run_id) if store is not None else {}
+
+    async def on_capture(shot, record):
+        # Blocks the capturing tab while the analysis queue is full
+        await captured.put(shot["output"])
+
+    async def capture():
+        try:
+            records = await capture_screenshots.capture_with_browser(shots, auth_file, tabs=tabs,
+                                                                      on_capture=on_capture)
+            capture_screenshots.write_timings(records)
+            completed.add("capture")
+        finally:
+            for _ in range(analysis_workers):
+                await captured.put(None)
+
+    async def analyze():
+        while True:
+            image_path = await captured.get()
+            if image_path is None:
+                return
+            # Hashing and analyze_screenshot block, so run them on a worker thread
+            description = await asyncio.to_thread(analyze_and_document.describe_page, image_path, phash_threshold,
+                                                  previous_index, index, store, run_id, finished, counts,
+                                                  **analyze_options)
+            await described.put((os.path.basename(image_path), description))
+
+    async def analyze_all():
+        try:
+            await asyncio.gather(*(analyze() for _ in range(analysis_workers)))
+            completed.add("analysis")
+        finally:
+            await described.put(None)
+
+    async def write_chapters():
+        os.makedirs(chapters_dir, exist_ok=True)
+        previous_manifest = analyze_and_document.load_manifest(chapters_dir)
+        manifest = {}
+        while True:
+            item = await described.get()
+            if item is None:
+                break
+            filename, description = item
+            analyze_and_document.write_chapter(filename, description, chapters_dir, manifest, previous_manifest)
+            descriptions[filename] = description
+        # Stale chapters go only once the new set is complete, and only those of
+        # shots no longer listed; a page whose capture failed keeps its chapter
+        if completed == {"capture", "analysis"}:
+            analyze_and_document.finish_chapters(chapters_dir, manifest, shot_files)
+        else:
+            print("Capture or analysis did not finish, keeping the previous chapters")
+
+    await asyncio.gather(capture(), analyze_all(), write_chapters())
+
+    if phash_threshold is not None:
+        phash_index.save_index(capture_screenshots.screenshots_dir, index)
+    if summary is not None:
+        summary.update(counts)
+    order = [os.path.basename(shot["output"]) for shot in shots]
+    return {filename: descriptions[filename] for filename in order if filename in descriptions}
+
+def needs_whole_set(options):
+    """Whether options analyze the screenshots as a set (shared layout, batches or
+    groups), which has to wait until every page is captured."""
+    return bool(options["shared_layout"] or options["batch"] or (options["group_size"] or 0) > 1)
+
+async def capture_then_analyze(shots, tabs=4, analysis_workers=4, chapters_dir="chapters",
+                               auth_file=capture_screenshots.auth_file, **options):
+    """Captures every shot, then analyzes the screenshots as a set with
+    analyze_and_document.get_screenshot_descriptions and writes the chapters.
+    options are passed on to get_screenshot_descriptions."""
+    records = await capture_screenshots.capture_with_browser(shots, auth_file, tabs=tabs)
+    capture_screenshots.write_timings(records)
+    descriptions = await asyncio.to_thread(analyze_and_document.get_screenshot_descriptions,
+                                           capture_screenshots.screenshots_dir, max_workers=analysis_workers,
+                                           **options)
+    analyze_and_document.create_markdown_report(descriptions, chapters_dir,
+                                                expected={os.path.basename(shot["output"]) for shot in shots})
+    return descriptions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Capture, analyze and build the user guide in one process.")
+    parser.add_argument("--tabs", type=int, default=4,
+                        help="number of pages captured in parallel (default: 4)")
+    parser.add_argument("--jobs", "-j", type=int, default=4,
+                        help="number of screenshots analyzed concurrently (default: 4)")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="maximum pages waiting between two stages (default: %(default)s)")
+    analyze_and_document.add_analysis_arguments(parser)
+    parser.add_argument("--pdf-jobs", type=int,
+                        help="render chapters to PDF separately on this many processes, reusing cached chapters")
+    parser.add_argument("--pdf-budget", type=float, metavar="MB",
+                        help="lower the resolution and quality of the PDF's images until they fit in this many MB")
+    parser.add_argument("--shots", default=capture_screenshots.shots_file,
+                        help="pages to capture, e.g. crawled_shots.yml written by crawler.py (default: %(default)s)")
+    parser.add_argument("--force-login", action="store_true",
+                        help="log in again even if the session in auth.json is still valid")
+    parser.add_argument("--tpm", type=int, help="tokens-per-minute budget for screenshot analysis")
+    parser.add_argument("--max-retries", type=int, default=rate_limiter.MAX_RETRIES,
+                        help="retries for rate-limited or failed API calls (default: %(default)s)")
+    parser.add_argument("--metrics-file", default=metrics.REPORT_FILE,
+                        help="JSON run report with per-stage and per-page timings, tokens and cost "
+                             "(default: %(default)s)")
+    parser.add_argument("--prometheus-file", help="also write the run's metrics to this Prometheus textfile")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+    if args.purge_cache:
+        description_cache.purge_cache(args.cache_dir)
+    options = analyze_and_document.analysis_options(args)
+
+    login_config = capture_screenshots.load_yaml(capture_screenshots.login_file)
+    capture_screenshots.ensure_auth(login_config[0], capture_screenshots.auth_file, force=args.force_login)
+    shots = capture_screenshots.load_yaml(args.shots)
+    capture_screenshots.clear_screenshots(capture_screenshots.screenshots_dir)
+
+    chapters_dir = "chapters"
+    limiter = rate_limiter.RateLimiter(max_concurrency=args.jobs, tokens_per_minute=args.tpm,
+                                       max_retries=args.max_retries)
+    store, run_id = analyze_and_document.open_run(args, options)
+    summary = {}
+    if needs_whole_set(options):
+        # Shared layout, batches and groups look at all screenshots at once
+        print(f"Capturing {len(shots)} pages, then analyzing them as a set")
+        descriptions = asyncio.run(capture_then_analyze(shots, tabs=args.tabs, analysis_workers=args.jobs,
+                                                        chapters_dir=chapters_dir, limiter=limiter,
+                                                        summary=summary, store=store, run_id=run_id,
+                                                        **options))
+    else:
+        print(f"Running pipeline for {len(shots)} pages")
+        for name in ("shared_layout", "batch", "group_size", "group_tokens"):
+            options.pop(name)
+        descriptions = asyncio.run(run_pipeline(shots, tabs=args.tabs, analysis_workers=args.jobs,
+                                                queue_size=args.queue_size, chapters_dir=chapters_dir,
+                                                limiter=limiter, summary=summary, store=store, run_id=run_id,
+                                                **options))
+    if options["cache_dir"]:
+        description_cache.prune_cache(options["cache_dir"], int(args.cache_max_size * 1024 * 1024),
+                                      args.cache_max_age)
+    if summary:
+        print(f"Run summary: {summary['analyzed']} analyzed, {summary['resumed']} resumed, "
+              f"{summary['reused']} skipped as visually unchanged")
+
+    if descriptions:
+        analyze_and_document.create_pdf_report(chapters_dir, "user_guide.pdf", pdf_jobs=args.pdf_jobs,
+                                               pdf_budget_mb=args.pdf_budget)
+    else:
+        print("No screenshots captured, skipping PDF generation.")
+
+    report = metrics.write_report(args.metrics_file, args.prometheus_file)
+    metrics.print_summary(report)
+    if store is not None:
+        store.finish_run(run_id)
+        store.close()
+    print(f"Done in {time.perf_counter() - start:.1f} s.")
+
+if __name__ == "__main__":
+    main()
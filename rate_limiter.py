@@ -0,0 +1,219 @@
+import re
+import time
+import random
+import threading
+import collections
+
+# Tokens a request is assumed to use before any response has reported its usage:
+# a high-detail full-page screenshot (85 + 6 tiles x 170) plus MAX_TOKENS of output
+DEFAULT_TOKEN_ESTIMATE = 85 + 6 * 170 + 500
+MAX_RETRIES = 6
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+WINDOW_SECONDS = 60.0
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_duration(value):
+    """Parses rate-limit reset durations such as "20ms", "1.5s" or "6m0s" into seconds."""
+    if not value:
+        return None
+    parts = DURATION_PART.findall(str(value))
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+def retry_after(headers):
+    """Seconds the server asked us to wait (retry-after-ms or retry-after), or None."""
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    return None
+
+def is_retryable(error):
+    """429s, 5xx, timeouts and connection errors are worth retrying; bad requests are not."""
+    # Only needed once a call has failed, by which time the SDK is loaded anyway
+    import openai
+
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code in (408, 409)
+    return False
+
+def is_rate_limit(error):
+    import openai
+
+    return isinstance(error, openai.RateLimitError)
+
+class RateLimiter:
+    """Schedules API calls shared by many threads to stay within the account's rate limits.
+
+    Concurrency follows AIMD: each success raises the allowed number of
+    requests in flight by 1/limit (about one per round of requests, up to
+    max_concurrency), and a 429 halves it. Requests are also held back to
+    stay within tokens_per_minute, when the rate-limit headers report that
+    the remaining requests or tokens are used up, and while a retry-after is
+    pending. Failed calls are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, max_concurrency=4, tokens_per_minute=None, max_retries=MAX_RETRIES,
+                 base_delay=BASE_DELAY, max_delay=MAX_DELAY, min_concurrency=1):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.token_estimate = DEFAULT_TOKEN_ESTIMATE
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failed": 0}
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        # [start time, tokens] per request in the last minute, oldest first
+        self._window = collections.deque()
+
+    def _wait_time(self, now):
+        """Seconds until another request may start, or 0 if one may start now."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= int(self.limit):
+            # Woken up by release(); the timeout only guards against missed wakeups
+            return 1.0
+        if self.tokens_per_minute:
+            while self._window and self._window[0][0] <= now - WINDOW_SECONDS:
+                self._window.popleft()
+            used = sum(tokens for _, tokens in self._window)
+            if self._window and used + self.token_estimate > self.tokens_per_minute:
+                return max(0.05, self._window[0][0] + WINDOW_SECONDS - now)
+        return 0
+
+    def acquire(self):
+        """Blocks until a request may start. Returns the entry to pass to release()."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = self._wait_time(now)
+                if wait <= 0:
+                    break
+                self._condition.wait(wait)
+            self._in_flight += 1
+            self.stats["requests"] += 1
+            entry = [now, self.token_estimate]
+            if self.tokens_per_minute:
+                self._window.append(entry)
+            return entry
+
+    def release(self, entry, tokens=None, headers=None, rate_limited=False, pause=None):
+        """Records how a request ended and adjusts concurrency and pauses accordingly."""
+        with self._condition:
+            now = time.monotonic()
+            self._in_flight -= 1
+            if tokens is not None:
+                entry[1] = tokens
+                # Smooth the per-request estimate towards what responses report
+                self.token_estimate = round(0.8 * self.token_estimate + 0.2 * tokens)
+
+            if rate_limited:
+                self.stats["rate_limited"] += 1
+                # All requests already in flight when the limit was hit will fail
+                # too; halve only once for them instead of once each
+                if entry[0] >= self._last_decrease:
+                    previous = int(self.limit)
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._last_decrease = now
+                    if int(self.limit) < previous:
+                        print(f"Rate limited, reducing concurrency to {int(self.limit)}")
+            elif tokens is not None:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+            if pause:
+                self._paused_until = max(self._paused_until, now + pause)
+            if headers:
+                self._apply_headers(headers, now)
+            self._condition.notify_all()
+
+    def _apply_headers(self, headers, now):
+        """Pauses until the reset time when the headers say the remaining budget is used up."""
+        for kind, needed in (("requests", 1), ("tokens", self.token_estimate)):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            try:
+                remaining = int(remaining)
+            except ValueError:
+                continue
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if remaining < needed and reset:
+                self._paused_until = max(self._paused_until, now + reset)
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff: a random delay up to base_delay * 2**attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, request, stats=None, max_tokens=None):
+        """Runs request() under the limiter, retrying transient failures.
+
+        request must return a raw response (e.g. from
+        client.chat.completions.with_raw_response.create) so its rate-limit
+        headers can be read; the parsed response is returned. The API counts
+        a request's max_tokens rather than its actual completion against the
+        token limit, so pass it to budget the same way. If stats is a dict,
+        the number of retries is stored in it. The last error is raised once
+        max_retries is exhausted or the error is not retryable.
+        """
+        attempt = 0
+        while True:
+            entry = self.acquire()
+            try:
+                raw = request()
+            except Exception as e:
+                headers = getattr(getattr(e, "response", None), "headers", None)
+                rate_limited = is_rate_limit(e)
+                delay = retry_after(headers)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                else:
+                    # Spread out the requests that were all told to come back at once
+                    delay += random.uniform(0, self.base_delay)
+                self.release(entry, headers=headers, rate_limited=rate_limited,
+                             pause=delay if rate_limited else None)
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    with self._condition:
+                        self.stats["failed"] += 1
+                    raise
+                attempt += 1
+                with self._condition:
+                    self.stats["retries"] += 1
+                if stats is not None:
+                    stats["retries"] = attempt
+                print(f"Retrying in {delay:.1f} s after {type(e).__name__} (attempt {attempt} of {self.max_retries})")
+                time.sleep(delay)
+                continue
+
+            response = raw.parse()
+            usage = getattr(response, "usage", None)
+            if usage is None:
+                tokens = self.token_estimate
+            elif max_tokens:
+                tokens = usage.prompt_tokens + max_tokens
+            else:
+                tokens = usage.total_tokens
+            self.release(entry, tokens=tokens, headers=raw.headers)
+            return response
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+# Every analysis run and each page's result, written as pages finish, so a
+# crashed or killed run can be resumed and past runs can be compared.
+DEFAULT_STORE = os.path.join(".autodoc_cache", "runs.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    finished REAL,
+    status TEXT NOT NULL,
+    options TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    source TEXT,
+    image_sha256 TEXT,
+    image_bytes INTEGER,
+    captured REAL,
+    description TEXT,
+    seconds REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cost REAL,
+    finished REAL NOT NULL,
+    PRIMARY KEY (run_id, filename)
+);
+CREATE INDEX IF NOT EXISTS pages_by_filename ON pages (filename, run_id);
+"""
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class RunStore:
+    """A SQLite database of runs and their pages, shared by the analysis threads.
+
+    Each page is committed as soon as it is recorded, so everything finished
+    before a crash survives it. A run stays "running" until finish_run().
+    """
+
+    def __init__(self, path=DEFAULT_STORE):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        # WAL lets the query commands read while a run is writing
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _execute(self, sql, parameters=()):
+        with self._lock, self._connection:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def start_run(self, options=None):
+        """Starts a new run with the options that shape its descriptions. Returns its id."""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO runs (started, status, options) VALUES (?, 'running', ?)",
+                (time.time(), json.dumps(options or {}, sort_keys=True)))
+            return cursor.lastrowid
+
+    def finish_run(self, run_id, status="done"):
+        self._execute("UPDATE runs SET finished = ?, status = ? WHERE id = ?", (time.time(), status, run_id))
+
+    def unfinished_run(self):
+        """The most recent run, as a dict, if it crashed, failed or is still going; otherwise None."""
+        rows = self._execute("SELECT * FROM runs ORDER BY id DESC LIMIT 1")
+        if not rows or rows[0]["status"] == "done":
+            return None
+        run = dict(rows[0])
+        run["options"] = json.loads(run["options"])
+        return run
+
+    def record_page(self, run_id, image_path, description, status="done", source="analyzed", **values):
+        """Stores one page's result with its screenshot's hash, size and capture time.
+
+        values may hold seconds, prompt_tokens, completion_tokens and cost.
+        """
+        try:
+            stat = os.stat(image_path)
+            image_sha256 = file_sha256(image_path)
+        except OSError:
+            stat = None
+            image_sha256 = None
+        self._execute(
+            "INSERT OR REPLACE INTO pages (run_id, filename, status, source, image_sha256, image_bytes, captured, "
+            "description, seconds, prompt_tokens, completion_tokens, cost, finished) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, os.path.basename(image_path), status, source, image_sha256,
+             stat.st_size if stat else None, stat.st_mtime if stat else None, description,
+             values.get("seconds"), values.get("prompt_tokens"), values.get("completion_tokens"),
+             values.get("cost"), time.time()))
+
+    def finished_pages(self, run_id):
+        """{filename: {"image_sha256": ..., "description": ...}} for the pages a run completed."""
+        rows = self._execute("SELECT filename, image_sha256, description FROM pages "
+                             "WHERE run_id = ? AND status = 'done'", (run_id,))
+        return {row["filename"]: {"image_sha256": row["image_sha256"], "description": row["description"]}
+                for row in rows}
+
+    def runs(self, limit=20):
+        return [dict(row) for row in self._execute(
+            "SELECT runs.id, runs.started, runs.finished, runs.status, COUNT(pages.filename) AS pages, "
+            "SUM(pages.status = 'error') AS errors, SUM(pages.cost) AS cost "
+            "FROM runs LEFT JOIN pages ON pages.run_id = runs.id "
+            "GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?", (limit,))]
+
+    def slowest_pages(self, limit=10, last_runs=None):
+        """Pages by their slowest analysis, over all runs or the last_runs most recent ones."""
+        where = ""
+        parameters = []
+        if last_runs:
+            where = "AND run_id > (SELECT COALESCE(MAX(id), 0) - ? FROM runs) "
+            parameters.append(last_runs)
+        return [dict(row) for row in self._execute(
+            "SELECT filename, MAX(seconds) AS max_seconds, AVG(seconds) AS avg_seconds, COUNT(*) AS runs "
+            f"FROM pages WHERE source = 'analyzed' AND seconds IS NOT NULL {where}"
+            "GROUP BY filename ORDER BY max_seconds DESC LIMIT ?", parameters + [limit])]
+
+    def changed_descriptions(self, run_id=None, since_run_id=None):
+        """Pages whose description in run_id differs from the one in since_run_id.
+
+        Defaults to the two most recent finished runs. Pages new in run_id
+        are included with an old description of None.
+        """
+        if run_id is None or since_run_id is None:
+            finished = [row["id"] for row in self._execute(
+                "SELECT id FROM runs WHERE status = 'done' ORDER BY id DESC LIMIT 2")]
+            if len(finished) < 2:
+                return []
+            run_id, since_run_id = run_id or finished[0], since_run_id or finished[1]
+        return [dict(row) for row in self._execute(
+            "SELECT new.filename, old.description AS old_description, new.description AS new_description "
+            "FROM pages AS new LEFT JOIN pages AS old ON old.filename = new.filename AND old.run_id = ? "
+            "WHERE new.run_id = ? AND new.status = 'done' "
+            "AND (old.description IS NULL OR old.description != new.description) "
+            "ORDER BY new.filename", (since_run_id, run_id))]
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) if timestamp else "-"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Query the history of analysis runs.")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="run store database (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    runs = commands.add_parser("runs", help="list recent runs")
+    runs.add_argument("--limit", type=int, default=20)
+    slowest = commands.add_parser("slowest", help="pages with the slowest analysis")
+    slowest.add_argument("--limit", type=int, default=10)
+    slowest.add_argument("--last-runs", type=int, help="only look at this many recent runs")
+    changed = commands.add_parser("changed", help="pages whose description changed between two runs")
+    changed.add_argument("--run", type=int, help="run to compare (default: the last finished run)")
+    changed.add_argument("--since", type=int, help="run to compare against (default: the one before)")
+    changed.add_argument("--show", action="store_true", help="print the old and new descriptions")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.store):
+        print(f"No run store at {args.store}")
+        return
+    store = RunStore(args.store)
+    if args.command == "runs":
+        for run in store.runs(args.limit):
+            print(f"Run {run['id']}: {run['status']}, started {format_time(run['started'])}, "
+                  f"finished {format_time(run['finished'])}, {run['pages']} pages, {run['errors'] or 0} errors, "
+                  f"${run['cost'] or 0:.4f}")
+    elif args.command == "slowest":
+        for page in store.slowest_pages(args.limit, args.last_runs):
+            print(f"{page['filename']}: {page['max_seconds']:.2f} s max, {page['avg_seconds']:.2f} s average "
+                  f"over {page['runs']} runs")
+    else:
+        changes = store.changed_descriptions(args.run, args.since)
+        for page in changes:
+            print(f"{page['filename']}: {'changed' if page['old_description'] is not None else 'new'}")
+            if args.show:
+                print(f"  before: {page['old_description']}\n  after:  {page['new_description']}")
+        print(f"{len(changes)} pages changed")
+    store.close()
+
+if __name__ == "__main__":
+    main()
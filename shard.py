@@ -0,0 +1,296 @@
+import os
+import re
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import capture_screenshots
+import analyze_and_document
+import description_cache
+import metrics
+import phash_index
+import rate_limiter
+import work_queue
+
+POLL_INTERVAL = 5
+BATCH_SIZE = 8
+
+def item_id(index, shot):
+    """Queue ids sort in shots.yml order, e.g. 00003-users."""
+    name = os.path.splitext(os.path.basename(shot["output"]))[0]
+    return f"{index:05d}-{re.sub(r'[^A-Za-z0-9_-]+', '_', name)}"
+
+def coordinate(shots, queue_dir=work_queue.DEFAULT_QUEUE_DIR):
+    """Splits the shots into one queue item per page and clears the screenshots directory."""
+    items = [{"id": item_id(index, shot), "index": index, "shot": shot} for index, shot in enumerate(shots)]
+    work_queue.create_queue(queue_dir, items)
+    capture_screenshots.clear_screenshots(capture_screenshots.screenshots_dir)
+
+class LeaseKeeper:
+    """Renews the leases on the items a worker holds from a background thread until stopped."""
+
+    def __init__(self, queue_dir, items, lease_seconds):
+        self.queue_dir = queue_dir
+        self.items = list(items)
+        self.interval = max(1.0, lease_seconds / 3)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for lost in work_queue.renew(self.queue_dir, self.items):
+                print(f"Lost the lease on {lost}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+def process_items(items, queue_dir, tabs=4, jobs=4, limiter=None, max_attempts=work_queue.MAX_ATTEMPTS,
+                  phash_threshold=None, previous_index=None, **analyze_options):
+    """Captures and analyzes a batch of claimed items, completing or failing each one.
+
+    Pages are described by analyze_and_document.describe_page with
+    analyze_options. With a phash_threshold, pages that look the same as in
+    previous_index reuse its description, and each item's result carries its
+    entry for the next run's index, which merge writes.
+    """
+    shots = [item["shot"] for item in items]
+    records = asyncio.run(capture_screenshots.capture_with_browser(shots, capture_screenshots.auth_file, tabs=tabs))
+    captured = {record["output"] for record in records}
+
+    to_analyze = []
+    for item in items:
+        if item["shot"]["output"] in captured:
+            to_analyze.append(item)
+        else:
+            state = work_queue.fail(queue_dir, item, "capture failed", max_attempts)
+            print(f"Capture of {item['shot']['url']} failed, moved to {state}")
+
+    def analyze(item):
+        index = {}
+        description = analyze_and_document.describe_page(item["shot"]["output"], phash_threshold, previous_index,
+                                                         index, limiter=limiter, **analyze_options)
+        return description, index
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for item, (description, index) in zip(to_analyze, executor.map(analyze, to_analyze)):
+            if analyze_and_document.is_error_description(description):
+                state = work_queue.fail(queue_dir, item, description, max_attempts)
+                print(f"{description} (moved to {state})")
+            else:
+                result = {"description": description}
+                if index:
+                    result["phash"] = next(iter(index.values()))
+                work_queue.complete(queue_dir, item, result)
+                print(f"Completed {item['id']}")
+
+def work(queue_dir=work_queue.DEFAULT_QUEUE_DIR, worker_id=None, tabs=4, jobs=4, batch_size=BATCH_SIZE,
+         lease_seconds=work_queue.LEASE_SECONDS, max_attempts=work_queue.MAX_ATTEMPTS,
+         poll_interval=POLL_INTERVAL, limiter=None, phash_threshold=None, **analyze_options):
+    """Claims batches of items until the queue is drained.
+
+    A worker keeps going while other workers still hold leases, so that
+    items whose lease expires (e.g. a crashed worker's) are picked up again.
+    phash_threshold and analyze_options are passed on to process_items.
+    Returns the number of items this worker processed.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    limiter = limiter or rate_limiter.RateLimiter(max_concurrency=jobs)
+    processed = 0
+    # Read once; merge writes the next run's index from the finished items
+    previous_index = (phash_index.load_index(capture_screenshots.screenshots_dir)
+                      if phash_threshold is not None else {})
+    print(f"Worker {worker_id} started on {queue_dir}")
+    while True:
+        work_queue.requeue_expired(queue_dir, lease_seconds, max_attempts)
+        items = work_queue.claim(queue_dir, worker_id, batch_size)
+        if not items:
+            counts = work_queue.counts(queue_dir)
+            if not counts["pending"] and not counts["leased"]:
+                break
+            time.sleep(poll_interval)
+            continue
+        print(f"Worker {worker_id} claimed {len(items)} items")
+        with LeaseKeeper(queue_dir, items, lease_seconds):
+            process_items(items, queue_dir, tabs=tabs, jobs=jobs, limiter=limiter, max_attempts=max_attempts,
+                          phash_threshold=phash_threshold, previous_index=previous_index, **analyze_options)
+        processed += len(items)
+
+    report_dir = os.path.join(queue_dir, "reports")
+    os.makedirs(report_dir, exist_ok=True)
+    metrics.write_report(os.path.join(report_dir, f"{worker_id}.json"))
+    print(f"Worker {worker_id} done after {processed} items")
+    return processed
+
+def merge(queue_dir=work_queue.DEFAULT_QUEUE_DIR, chapters_dir="chapters", pdf_jobs=None, allow_partial=False):
+    """Builds the chapters and PDF from the finished items.
+
+    Refuses to run while items are still pending or leased, unless
+    allow_partial is set. Returns the descriptions, or None if it didn't run.
+    """
+    counts = work_queue.counts(queue_dir)
+    print(f"Queue: {counts['done']} done, {counts['failed']} failed, "
+          f"{counts['pending']} pending, {counts['leased']} leased")
+    if (counts["pending"] or counts["leased"]) and not allow_partial:
+        print("Work is still in progress; wait for the workers or pass --allow-partial.")
+        return None
+    for item in work_queue.results(queue_dir, "failed"):
+        print(f"Failed after {item['attempts']} attempts: {item['shot']['url']} ({item.get('error')})")
+
+    descriptions = {}
+    index = {}
+    for item in sorted(work_queue.results(queue_dir), key=lambda item: item["index"]):
+        filename = os.path.basename(item["shot"]["output"])
+        descriptions[filename] = item["result"]["description"]
+        if "phash" in item["result"]:
+            index[filename] = item["result"]["phash"]
+    if index:
+        phash_index.save_index(capture_screenshots.screenshots_dir, index)
+
+    # Fold the workers' measurements into this run's report
+    report_dir = os.path.join(queue_dir, "reports")
+    if os.path.isdir(report_dir):
+        for name in sorted(os.listdir(report_dir)):
+            if name.endswith(".json"):
+                metrics.extend(work_queue.read_item(os.path.join(report_dir, name)).get("records", []))
+
+    # Chapters of pages that are queued but failed or unfinished stay; only
+    # those of pages no longer in the queue are removed
+    queued = {os.path.basename(item["shot"]["output"])
+              for state in work_queue.STATES for item in work_queue.results(queue_dir, state)}
+    analyze_and_document.create_markdown_report(descriptions, chapters_dir, expected=queued)
+    if descriptions:
+        analyze_and_document.create_pdf_report(chapters_dir, "user_guide.pdf", pdf_jobs=pdf_jobs)
+    return descriptions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Split a documentation run over several worker processes or hosts.")
+    parser.add_argument("--queue-dir", default=work_queue.DEFAULT_QUEUE_DIR,
+                        help="queue directory, on a filesystem shared by all workers (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    coordinator = commands.add_parser("coordinator", help="queue one work item per page in the shots file")
+    coordinator.add_argument("--shots", default=capture_screenshots.shots_file,
+                             help="pages to document (default: %(default)s)")
+    coordinator.add_argument("--force-login", action="store_true",
+                             help="log in again even if the session in auth.json is still valid")
+
+    worker_options = argparse.ArgumentParser(add_help=False)
+    worker_options.add_argument("--tabs", type=int, default=4, help="pages captured in parallel (default: 4)")
+    worker_options.add_argument("--jobs", "-j", type=int, default=4,
+                                help="screenshots analyzed concurrently (default: 4)")
+    worker_options.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                                help="items claimed at a time (default: %(default)s)")
+    worker_options.add_argument("--lease-seconds", type=float, default=work_queue.LEASE_SECONDS,
+                                help="requeue items whose worker hasn't renewed its lease for this long "
+                                     "(default: %(default)s)")
+    worker_options.add_argument("--max-attempts", type=int, default=work_queue.MAX_ATTEMPTS,
+                                help="give up on an item after this many failures (default: %(default)s)")
+    worker_options.add_argument("--tpm", type=int, help="tokens-per-minute budget for this worker's analysis")
+    analyze_and_document.add_analysis_arguments(worker_options, per_page=True)
+
+    worker = commands.add_parser("worker", parents=[worker_options],
+                                 help="claim and process items until the queue is drained")
+    worker.add_argument("--worker-id", help="name used in leases and reports (default: host-pid)")
+
+    merge_options = argparse.ArgumentParser(add_help=False)
+    merge_options.add_argument("--pdf-jobs", type=int,
+                               help="render chapters to PDF separately on this many processes")
+    merge_options.add_argument("--metrics-file", default=metrics.REPORT_FILE,
+                               help="combined run report (default: %(default)s)")
+    merge_options.add_argument("--prometheus-file", help="also write the run's metrics to this Prometheus textfile")
+
+    merge_command = commands.add_parser("merge", parents=[merge_options],
+                                        help="write the chapters and PDF from the finished items")
+    merge_command.add_argument("--allow-partial", action="store_true",
+                               help="merge even though some items are still pending or leased")
+
+    run = commands.add_parser("run", parents=[worker_options, merge_options],
+                              help="coordinate, start local worker processes and merge")
+    run.add_argument("--workers", type=int, default=2, help="worker processes to start (default: 2)")
+    run.add_argument("--shots", default=capture_screenshots.shots_file,
+                     help="pages to document (default: %(default)s)")
+    run.add_argument("--force-login", action="store_true",
+                     help="log in again even if the session in auth.json is still valid")
+    args = parser.parse_args(argv)
+    if getattr(args, "shared_layout", False):
+        # Each worker only sees the pages it claimed, so it can't tell the shared chrome apart
+        parser.error("--shared-layout needs every screenshot at once; use autodoc.py all or "
+                     "analyze_and_document.py instead")
+    if args.command == "worker" and args.purge_cache:
+        parser.error("--purge-cache would remove entries other workers are using; pass it to run, or purge "
+                     "before starting workers")
+    return args
+
+def worker_argv(args):
+    argv = ["--queue-dir", args.queue_dir, "worker", "--tabs", str(args.tabs), "--jobs", str(args.jobs),
+            "--batch-size", str(args.batch_size), "--lease-seconds", str(args.lease_seconds),
+            "--max-attempts", str(args.max_attempts)]
+    if args.tpm:
+        argv += ["--tpm", str(args.tpm)]
+    # The analysis options, so local workers describe pages as a single process would
+    argv += ["--cache-dir", args.cache_dir, "--cache-max-age", str(args.cache_max_age),
+             "--max-dimension", str(args.max_dimension), "--image-format", args.image_format,
+             "--image-quality", str(args.image_quality), "--phash-threshold", str(args.phash_threshold)]
+    if args.detail:
+        argv += ["--detail", args.detail]
+    for flag in ("no_cache", "no_preprocess", "phash"):
+        if getattr(args, flag):
+            argv.append("--" + flag.replace("_", "-"))
+    return argv
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+
+    if args.command in ("coordinator", "run"):
+        login_config = capture_screenshots.load_yaml(capture_screenshots.login_file)
+        capture_screenshots.ensure_auth(login_config[0], capture_screenshots.auth_file, force=args.force_login)
+        coordinate(capture_screenshots.load_yaml(args.shots), args.queue_dir)
+
+    if args.command == "worker":
+        # Only the coordinator logs in; workers use the session it saved, so they
+        # don't race each other to replace it
+        if not os.path.exists(capture_screenshots.auth_file):
+            print(f"No session in {capture_screenshots.auth_file}; run the coordinator first")
+            sys.exit(1)
+        options = analyze_and_document.analysis_options(args)
+        limiter = rate_limiter.RateLimiter(max_concurrency=args.jobs, tokens_per_minute=args.tpm)
+        work(args.queue_dir, args.worker_id, tabs=args.tabs, jobs=args.jobs, batch_size=args.batch_size,
+             lease_seconds=args.lease_seconds, max_attempts=args.max_attempts, limiter=limiter,
+             phash_threshold=options["phash_threshold"], cache_dir=options["cache_dir"],
+             cache_max_age=options["cache_max_age"], image_options=options["image_options"])
+
+    if args.command == "run":
+        if args.purge_cache:
+            description_cache.purge_cache(args.cache_dir)
+        # Split the tokens-per-minute budget between the workers
+        if args.tpm:
+            args.tpm = max(1, args.tpm // args.workers)
+        processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__)] + worker_argv(args))
+                     for _ in range(args.workers)]
+        for process in processes:
+            process.wait()
+
+    if args.command in ("merge", "run"):
+        if merge(args.queue_dir, pdf_jobs=args.pdf_jobs, allow_partial=getattr(args, "allow_partial", False)) is None:
+            sys.exit(1)
+        if args.command == "run" and not args.no_cache:
+            description_cache.prune_cache(args.cache_dir, int(args.cache_max_size * 1024 * 1024),
+                                          args.cache_max_age)
+        report = metrics.write_report(args.metrics_file, args.prometheus_file)
+        metrics.print_summary(report)
+
+    print(f"Done in {time.perf_counter() - start:.1f} s.")
+
+if __name__ == "__main__":
+    main()
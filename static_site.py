@@ -0,0 +1,397 @@
+import os
+import re
+import glob
+import html
+import json
+import contextlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import atomic_write
+import image_assets
+import markdown_to_html
+import metrics
+
+# A folder of small pages instead of one document holding every chapter: each
+# chapter is its own page, the navigation and stylesheet are shared, and search
+# runs in the browser against an index built here, so no server is needed.
+SITE_DIR = "site"
+SITE_TITLE = "User Guide"
+SEARCH_INDEX_FILE = "search-index.js"
+# Chapter pages are prefixed so none can collide with index.html (e.g. a chapter
+# named Index) or other files of the site
+PAGE_PREFIX = "chapter-"
+# The pages the last build wrote; only those are ever deleted from the site folder
+MANIFEST_FILE = ".site-manifest.json"
+
+# Title words count as this many occurrences in the body when ranking results
+TITLE_WEIGHT = 5
+MIN_TERM_LENGTH = 2
+SNIPPET_LENGTH = 160
+STOP_WORDS = frozenset(
+    "a an and are as at be but by can for from has have in is it its of on or that the their this "
+    "to was were which will with you your".split())
+
+TAG_PATTERN = re.compile(r'<[^>]+>')
+# Every chapter has the same headings (e.g. "Description"), which would open each
+# snippet and match every search, so they are left out of page text
+HEADING_PATTERN = re.compile(r'<h([1-6])\b[^>]*>.*?</h\1>', re.DOTALL)
+TERM_PATTERN = re.compile(r'\w+')
+
+SITE_CSS = markdown_to_html.SCREEN_CSS + """
+        .toc [aria-current="page"] {
+            background-color: #e9ecef;
+            font-weight: bold;
+        }
+        .toc h2 a {
+            color: #495057;
+            padding: 0;
+        }
+        #search {
+            width: 100%;
+            box-sizing: border-box;
+            padding: 6px 10px;
+            margin-bottom: 10px;
+            border: 1px solid #ced4da;
+            border-radius: 3px;
+        }
+        #search-results {
+            padding-left: 0;
+            list-style-type: none;
+        }
+        #search-results small {
+            display: block;
+            color: #6c757d;
+        }
+        .pager {
+            display: flex;
+            justify-content: space-between;
+        }
+        .chapters {
+            display: grid;
+            grid-template-columns: repeat(auto-fill, minmax(240px, 1fr));
+            gap: 20px;
+            padding-left: 0;
+            list-style-type: none;
+        }
+        .chapters img {
+            width: 100%;
+            height: auto;
+            margin: 0 0 5px;
+            border: 1px solid #dee2e6;
+        }
+        .chapters p {
+            margin: 5px 0;
+            font-size: 0.9em;
+            color: #6c757d;
+        }
+        """
+
+# Loads the index on the first keystroke, through a script tag because browsers
+# refuse fetch() for pages opened from disk. Every query word must match the
+# start of an indexed term; pages are ranked by term count weighted by rarity.
+SEARCH_JS = """(function () {
+    var input = document.getElementById("search");
+    var results = document.getElementById("search-results");
+    var index = null;
+    var terms = null;
+    var stopWords = %(stop_words)s;
+    var current = document.querySelector('.toc [aria-current="page"]');
+    if (current) {
+        current.scrollIntoView({block: "center"});
+    }
+
+    function load() {
+        if (index !== null) {
+            return;
+        }
+        index = false;
+        var script = document.createElement("script");
+        script.src = "%(index_file)s";
+        script.onload = function () {
+            index = window.SEARCH_INDEX;
+            terms = Object.keys(index.terms).sort();
+            search();
+        };
+        document.head.appendChild(script);
+    }
+
+    function firstAtLeast(word) {
+        var low = 0, high = terms.length;
+        while (low < high) {
+            var middle = (low + high) >> 1;
+            if (terms[middle] < word) {
+                low = middle + 1;
+            } else {
+                high = middle;
+            }
+        }
+        return low;
+    }
+
+    function scoresFor(word) {
+        var scores = {};
+        for (var i = firstAtLeast(word); i < terms.length && terms[i].lastIndexOf(word, 0) === 0; i++) {
+            var postings = index.terms[terms[i]];
+            var weight = Math.log(1 + index.docs.length / (postings.length / 2));
+            for (var j = 0; j < postings.length; j += 2) {
+                scores[postings[j]] = (scores[postings[j]] || 0) + postings[j + 1] * weight;
+            }
+        }
+        return scores;
+    }
+
+    function search() {
+        results.textContent = "";
+        var words = (input.value.toLowerCase().match(/[\\p{L}\\p{N}_]+/gu) || []).filter(function (word) {
+            return stopWords.indexOf(word) < 0;
+        });
+        if (!index || !words.length) {
+            return;
+        }
+        var total = null;
+        words.forEach(function (word) {
+            var scores = scoresFor(word);
+            if (total === null) {
+                total = scores;
+                return;
+            }
+            for (var doc in total) {
+                if (doc in scores) {
+                    total[doc] += scores[doc];
+                } else {
+                    delete total[doc];
+                }
+            }
+        });
+        var ranked = Object.keys(total).sort(function (a, b) { return total[b] - total[a]; });
+        ranked.slice(0, %(max_results)d).forEach(function (doc) {
+            var entry = index.docs[doc];
+            var item = document.createElement("li");
+            var link = document.createElement("a");
+            link.href = entry[1];
+            link.textContent = entry[0];
+            var snippet = document.createElement("small");
+            snippet.textContent = entry[2];
+            link.appendChild(snippet);
+            item.appendChild(link);
+            results.appendChild(item);
+        });
+        if (!ranked.length) {
+            results.textContent = "No results";
+        }
+    }
+
+    input.addEventListener("focus", load);
+    input.addEventListener("input", function () {
+        load();
+        search();
+    });
+    input.addEventListener("keydown", function (event) {
+        var first = results.querySelector("a");
+        if (event.key === "Enter" && first) {
+            window.location.href = first.href;
+        } else if (event.key === "Escape") {
+            input.value = "";
+            search();
+        }
+    });
+})();
+"""
+MAX_RESULTS = 20
+
+def page_file(title):
+    return f"{PAGE_PREFIX}{title}.html"
+
+def page_url(title):
+    return quote(page_file(title))
+
+def page_text(html_content):
+    """The visible text of an HTML fragment apart from its headings, with whitespace collapsed."""
+    text = TAG_PATTERN.sub(" ", HEADING_PATTERN.sub(" ", html_content))
+    return " ".join(html.unescape(text).split())
+
+def load_manifest(output_dir):
+    """The page names the last build wrote to output_dir."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def terms(text):
+    return [term for term in TERM_PATTERN.findall(text.lower())
+            if len(term) >= MIN_TERM_LENGTH and term not in STOP_WORDS]
+
+def snippet(text, length=SNIPPET_LENGTH):
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(" ", 1)[0] + "…"
+
+def build_search_index(pages):
+    """Builds the inverted index for [(title, url, text)].
+
+    Returns {"docs": [[title, url, snippet], ...], "terms": {term: postings}}
+    where postings is a flat [doc, count, doc, count, ...] list, which keeps
+    the JSON compact for guides with hundreds of pages.
+    """
+    docs = []
+    postings = {}
+    for doc, (title, url, text) in enumerate(pages):
+        counts = Counter(terms(text))
+        for term in terms(title):
+            counts[term] += TITLE_WEIGHT
+        for term, count in counts.items():
+            postings.setdefault(term, []).extend((doc, count))
+        docs.append([title, url, snippet(text)])
+    return {"docs": docs, "terms": dict(sorted(postings.items()))}
+
+def write_if_changed(path, content):
+    """Writes content to path unless it already holds it, so unchanged pages keep
+    their modification time. Returns True if the file was written."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+    atomic_write.write_text(path, content)
+    return True
+
+def navigation(titles, current=None):
+    items = []
+    for title in titles:
+        attributes = ' aria-current="page"' if title == current else ""
+        items.append(f'<li><a href="{page_url(title)}"{attributes}>{html.escape(title)}</a></li>')
+    return "\n            ".join(items)
+
+def site_page(page_title, body, nav_html, site_title=SITE_TITLE):
+    """A page of the site: the shared navigation with the search box, then body."""
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>{html.escape(page_title)}</title>
+    <link rel="stylesheet" href="site.css">
+    <script src="search.js" defer></script>
+</head>
+<body>
+    <nav class="toc">
+        <input id="search" type="search" placeholder="Search" autocomplete="off" aria-label="Search">
+        <ul id="search-results"></ul>
+        <h2><a href="index.html">{html.escape(site_title)}</a></h2>
+        <ul>
+            {nav_html}
+        </ul>
+    </nav>
+    <div class="content">
+        {body}
+    </div>
+</body>
+</html>"""
+
+def render_chapter(md_file, assets):
+    """Converts one chapter. Returns (title, HTML fragment, text, thumbnail or None)."""
+    title = os.path.splitext(os.path.basename(md_file))[0]
+    with open(md_file, "r", encoding="utf-8") as f, metrics.timer("markdown", os.path.basename(md_file)):
+        html_content = markdown_to_html.render_markdown(f.read())
+    with metrics.timer("images", os.path.basename(md_file)):
+        sources = image_assets.local_sources(html_content)
+        html_content = assets.screen_html(html_content)
+        thumbnail = assets.thumbnail(sources[0]) if sources else None
+    return title, html_content, page_text(html_content), thumbnail
+
+def chapter_card(title, text, thumbnail):
+    image = ""
+    if thumbnail:
+        path, (width, height) = thumbnail
+        image = (f'<img src="{html.escape(path)}" width="{width}" height="{height}" alt="" '
+                 f'loading="lazy" decoding="async">')
+    return (f'<li><a href="{page_url(title)}">{image}{html.escape(title)}</a>'
+            f'<p>{html.escape(snippet(text))}</p></li>')
+
+def build_site(input_dir="chapters", output_dir=SITE_DIR, site_title=SITE_TITLE, jobs=4, assets=None):
+    """Writes a static site for the markdown files in input_dir to output_dir.
+
+    Each chapter becomes its own page with the shared navigation and prev/next
+    links; index.html lists the chapters with lazily loaded thumbnails, and
+    search-index.js holds the search index. Image paths are resolved from the
+    directory containing output_dir, as for user_guide.html, and resized
+    copies are written to output_dir/assets. Pages that haven't changed are
+    not rewritten, and pages of removed chapters are deleted. Only pages a
+    previous build wrote (listed in MANIFEST_FILE) are ever deleted, so other
+    files in output_dir are left alone.
+    """
+    md_files = sorted(glob.glob(os.path.join(input_dir, '*.md')))
+    if not md_files:
+        print(f"No markdown files found in {input_dir}")
+        return False
+
+    os.makedirs(output_dir, exist_ok=True)
+    if assets is None:
+        assets = image_assets.ImageAssets(output_dir, source_dir=os.path.dirname(os.path.abspath(output_dir)))
+
+    # Threads are enough: Markdown conversion is quick and Pillow releases the
+    # GIL while it resizes and encodes, which is most of a first build
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = [executor.submit(render_chapter, md_file, assets) for md_file in md_files]
+        chapters = []
+        for md_file, future in zip(md_files, futures):
+            try:
+                chapters.append(future.result())
+            except Exception as e:
+                print(f"Error processing {md_file}: {str(e)}")
+
+    titles = [title for title, _, _, _ in chapters]
+    written = 0
+    for position, (title, html_content, _, _) in enumerate(chapters):
+        pager = []
+        if position > 0:
+            previous = titles[position - 1]
+            pager.append(f'<a href="{page_url(previous)}" rel="prev">&larr; {html.escape(previous)}</a>')
+        else:
+            pager.append('<span></span>')
+        if position + 1 < len(titles):
+            following = titles[position + 1]
+            pager.append(f'<a href="{page_url(following)}" rel="next">{html.escape(following)} &rarr;</a>')
+        body = f"""<section>
+            <h1>{html.escape(title)}</h1>
+            <hr>
+            {html_content}
+        </section>
+        <nav class="pager">{''.join(pager)}</nav>"""
+        page = site_page(f"{title} - {site_title}", body, navigation(titles, title), site_title)
+        written += write_if_changed(os.path.join(output_dir, page_file(title)), page)
+
+    cards = "\n            ".join(chapter_card(title, text, thumbnail) for title, _, text, thumbnail in chapters)
+    body = f"""<section>
+            <h1>{html.escape(site_title)}</h1>
+            <ul class="chapters">
+            {cards}
+            </ul>
+        </section>"""
+    written += write_if_changed(os.path.join(output_dir, "index.html"),
+                                site_page(site_title, body, navigation(titles), site_title))
+
+    index = build_search_index([(title, page_url(title), text) for title, _, text, _ in chapters])
+    index_js = f"window.SEARCH_INDEX = {json.dumps(index, ensure_ascii=False, separators=(',', ':'))};\n"
+    write_if_changed(os.path.join(output_dir, SEARCH_INDEX_FILE), index_js)
+    write_if_changed(os.path.join(output_dir, "search.js"),
+                     SEARCH_JS % {"index_file": SEARCH_INDEX_FILE, "max_results": MAX_RESULTS,
+                                  "stop_words": json.dumps(sorted(STOP_WORDS))})
+    write_if_changed(os.path.join(output_dir, "site.css"), SITE_CSS)
+
+    # Pages of chapters that no longer exist
+    pages = sorted({page_file(title) for title in titles} | {"index.html"})
+    for name in load_manifest(output_dir):
+        if name not in pages and os.path.basename(name) == name:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(output_dir, name))
+    write_if_changed(os.path.join(output_dir, MANIFEST_FILE), json.dumps(pages, indent=2))
+    assets.prune()
+
+    print(f"Wrote site with {len(chapters)} chapters to {output_dir} ({written} pages changed, "
+          f"search index {len(index['terms'])} terms, {len(index_js) / 1024:.0f} KB)")
+    return True
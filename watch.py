@@ -0,0 +1,349 @@
+import os
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import atomic_write
+import capture_screenshots
+import analyze_and_document
+import description_cache
+import layout_regions
+import markdown_to_html
+import metrics
+import phash_index
+import rate_limiter
+
+POLL_INTERVAL = 1.0
+# A file must look the same for this long before it's picked up, so half-written
+# screenshots and editor save sequences are not processed
+SETTLE_SECONDS = 0.5
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+def snapshot(paths):
+    """{path: (mtime_ns, size)} for the paths that exist."""
+    state = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        state[path] = (stat.st_mtime_ns, stat.st_size)
+    return state
+
+def list_files(directory, extensions):
+    try:
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                if name.endswith(extensions)]
+    except FileNotFoundError:
+        return []
+
+def diff(old, new):
+    """Returns (changed or added paths, removed paths) between two snapshots."""
+    changed = [path for path, state in new.items() if old.get(path) != state]
+    removed = [path for path in old if path not in new]
+    return changed, removed
+
+async def settled(list_paths):
+    """Snapshots the paths from list_paths() once two snapshots SETTLE_SECONDS apart agree."""
+    state = snapshot(list_paths())
+    while True:
+        await asyncio.sleep(SETTLE_SECONDS)
+        again = snapshot(list_paths())
+        if again == state:
+            return state
+        state = again
+
+def is_stale(source, target):
+    """True if target is missing or older than source."""
+    try:
+        return os.path.getmtime(target) < os.path.getmtime(source)
+    except OSError:
+        return True
+
+class Watcher:
+    """Rebuilds the guide as its inputs change, keeping everything expensive resident.
+
+    One Chromium instance with the logged-in context, the Vision API client
+    and rate limiter, the analysis threads, WeasyPrint and the PDF render
+    processes stay up between rebuilds, so a one-page edit costs one
+    capture, one analysis and one chapter render. Each stage runs only for
+    the pages affected:
+
+      login.yml changed    -> log in again, recapture every page
+      shots.yml changed    -> capture added or edited shots, drop removed ones
+      screenshots/ changed -> analyze those screenshots, rewrite their chapters
+      chapters/ changed    -> render user_guide.html and user_guide.pdf
+                              (also after a new screenshot, which the PDF embeds)
+
+    Screenshots are analyzed with the same options as analyze_and_document.py:
+    analyze_options go to analyze_screenshot, phash_threshold reuses the
+    descriptions of unchanged-looking pages, and with shared_layout the
+    chrome shared by the screenshots is described once and cropped from the
+    pages. When the shared chrome changes, every page is analyzed again.
+    """
+
+    def __init__(self, shots_path=capture_screenshots.shots_file, chapters_dir="chapters", tabs=4, jobs=4,
+                 pdf_jobs=2, limiter=None, metrics_file=metrics.REPORT_FILE, phash_threshold=None,
+                 shared_layout=False, **analyze_options):
+        self.shots_path = shots_path
+        self.screenshots_dir = capture_screenshots.screenshots_dir
+        self.chapters_dir = chapters_dir
+        self.tabs = tabs
+        self.metrics_file = metrics_file
+        self.analyze_options = dict(analyze_options, limiter=limiter or rate_limiter.RateLimiter(jobs))
+        self.phash_threshold = phash_threshold
+        self.phash_index = phash_index.load_index(self.screenshots_dir) if phash_threshold is not None else {}
+        self.shared_layout = shared_layout
+        self.layout = None
+        self.analysis_pool = ThreadPoolExecutor(max_workers=max(1, jobs))
+        # Forked now, before any threads start, and reused for every render
+        self.render_pool = ProcessPoolExecutor(max_workers=max(1, pdf_jobs), initializer=metrics.reset)
+        self.render_pool.submit(int).result()
+        self.assets = markdown_to_html.make_assets("user_guide.pdf")
+        self.context = None
+        self.shots = {}
+        self.state = {}
+        # Snapshot of the files when the last rebuild failed, if it did
+        self.failed = None
+
+    def input_files(self):
+        return [capture_screenshots.login_file, self.shots_path]
+
+    def screenshot_files(self):
+        return [path for path in list_files(self.screenshots_dir, IMAGE_EXTENSIONS)
+                if os.path.basename(path) != layout_regions.LAYOUT_IMAGE]
+
+    def chapter_files(self):
+        return list_files(self.chapters_dir, (".md",))
+
+    async def log_in(self, browser, force=False):
+        login_config = capture_screenshots.load_yaml(capture_screenshots.login_file)[0]
+        # ensure_auth runs its own event loop, so give it a thread
+        await asyncio.to_thread(capture_screenshots.ensure_auth, login_config, capture_screenshots.auth_file,
+                                force)
+        if self.context is not None:
+            await self.context.close()
+        self.context = await capture_screenshots.new_auth_context(browser, capture_screenshots.auth_file)
+
+    def load_shots(self):
+        return {shot["output"]: shot for shot in capture_screenshots.load_yaml(self.shots_path) or []}
+
+    async def capture(self, shots):
+        if not shots:
+            return
+        print(f"Capturing {len(shots)} pages")
+        await capture_screenshots.capture_in_context(self.context, shots, tabs=self.tabs)
+
+    def remove_pages(self, image_paths, manifest):
+        for image_path in image_paths:
+            chapter_file = analyze_and_document.chapter_path(os.path.basename(image_path), self.chapters_dir)
+            manifest.pop(os.path.basename(chapter_file), None)
+            if os.path.exists(chapter_file):
+                os.remove(chapter_file)
+                print(f"Removed chapter: {chapter_file}")
+
+    def update_layout(self, to_analyze):
+        """With shared_layout, finds the chrome shared by the current screenshots. If it
+        changed, the Common Layout image is rewritten and, as every page is now
+        cropped differently, all screenshots are analyzed again. Returns the
+        screenshots to analyze."""
+        layout_path = os.path.join(self.screenshots_dir, layout_regions.LAYOUT_IMAGE)
+        screenshots = self.screenshot_files()
+        layout = layout_regions.detect_layout(screenshots) if self.shared_layout and screenshots else None
+        if layout == self.layout:
+            return to_analyze
+        self.layout = layout
+        if layout is None:
+            print("No layout shared by the screenshots found, sending whole pages")
+            self.analyze_options.pop("crop", None)
+            return screenshots
+        layout_regions.write_layout_image(screenshots[0], layout, layout_path)
+        left, top, right, bottom = layout
+        print(f"Found shared layout: header {top}px, footer {bottom}px, left {left}px, right {right}px; "
+              f"analyzing every page with it")
+        self.analyze_options["crop"] = layout
+        return [layout_path] + screenshots
+
+    async def analyze(self, image_paths, manifest):
+        """Describes screenshots on the analysis threads and writes their chapters."""
+        if not image_paths:
+            return
+        print(f"Analyzing {len(image_paths)} screenshots")
+        loop = asyncio.get_running_loop()
+        descriptions = await asyncio.gather(*(
+            loop.run_in_executor(self.analysis_pool,
+                                 lambda image_path=image_path: analyze_and_document.describe_page(
+                                     image_path, self.phash_threshold, self.phash_index, self.phash_index,
+                                     **self.analyze_options))
+            for image_path in image_paths))
+        previous_manifest = dict(manifest)
+        os.makedirs(self.chapters_dir, exist_ok=True)
+        for image_path, description in zip(image_paths, descriptions):
+            analyze_and_document.write_chapter(os.path.basename(image_path), description, self.chapters_dir,
+                                               manifest, previous_manifest)
+
+    def render(self):
+        # Kept across rebuilds so unchanged screenshots aren't hashed again
+        markdown_to_html.convert_to_single_html(self.chapters_dir, "user_guide.html", assets=self.assets)
+        markdown_to_html.convert_to_pdf_by_chapter(self.chapters_dir, "user_guide.pdf", executor=self.render_pool,
+                                                   assets=self.assets)
+
+    def pending_at_start(self):
+        """Work left over from before the watcher started: shots never captured,
+        screenshots newer than their chapter, chapters newer than the PDF."""
+        to_capture = [shot for output, shot in self.shots.items() if not os.path.exists(output)]
+        to_analyze = [path for path in self.screenshot_files()
+                      if is_stale(path, analyze_and_document.chapter_path(os.path.basename(path),
+                                                                           self.chapters_dir))]
+        render = any(is_stale(path, "user_guide.pdf") for path in self.chapter_files())
+        return to_capture, to_analyze, render
+
+    async def rebuild(self, browser, to_capture=(), to_analyze=(), render=False):
+        """Runs the stages affected by what changed since the last rebuild. Returns True if anything ran."""
+        start = time.perf_counter()
+        manifest = analyze_and_document.load_manifest(self.chapters_dir)
+        to_capture = list(to_capture)
+        to_analyze = list(to_analyze)
+
+        inputs = await settled(self.input_files)
+        changed, _ = diff(self.state.get("inputs", inputs), inputs)
+        self.state["inputs"] = inputs
+        if capture_screenshots.login_file in changed:
+            print("login.yml changed, logging in again")
+            await self.log_in(browser, force=True)
+            to_capture = list(self.load_shots().values())
+        if self.shots_path in changed:
+            shots = self.load_shots()
+            edited = [shot for output, shot in shots.items() if self.shots.get(output) != shot]
+            removed = [output for output in self.shots if output not in shots]
+            print(f"{self.shots_path} changed: {len(edited)} added or edited, {len(removed)} removed")
+            for output in removed:
+                if os.path.exists(output):
+                    os.remove(output)
+            to_capture += [shot for shot in edited if shot not in to_capture]
+            self.shots = shots
+        await self.capture(to_capture)
+
+        screenshots = await settled(self.screenshot_files)
+        changed, removed = diff(self.state.get("screenshots", screenshots), screenshots)
+        self.state["screenshots"] = screenshots
+        to_analyze += [path for path in changed if path not in to_analyze]
+        if self.shared_layout and (to_analyze or removed):
+            to_analyze = await asyncio.to_thread(self.update_layout, to_analyze)
+            layout_chapter = analyze_and_document.chapter_path(layout_regions.LAYOUT_IMAGE, self.chapters_dir)
+            if self.layout is None and os.path.exists(layout_chapter):
+                removed.append(os.path.join(self.screenshots_dir, layout_regions.LAYOUT_IMAGE))
+        self.remove_pages(removed, manifest)
+        await self.analyze(to_analyze, manifest)
+        if self.phash_threshold is not None and (to_analyze or removed):
+            for path in removed:
+                self.phash_index.pop(os.path.basename(path), None)
+            phash_index.save_index(self.screenshots_dir, self.phash_index)
+        if to_analyze or removed:
+            manifest_file = os.path.join(self.chapters_dir, analyze_and_document.MANIFEST_FILE)
+            atomic_write.write_json(manifest_file, manifest, indent=2, sort_keys=True)
+
+        chapters = await settled(self.chapter_files)
+        changed, removed = diff(self.state.get("chapters", chapters), chapters)
+        self.state["chapters"] = chapters
+        if (render or to_analyze or changed or removed) and chapters:
+            await asyncio.to_thread(self.render)
+
+        ran = bool(to_capture or to_analyze or render or changed or removed)
+        if ran:
+            metrics.write_report(self.metrics_file)
+            metrics.reset()
+            print(f"Rebuilt in {time.perf_counter() - start:.1f} s. Watching for changes...")
+        return ran
+
+    async def safe_rebuild(self, browser, *args):
+        """Runs rebuild, but a failure is logged instead of stopping the watcher. The
+        state from before the rebuild is kept, so the same changes are picked up
+        again once the files change next. Returns True if anything ran."""
+        state = dict(self.state)
+        shots = self.shots
+        try:
+            ran = await self.rebuild(browser, *args)
+        except Exception as e:
+            print(f"Rebuild failed: {type(e).__name__}: {e}")
+            self.state = state
+            self.shots = shots
+            self.failed = {
+                "inputs": snapshot(self.input_files()),
+                "screenshots": snapshot(self.screenshot_files()),
+                "chapters": snapshot(self.chapter_files()),
+            }
+            print("Watching for changes...")
+            return True
+        self.failed = None
+        return ran
+
+    async def run(self, interval=POLL_INTERVAL):
+        from playwright.async_api import async_playwright
+
+        async with async_playwright() as playwright:
+            browser = await playwright.chromium.launch()
+            try:
+                await self.log_in(browser)
+                self.shots = self.load_shots()
+                self.state["inputs"] = snapshot(self.input_files())
+                self.state["screenshots"] = snapshot(self.screenshot_files())
+                self.state["chapters"] = snapshot(self.chapter_files())
+                to_capture, to_analyze, render = self.pending_at_start()
+                if self.shared_layout:
+                    # Find the current layout; pages are analyzed again only if it changed
+                    to_analyze = await asyncio.to_thread(self.update_layout, to_analyze)
+                if not await self.safe_rebuild(browser, to_capture, to_analyze, render):
+                    print("Up to date. Watching for changes...")
+                while True:
+                    await asyncio.sleep(interval)
+                    current = {
+                        "inputs": snapshot(self.input_files()),
+                        "screenshots": snapshot(self.screenshot_files()),
+                        "chapters": snapshot(self.chapter_files()),
+                    }
+                    if current == self.failed:
+                        continue  # retried once something changes again
+                    if any(current[name] != self.state[name] for name in current):
+                        await self.safe_rebuild(browser)
+            finally:
+                await browser.close()
+                self.analysis_pool.shutdown()
+                self.render_pool.shutdown()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Keep the user guide up to date while shots.yml, login.yml, "
+                                                 "screenshots or chapters change.")
+    parser.add_argument("--shots", default=capture_screenshots.shots_file,
+                        help="pages to capture (default: %(default)s)")
+    parser.add_argument("--tabs", type=int, default=4, help="pages captured in parallel (default: 4)")
+    parser.add_argument("--jobs", "-j", type=int, default=4,
+                        help="screenshots analyzed concurrently (default: 4)")
+    parser.add_argument("--pdf-jobs", type=int, default=2,
+                        help="processes kept ready to render chapter PDFs (default: %(default)s)")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                        help="seconds between checks for changes (default: %(default)s)")
+    parser.add_argument("--tpm", type=int, help="tokens-per-minute budget for screenshot analysis")
+    parser.add_argument("--metrics-file", default=metrics.REPORT_FILE,
+                        help="run report of the last rebuild (default: %(default)s)")
+    analyze_and_document.add_analysis_arguments(parser, per_page=True)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.purge_cache:
+        description_cache.purge_cache(args.cache_dir)
+    options = analyze_and_document.analysis_options(args)
+    limiter = rate_limiter.RateLimiter(max_concurrency=args.jobs, tokens_per_minute=args.tpm)
+    watcher = Watcher(args.shots, tabs=args.tabs, jobs=args.jobs, pdf_jobs=args.pdf_jobs, limiter=limiter,
+                      metrics_file=args.metrics_file, phash_threshold=options["phash_threshold"],
+                      shared_layout=options["shared_layout"], cache_dir=options["cache_dir"],
+                      cache_max_age=options["cache_max_age"], image_options=options["image_options"])
+    try:
+        asyncio.run(watcher.run(args.interval))
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import shutil
+import socket
+import contextlib
+
+import atomic_write
+
+# A work queue made of JSON files, shared by workers on one host or on several
+# hosts with a common filesystem. An item moves between directories by
+# os.rename, which is atomic, so exactly one worker wins each claim:
+#
+#   pending/ --claim--> leased/ --complete--> done/
+#      ^                  |
+#      +--fail/expire-----+--(too many attempts)--> failed/
+#
+# A lease is held as long as the leased file's mtime is refreshed (renew).
+
+DEFAULT_QUEUE_DIR = ".autodoc_queue"
+LEASE_SECONDS = 900
+MAX_ATTEMPTS = 3
+STATES = ("pending", "leased", "done", "failed")
+# Unique per process across hosts, for temporary file names
+PROCESS_TAG = f"{socket.gethostname()}.{os.getpid()}"
+
+def state_dir(queue_dir, state):
+    return os.path.join(queue_dir, state)
+
+def item_names(queue_dir, state):
+    try:
+        return sorted(name for name in os.listdir(state_dir(queue_dir, state)) if name.endswith(".json"))
+    except FileNotFoundError:
+        return []
+
+def read_item(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_item(path, item):
+    """Writes an item next to its final path first; the .tmp name keeps it out of listings."""
+    atomic_write.write_json(path, item, indent=2)
+
+def create_queue(queue_dir, items):
+    """Replaces the queue in queue_dir with the given items, all pending.
+
+    Each item is a dict with at least an "id" that is unique and safe as a
+    file name; ids are claimed in sorted order.
+    """
+    if os.path.exists(queue_dir):
+        shutil.rmtree(queue_dir)
+    for state in STATES:
+        os.makedirs(state_dir(queue_dir, state))
+    for item in items:
+        item = dict(item, attempts=0)
+        write_item(os.path.join(state_dir(queue_dir, "pending"), f"{item['id']}.json"), item)
+    print(f"Queued {len(items)} items in {queue_dir}")
+
+def claim(queue_dir, worker_id, count=1):
+    """Leases up to count pending items for worker_id. Returns the claimed items."""
+    claimed = []
+    for name in item_names(queue_dir, "pending"):
+        if len(claimed) >= count:
+            break
+        pending_path = os.path.join(state_dir(queue_dir, "pending"), name)
+        leased_path = os.path.join(state_dir(queue_dir, "leased"), name)
+        if os.path.exists(os.path.join(state_dir(queue_dir, "done"), name)):
+            # Finished by a worker whose lease had already expired
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(pending_path)
+            continue
+        try:
+            os.rename(pending_path, leased_path)
+        except FileNotFoundError:
+            continue  # another worker got there first
+        # rename keeps the mtime from when the item was queued; start the lease now
+        # so requeue_expired doesn't take it back before write_item replaces the file
+        try:
+            os.utime(leased_path)
+            item = read_item(leased_path)
+        except FileNotFoundError:
+            continue  # requeue_expired took it back in between; not claimed
+        item.update(worker=worker_id, leased_at=time.time())
+        write_item(leased_path, item)
+        claimed.append(item)
+    return claimed
+
+def renew(queue_dir, items):
+    """Extends the leases on items. Returns the ids whose lease was lost."""
+    lost = []
+    for item in items:
+        try:
+            os.utime(os.path.join(state_dir(queue_dir, "leased"), f"{item['id']}.json"))
+        except FileNotFoundError:
+            lost.append(item["id"])
+    return lost
+
+def complete(queue_dir, item, result):
+    """Stores an item's result in done/ and releases its lease."""
+    name = f"{item['id']}.json"
+    write_item(os.path.join(state_dir(queue_dir, "done"), name), dict(item, result=result, finished_at=time.time()))
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(state_dir(queue_dir, "leased"), name))
+
+def fail(queue_dir, item, error, max_attempts=MAX_ATTEMPTS):
+    """Puts a failed item back in pending, or in failed/ after max_attempts tries."""
+    name = f"{item['id']}.json"
+    item = dict(item, attempts=item.get("attempts", 0) + 1, error=str(error))
+    state = "failed" if item["attempts"] >= max_attempts else "pending"
+    write_item(os.path.join(state_dir(queue_dir, state), name), item)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(state_dir(queue_dir, "leased"), name))
+    return state
+
+def requeue_expired(queue_dir, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """Returns items whose lease hasn't been renewed for lease_seconds to pending
+    (e.g. after a worker crashed). Returns the number of items requeued."""
+    requeued = 0
+    cutoff = time.time() - lease_seconds
+    for name in item_names(queue_dir, "leased"):
+        leased_path = os.path.join(state_dir(queue_dir, "leased"), name)
+        try:
+            if os.path.getmtime(leased_path) >= cutoff:
+                continue
+            # Move it aside first so only one worker requeues it
+            expired_path = f"{leased_path}.{PROCESS_TAG}.expired"
+            os.rename(leased_path, expired_path)
+        except FileNotFoundError:
+            continue
+        item = read_item(expired_path)
+        print(f"Lease on {item['id']} held by {item.get('worker')} expired, requeueing")
+        item = dict(item, attempts=item.get("attempts", 0) + 1, error="lease expired")
+        state = "failed" if item["attempts"] >= max_attempts else "pending"
+        write_item(os.path.join(state_dir(queue_dir, state), name), item)
+        os.remove(expired_path)
+        requeued += 1
+    return requeued
+
+def counts(queue_dir):
+    return {state: len(item_names(queue_dir, state)) for state in STATES}
+
+def results(queue_dir, state="done"):
+    """Returns the items in a state directory, sorted by id."""
+    items = []
+    for name in item_names(queue_dir, state):
+        with contextlib.suppress(FileNotFoundError):
+            items.append(read_item(os.path.join(state_dir(queue_dir, state), name)))
+    return items